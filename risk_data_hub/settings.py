@@ -407,6 +407,38 @@ LOGGING = {
 APP_DEFAULT_REGION = 'Europe'
 COUNTRY_ADMIN_USER_GROUP = 'country_admin'
 
+# Risk data extraction backend:
+# 'wfs' reads SQL views through GeoServer, 'postgis' queries datastore directly,
+# 'cube' slices precomputed per-analysis values (rebuilt by imports)
+RISKS_EXTRACTION_BACKEND = os.getenv('RISKS_EXTRACTION_BACKEND', 'wfs')
+# seconds after which cached WFS capabilities are reloaded
+RISKS_WFS_CAPABILITIES_TTL = int(os.getenv('RISKS_WFS_CAPABILITIES_TTL', 300))
+# max number of concurrent GeoServer requests issued by a single process
+RISKS_FETCH_WORKERS = int(os.getenv('RISKS_FETCH_WORKERS', 8))
+# cache alias used to share risk analysis cubes between processes
+RISKS_CUBE_CACHE = 'default'
+# max number of risk analysis cubes kept in memory of each process
+RISKS_CUBE_LOCAL_SIZE = int(os.getenv('RISKS_CUBE_LOCAL_SIZE', 32))
+# cache alias keeping data versions, bumped by imports and model changes,
+# and seconds for which data responses are cached (they are invalidated
+# on import). The cache must be shared by web and celery processes,
+# per-process (locmem) cache is reported by system checks
+RISKS_VERSION_CACHE = 'default'
+RISKS_DATA_CACHE_TTL = int(os.getenv('RISKS_DATA_CACHE_TTL', 86400))
+# seconds between checks whether in-memory administrative divisions
+# tree is outdated
+RISKS_ADM_TREE_CHECK_INTERVAL = int(os.getenv('RISKS_ADM_TREE_CHECK_INTERVAL', 5))
+# max number of ranked matches returned by administrative division lookup,
+# 0 returns all matches
+RISKS_ADM_LOOKUP_LIMIT = int(os.getenv('RISKS_ADM_LOOKUP_LIMIT', 50))
+# simplification tolerances (degrees) of prebuilt administrative division
+# geometries, 0 is original geometry; picked by geometry view `zoom` param
+RISKS_GEOMETRY_TOLERANCES = tuple(float(t) for t in os.getenv('RISKS_GEOMETRY_TOLERANCES', '0,0.001,0.005,0.02').split(','))
+# cache alias keeping TopoJSON of administrative divisions
+RISKS_TOPOLOGY_CACHE = 'default'
+# directory of disk cache for administrative divisions vector tiles
+RISKS_TILE_CACHE_DIR = os.getenv('RISKS_TILE_CACHE_DIR', os.path.join(LOCAL_ROOT, 'tile_cache'))
+
 #EMAIL SETTINGS
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtpconnector.jrc.ec.europa.eu'
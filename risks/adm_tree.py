@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import copy
+import logging
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+
+from risks.versioning import data_versions
+
+log = logging.getLogger(__name__)
+
+
+def normalize_name(value):
+    """
+    Returns lowercase name without accents, for name lookups
+    """
+    value = unicodedata.normalize('NFKD', unicode(value))
+    return u''.join(c for c in value if not unicodedata.combining(c)).lower()
+
+
+def trigrams(value):
+    return set(value[idx:idx + 3] for idx in range(len(value) - 2))
+
+
+class AdmDivisionTree(object):
+    """
+    Process-level, read-only index of administrative divisions tree.
+
+    Keeps code -> node, parent pointers, children and region membership
+    for all divisions, loaded lazily with two queries. The index is
+    reloaded when administrative divisions data version changes (it's
+    bumped by `populateau` and `rebuild_tree` commands), checked at most
+    every `check_interval` seconds.
+
+    Lookups return fresh :py:class:`risks.models.AdministrativeDivision`
+    copies (without geometry loaded), with parents already set, so they
+    can be used by views as any other instance.
+
+    Division names are indexed by trigrams for accent- and
+    case-insensitive search.
+    """
+
+    def __init__(self, check_interval=5):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._checked = 0
+
+    def _load(self):
+        from risks.models import AdministrativeDivision, RegionAdministrativeDivisionAssociation
+
+        nodes = {}
+        by_id = {}
+        children = {}
+        for adm in AdministrativeDivision.objects.order_by('tree_id', 'lft'):
+            nodes[adm.code] = adm
+            by_id[adm.id] = adm
+            children.setdefault(adm.parent_id, []).append(adm.id)
+
+        regions = {}
+        for adm_id, region_id in RegionAdministrativeDivisionAssociation.objects\
+                                                                       .values_list('administrativedivision_id', 'region_id'):
+            regions.setdefault(adm_id, set()).add(region_id)
+
+        names = {}
+        grams = {}
+        for adm_id, adm in by_id.iteritems():
+            name = names[adm_id] = normalize_name(adm.name)
+            for gram in trigrams(name):
+                grams.setdefault(gram, set()).add(adm_id)
+
+        log.info("loaded administrative divisions tree: %s nodes", len(nodes))
+        return {'nodes': nodes, 'by_id': by_id, 'children': children, 'regions': regions,
+                'names': names, 'trigrams': grams,
+                'max_level': max([adm.level for adm in by_id.itervalues()] or [None])}
+
+    def get_data(self):
+        now = time.time()
+        if self._data is not None and now - self._checked < self.check_interval:
+            return self._data
+        with self._lock:
+            version = data_versions.get_versions([data_versions.ADM_SCOPE])[0]
+            if self._data is None or version != self._version:
+                self._data = self._load()
+                self._version = version
+            self._checked = now
+            return self._data
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+
+    @staticmethod
+    def _copy(adm):
+        # views set request context (app, region) on instances,
+        # so shared nodes are never handed out
+        out = adm.__class__.__new__(adm.__class__)
+        out.__dict__.update(adm.__dict__)
+        out._state = copy.copy(adm._state)
+        return out
+
+    def _chain(self, data, adm):
+        chain = []
+        while adm is not None:
+            chain.append(adm)
+            adm = data['by_id'].get(adm.parent_id)
+        chain.reverse()
+
+        out = []
+        parent = None
+        for adm in chain:
+            adm = self._copy(adm)
+            adm.parent = parent
+            out.append(adm)
+            parent = adm
+        return out
+
+    def get(self, code):
+        """
+        Returns division for code, or None
+        """
+        chain = self.get_chain(code)
+        return chain[-1] if chain else None
+
+    def get_chain(self, code):
+        """
+        Returns list of divisions from root to the one with given code,
+        or None if code is not known
+        """
+        data = self.get_data()
+        adm = data['nodes'].get(code)
+        if adm is None:
+            return
+        return self._chain(data, adm)
+
+    def get_parents_chain(self, code):
+        chain = self.get_chain(code)
+        return chain[:-1] if chain else []
+
+    def get_children(self, code):
+        """
+        Returns children of division with given code, in tree order
+        """
+        data = self.get_data()
+        adm = data['nodes'].get(code)
+        if adm is None:
+            return []
+        parent = self._chain(data, adm)[-1]
+        out = []
+        for child_id in data['children'].get(adm.id, ()):
+            child = self._copy(data['by_id'][child_id])
+            child.parent = parent
+            out.append(child)
+        return out
+
+    def get_level(self, code):
+        adm = self.get_data()['nodes'].get(code)
+        return adm.level if adm is not None else None
+
+    def get_max_level(self):
+        """
+        Returns level of the deepest divisions, None if there are none
+        """
+        return self.get_data()['max_level']
+
+    def get_region_ids(self, code):
+        """
+        Returns ids of regions division with given code belongs to
+        """
+        data = self.get_data()
+        adm = data['nodes'].get(code)
+        if adm is None:
+            return set()
+        return set(data['regions'].get(adm.id, ()))
+
+    def get_level_nodes(self, level, region_id=None):
+        """
+        Returns (id, code, name) tuples of divisions at given level (all
+        levels if None), optionally only ones belonging to given region
+        """
+        data = self.get_data()
+        out = []
+        for adm_id, adm in data['by_id'].iteritems():
+            if level is not None and adm.level != level:
+                continue
+            if region_id is not None and region_id not in data['regions'].get(adm_id, ()):
+                continue
+            out.append((adm_id, adm.code, adm.name,))
+        return out
+
+    def _get_country(self, data, adm):
+        while adm is not None and adm.level > 1:
+            adm = data['by_id'].get(adm.parent_id)
+        return adm if adm is not None and adm.level == 1 else None
+
+    def search(self, query, limit=None):
+        """
+        Returns divisions which names contain `query` (ignoring accents
+        and case) as list of (code, name, country code) tuples.
+
+        Queries shorter than three letters have no trigrams, so all
+        names are scanned for them. Results are ranked: exact names
+        first, then names starting with query, names with a word
+        starting with query, other matches; then by level and name.
+        """
+        data = self.get_data()
+        query = normalize_name(query).strip()
+        if not query:
+            return []
+        if len(query) < 3:
+            candidates = data['names'].iterkeys()
+        else:
+            sets = sorted((data['trigrams'].get(gram, set()) for gram in trigrams(query)), key=len)
+            candidates = sets[0].intersection(*sets[1:])
+
+        names = data['names']
+        ranked = []
+        for adm_id in candidates:
+            name = names[adm_id]
+            pos = name.find(query)
+            if pos < 0:
+                continue
+            if name == query:
+                rank = 0
+            elif pos == 0:
+                rank = 1
+            elif not name[pos - 1].isalnum():
+                rank = 2
+            else:
+                rank = 3
+            adm = data['by_id'][adm_id]
+            ranked.append((rank, adm.level, name, adm.code, adm,))
+        ranked.sort()
+        if limit:
+            ranked = ranked[:limit]
+
+        out = []
+        for rank, level, name, code, adm in ranked:
+            country = self._get_country(data, adm)
+            out.append((adm.code, adm.name, country.code if country is not None else '',))
+        return out
+
+
+adm_tree = AdmDivisionTree(check_interval=getattr(settings, 'RISKS_ADM_TREE_CHECK_INTERVAL', 5))
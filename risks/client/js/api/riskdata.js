@@ -10,6 +10,7 @@ const ConfigUtils = require('../../MapStore2/web/client/utils/ConfigUtils');
 const riskdataCache = {};
 const toBlob = require('canvas-to-blob');
 var FileSaver = require('file-saver');
+const {MSGPACK_CONTENT_TYPE, decodeResponse} = require('../utils/MsgpackUtils');
 const Api = {
     getData: function(url) {
         const cached = riskdataCache[url];
@@ -26,6 +27,33 @@ const Api = {
             return response.data;
         });
     },
+    /**
+     * Same as getData, for risk data endpoints: asks for msgpack
+     * encoded response, which is much smaller for large analyses.
+     */
+    getValues: function(url) {
+        const cached = riskdataCache[url];
+        if (cached && new Date().getTime() < cached.timestamp + (ConfigUtils.getConfigProp('cacheDataExpire') || 60) * 1000) {
+            return new Promise((resolve) => {
+                resolve(cached.data);
+            });
+        }
+        const config = {
+            responseType: 'arraybuffer',
+            headers: {'Accept': `${MSGPACK_CONTENT_TYPE}, application/json`}
+        };
+        const decode = (response) => decodeResponse(response.data, response.headers['content-type']);
+        return axios.get(url, config).then((response) => {
+            const data = decode(response);
+            riskdataCache[url] = {
+                timestamp: new Date().getTime(),
+                data
+            };
+            return data;
+        }).catch((e) => {
+            throw e && e.data instanceof ArrayBuffer ? {...e, data: decode(e)} : e;
+        });
+    },
     postData: function(url, values) {
         const cached = riskdataCache[url];
         if (cached && new Date().getTime() < cached.timestamp + (ConfigUtils.getConfigProp('cacheDataExpire') || 60) * 1000) {
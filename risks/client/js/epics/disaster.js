@@ -100,7 +100,7 @@ const getAnalysisEpic = (action$, store) =>
         let filtersString = '';
         _.forIn(analysisFilters, (value, key) => { if(value != '') filtersString += `${key}/${value}/` });
         const apiUrl = action.url + filtersString;
-        return Rx.Observable.defer(() => Api.getData(apiUrl))
+        return Rx.Observable.defer(() => Api.getValues(apiUrl))
             .retry(1)
             .map(val => {
                 const baseUrl = val.wms && val.wms.baseurl;
@@ -179,7 +179,7 @@ const getEventEpic = (action$, store) =>
 
 const getEventDetailsEpic = (action$, store) =>
     action$.ofType(EVENT_DETAILS).switchMap(action => 
-        Rx.Observable.defer(() => Api.getData(action.url))
+        Rx.Observable.defer(() => Api.getValues(action.url))
             .retry(1)
             .map(val => {
                 return [eventDetailsLoaded(val)];
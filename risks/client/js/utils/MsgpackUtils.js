@@ -0,0 +1,177 @@
+/**
+ * Copyright 2018, GeoSolutions Sas.
+ * All rights reserved.
+ *
+ * This source code is licensed under the BSD-style license found in the
+ * LICENSE file in the root directory of this source tree.
+ */
+const MSGPACK_CONTENT_TYPE = 'application/x-msgpack';
+const COLUMNAR_KEY = '$columnar';
+
+function decodeUtf8(bytes, start, end) {
+    let out = '';
+    let pos = start;
+    while (pos < end) {
+        let c = bytes[pos++];
+        if (c >= 0xf0) {
+            c = ((c & 0x07) << 18) | ((bytes[pos++] & 0x3f) << 12) | ((bytes[pos++] & 0x3f) << 6) | (bytes[pos++] & 0x3f);
+            c -= 0x10000;
+            out += String.fromCharCode(0xd800 + (c >> 10), 0xdc00 + (c & 0x3ff));
+            continue;
+        }
+        if (c >= 0xe0) {
+            c = ((c & 0x0f) << 12) | ((bytes[pos++] & 0x3f) << 6) | (bytes[pos++] & 0x3f);
+        } else if (c >= 0xc0) {
+            c = ((c & 0x1f) << 6) | (bytes[pos++] & 0x3f);
+        }
+        out += String.fromCharCode(c);
+    }
+    return out;
+}
+
+/**
+ * Decodes msgpack encoded ArrayBuffer.
+ * bin values are returned as Uint8Array, ext values are not supported.
+ */
+function decode(buffer) {
+    const bytes = new Uint8Array(buffer);
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    let pos = 0;
+    let read;
+    const str = (len) => {
+        const s = decodeUtf8(bytes, pos, pos + len);
+        pos += len;
+        return s;
+    };
+    const bin = (len) => {
+        const b = bytes.subarray(pos, pos + len);
+        pos += len;
+        return b;
+    };
+    const arr = (len) => {
+        const a = new Array(len);
+        for (let i = 0; i < len; i++) {
+            a[i] = read();
+        }
+        return a;
+    };
+    const map = (len) => {
+        const m = {};
+        for (let i = 0; i < len; i++) {
+            const key = read();
+            m[key] = read();
+        }
+        return m;
+    };
+    const u8 = () => bytes[pos++];
+    const u16 = () => { pos += 2; return view.getUint16(pos - 2); };
+    const u32 = () => { pos += 4; return view.getUint32(pos - 4); };
+    read = () => {
+        const type = u8();
+        if (type <= 0x7f) {
+            return type;
+        }
+        if (type <= 0x8f) {
+            return map(type & 0x0f);
+        }
+        if (type <= 0x9f) {
+            return arr(type & 0x0f);
+        }
+        if (type <= 0xbf) {
+            return str(type & 0x1f);
+        }
+        if (type >= 0xe0) {
+            return type - 0x100;
+        }
+        let val;
+        switch (type) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return bin(u8());
+            case 0xc5: return bin(u16());
+            case 0xc6: return bin(u32());
+            case 0xca: val = view.getFloat32(pos); pos += 4; return val;
+            case 0xcb: val = view.getFloat64(pos); pos += 8; return val;
+            case 0xcc: return u8();
+            case 0xcd: return u16();
+            case 0xce: return u32();
+            case 0xcf: val = u32() * 0x100000000; return val + u32();
+            case 0xd0: val = view.getInt8(pos); pos += 1; return val;
+            case 0xd1: val = view.getInt16(pos); pos += 2; return val;
+            case 0xd2: val = view.getInt32(pos); pos += 4; return val;
+            case 0xd3: val = view.getInt32(pos) * 0x100000000; pos += 4; return val + u32();
+            case 0xd9: return str(u8());
+            case 0xda: return str(u16());
+            case 0xdb: return str(u32());
+            case 0xdc: return arr(u16());
+            case 0xdd: return arr(u32());
+            case 0xde: return map(u16());
+            case 0xdf: return map(u32());
+            default: throw new Error(`Unsupported msgpack type 0x${type.toString(16)}`);
+        }
+    };
+    return read();
+}
+
+function unpackColumn(column, length) {
+    const data = column.type === 'float64' ? column.data : column.indices;
+    const view = new DataView(data.buffer, data.byteOffset, data.byteLength);
+    const out = new Array(length);
+    for (let i = 0; i < length; i++) {
+        if (column.type === 'float64') {
+            const val = view.getFloat64(i * 8, true);
+            out[i] = isNaN(val) ? null : val;
+        } else {
+            out[i] = column.dictionary[view.getUint32(i * 4, true)];
+        }
+    }
+    return out;
+}
+
+/**
+ * Rebuilds values matrix (list of rows) from column-encoded one
+ */
+function unpackValues(packed) {
+    const columns = packed.columns.map((c) => unpackColumn(c, packed.length));
+    const rows = new Array(packed.length);
+    for (let i = 0; i < packed.length; i++) {
+        rows[i] = columns.map((c) => c[i]);
+    }
+    return rows;
+}
+
+/**
+ * Replaces column-encoded matrices in decoded response with plain ones,
+ * so data has the same shape as json response.
+ */
+function unpackResponse(obj) {
+    if (obj === null || typeof obj !== 'object' || obj instanceof Uint8Array) {
+        return obj;
+    }
+    if (obj[COLUMNAR_KEY]) {
+        return unpackValues(obj);
+    }
+    Object.keys(obj).forEach((k) => { obj[k] = unpackResponse(obj[k]); });
+    return obj;
+}
+
+/**
+ * Decodes response body fetched as ArrayBuffer, both msgpack and json
+ * (i.e. error responses) are handled.
+ */
+function decodeResponse(data, contentType) {
+    if ((contentType || '').indexOf(MSGPACK_CONTENT_TYPE) === 0) {
+        return unpackResponse(decode(data));
+    }
+    const bytes = new Uint8Array(data);
+    return JSON.parse(decodeUtf8(bytes, 0, bytes.length));
+}
+
+module.exports = {
+    MSGPACK_CONTENT_TYPE,
+    decode,
+    unpackValues,
+    unpackResponse,
+    decodeResponse
+};
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import logging
+import math
+import threading
+from array import array
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+from risks.versioning import data_versions
+
+log = logging.getLogger(__name__)
+
+
+class RiskAnalysisCube(object):
+    """
+    Compact, precomputed (adm_code x dim1 x dim2) -> value data for
+    a risk analysis.
+
+    Dimension values are dictionary-encoded: each entry keeps indexes
+    into `dim1_values`/`dim2_values` lists, values are kept in float64
+    array (NaN for missing values). Entries are sorted by adm code and
+    dimension orders, so rows for a location are a contiguous slice.
+    """
+
+    def __init__(self, adm_offsets, dim1_values, dim1_orders, dim2_values, dim2_orders,
+                 dim1_idx, dim2_idx, values):
+        self.adm_offsets = adm_offsets
+        self.dim1_values = dim1_values
+        self.dim1_orders = dim1_orders
+        self.dim2_values = dim2_values
+        self.dim2_orders = dim2_orders
+        self.dim1_idx = dim1_idx
+        self.dim2_idx = dim2_idx
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds cube from (adm_code, dim1_value, dim1_order, dim2_value,
+        dim2_order, value) rows, sorted by adm_code and dimension orders.
+        """
+        dim_values = ([], [],)
+        dim_orders = ([], [],)
+        dim_lookup = ({}, {},)
+
+        def encode(axis, val, order):
+            lookup = dim_lookup[axis]
+            idx = lookup.get(val)
+            if idx is None:
+                idx = lookup[val] = len(dim_values[axis])
+                dim_values[axis].append(val)
+                dim_orders[axis].append(order)
+            return idx
+
+        adm_offsets = {}
+        dim1_idx = array('i')
+        dim2_idx = array('i')
+        values = array('d')
+        for adm_code, dim1_value, dim1_order, dim2_value, dim2_order, value in rows:
+            start, end = adm_offsets.get(adm_code, (len(values), len(values),))
+            adm_offsets[adm_code] = (start, end + 1,)
+            dim1_idx.append(encode(0, dim1_value, dim1_order))
+            dim2_idx.append(encode(1, dim2_value, dim2_order))
+            values.append(float('nan') if value is None else value)
+
+        return cls(adm_offsets, dim_values[0], dim_orders[0], dim_values[1], dim_orders[1],
+                   dim1_idx, dim2_idx, values)
+
+    def get_rows(self, adm_code):
+        """
+        Returns rows for given location, in the same format
+        as :py:class:`risks.datasource.PostGISDataSource` rows.
+        """
+        start, end = self.adm_offsets.get(adm_code, (0, 0,))
+        out = []
+        for pos in range(start, end):
+            d1 = self.dim1_idx[pos]
+            d2 = self.dim2_idx[pos]
+            value = self.values[pos]
+            out.append({'dim1_value': self.dim1_values[d1],
+                        'dim1_order': self.dim1_orders[d1],
+                        'dim2_value': self.dim2_values[d2],
+                        'dim2_order': self.dim2_orders[d2],
+                        'value': None if math.isnan(value) else value})
+        return out
+
+    def get_value(self, adm_code, dim1_value, dim2_value):
+        """
+        Returns value for location and dimension values, or None
+        """
+        start, end = self.adm_offsets.get(adm_code, (0, 0,))
+        for pos in range(start, end):
+            if self.dim1_values[self.dim1_idx[pos]] == dim1_value and \
+                    self.dim2_values[self.dim2_idx[pos]] == dim2_value:
+                value = self.values[pos]
+                return None if math.isnan(value) else value
+
+
+class RiskAnalysisCubeStore(object):
+    """
+    Read-through store for :py:class:`RiskAnalysisCube` objects.
+
+    Cubes are kept per data version of risk analysis (bumped by
+    imports): looked up in process memory first, then in shared django
+    cache, and built from datastore only if missing. A cube built for
+    an older version is never returned once the version is bumped.
+    Process memory keeps only recently used cubes.
+    """
+
+    CUBE_SQL = """SELECT adm.adm_code,
+                         d1.dim_value, d1.dim_order,
+                         d2.dim_value, d2.dim_order,
+                         NULLIF(rd.value, '')::float
+                  FROM risk_dimensions rd
+                  JOIN risk_analysis ra ON ra.id = rd.risk_analysis_id
+                  JOIN adm_divisions adm ON adm.fid = rd.adm_fid
+                  LEFT JOIN dimensions d1 ON d1.dim_id = rd.dim1_id
+                  LEFT JOIN dimensions d2 ON d2.dim_id = rd.dim2_id
+                  WHERE ra.name = %(risk_analysis)s
+                    AND ra.hazard_type = %(hazard_type)s
+                    AND rd.event_id = ''
+                  ORDER BY adm.adm_code, d1.dim_order, d2.dim_order"""
+
+    CACHE_KEY = 'risks:cube:{}:{}'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cubes = OrderedDict()
+
+    @property
+    def local_size(self):
+        return getattr(settings, 'RISKS_CUBE_LOCAL_SIZE', 32)
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'RISKS_CUBE_CACHE', 'default')]
+
+    @property
+    def cache_timeout(self):
+        # entries of superseded versions are left to expire
+        return getattr(settings, 'RISKS_DATA_CACHE_TTL', 86400)
+
+    def get_version(self, risk_id):
+        return data_versions.get_versions([data_versions.get_analysis_scope(risk_id)])[0]
+
+    def get_cache_key(self, risk_id, version):
+        return self.CACHE_KEY.format(risk_id, version)
+
+    def build(self, risk):
+        """
+        Builds cube for risk analysis from datastore. Datastore rows
+        are matched by analysis name and hazard type, as in
+        :py:class:`risks.datasource.PostGISDataSource`.
+        """
+        db_name = settings.OGC_SERVER['default']['DATASTORE']
+        with connections[db_name].cursor() as cursor:
+            cursor.execute(self.CUBE_SQL, {'risk_analysis': risk.name,
+                                           'hazard_type': risk.hazard_type.mnemonic})
+            return RiskAnalysisCube.from_rows(cursor.fetchall())
+
+    def _keep(self, risk_id, version, cube):
+        with self._lock:
+            # replaces cube of older version, if any
+            self._cubes.pop(risk_id, None)
+            self._cubes[risk_id] = (version, cube,)
+            while len(self._cubes) > self.local_size:
+                self._cubes.popitem(last=False)
+
+    def get(self, risk):
+        """
+        Returns cube for given risk analysis
+        """
+        version = self.get_version(risk.id)
+        with self._lock:
+            cached = self._cubes.get(risk.id)
+            if cached is not None and cached[0] == version:
+                # mark as recently used
+                del self._cubes[risk.id]
+                self._cubes[risk.id] = cached
+                return cached[1]
+
+        key = self.get_cache_key(risk.id, version)
+        cube = self.cache.get(key)
+        if cube is None:
+            cube = self.build(risk)
+            self.cache.set(key, cube, self.cache_timeout)
+        self._keep(risk.id, version, cube)
+        return cube
+
+    def rebuild(self, risk):
+        """
+        Rebuilds cube for risk analysis, should be called
+        after risk analysis data is imported and its version bumped.
+        """
+        version = self.get_version(risk.id)
+        cube = self.build(risk)
+        self.cache.set(self.get_cache_key(risk.id, version), cube, self.cache_timeout)
+        self._keep(risk.id, version, cube)
+        log.info("rebuilt cube for risk analysis %s: %s entries", risk.id, len(cube))
+        return cube
+
+
+risk_cubes = RiskAnalysisCubeStore()
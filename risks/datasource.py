@@ -4,12 +4,134 @@ from __future__ import print_function
 
 import logging
 import json
+import threading
+import time
 import urllib
+from decimal import Decimal
+from importlib import import_module
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
 
+import requests
+from django.conf import settings
+from django.db import connections
 from owslib.wfs import WebFeatureService
+from owslib.util import ServiceException
 
 log = logging.getLogger(__name__)
 
+# fastest available ijson backend; pure python one is slower than
+# json.load(), but still keeps memory bounded on large responses
+ijson = None
+for _backend in ('yajl2_c', 'yajl2_cffi', 'yajl2', 'python',):
+    try:
+        ijson = import_module('ijson.backends.{}'.format(_backend))
+        break
+    except ImportError:
+        pass
+
+# properties returned for each row by default
+DEFAULT_FIELD_NAMES = ['dim1_value', 'dim2_value', 'value']
+
+
+class WFSClientPool(object):
+    """
+    Process-wide pool of WFS clients, keyed by url and credentials.
+
+    Parsed capabilities (WebFeatureService instances) are shared between
+    threads and reloaded after `ttl` seconds. HTTP sessions are kept
+    per thread, so connections to GeoServer are reused between requests.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._local = threading.local()
+
+    def make_key(self, url, version, username=None, password=None):
+        return (url, version, username, password,)
+
+    def get_client(self, factory, url, version, **kwargs):
+        """
+        Returns WFS client for given url and credentials. Capabilities are
+        fetched only if there's no client cached or it expired.
+        """
+        key = self.make_key(url, version, kwargs.get('username'), kwargs.get('password'))
+        now = time.time()
+        with self._lock:
+            cached = self._clients.get(key)
+            if cached is not None and now - cached[0] < self.ttl:
+                return cached[1]
+        # fetch capabilities outside the lock, concurrent misses for
+        # the same key will just overwrite each other
+        wfs = factory(url=url, version=version, **kwargs)
+        with self._lock:
+            self._clients[key] = (now, wfs,)
+        return wfs
+
+    def get_session(self, url, version, username=None, password=None):
+        """
+        Returns keep-alive http session for current thread
+        """
+        sessions = getattr(self._local, 'sessions', None)
+        if sessions is None:
+            sessions = self._local.sessions = {}
+        key = self.make_key(url, version, username, password)
+        session = sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            if username:
+                session.auth = (username, password,)
+            sessions[key] = session
+        return session
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+
+wfs_pool = WFSClientPool(ttl=getattr(settings, 'RISKS_WFS_CAPABILITIES_TTL', 300))
+
+
+_fetch_pool = None
+_fetch_pool_lock = threading.Lock()
+
+
+def get_fetch_pool():
+    """
+    Returns bounded, process-wide thread pool used for concurrent fetches
+    """
+    global _fetch_pool
+    with _fetch_pool_lock:
+        if _fetch_pool is None:
+            _fetch_pool = ThreadPool(getattr(settings, 'RISKS_FETCH_WORKERS', 8))
+    return _fetch_pool
+
+
+def _run_call(call):
+    func, args, kwargs = call
+    return func(*args, **kwargs)
+
+
+def run_concurrently(calls):
+    """
+    Runs list of (callable, args, kwargs) in fetch pool and returns
+    results in the same order as calls. First exception raised by
+    any call is re-raised.
+    """
+    if len(calls) < 2:
+        return [_run_call(c) for c in calls]
+    return get_fetch_pool().map(_run_call, calls)
+
+
+def cql_in(field_name, values):
+    """
+    Returns CQL filter matching rows with field value in given values
+    """
+    quoted = ["'{}'".format(unicode(v).replace("'", "''")) for v in values]
+    return u'{} IN ({})'.format(field_name, ', '.join(quoted)).encode('utf-8')
+
 
 class GeoserverDataSource(object):
     """
@@ -17,16 +139,54 @@ class GeoserverDataSource(object):
     """
     OUTPUT_FORMATS = {'application/json': json.load}
     WFCLASS = staticmethod(WebFeatureService)
+    VERSION = '2.0.0'
+    TIMEOUT = 30
 
     def __init__(self, url, output_format='application/json', **kwargs):
-        self.wfs = GeoserverDataSource.WFCLASS(url=url, version='2.0.0', **kwargs)
+        self.wfs = wfs_pool.get_client(GeoserverDataSource.WFCLASS, url, self.VERSION, **kwargs)
         #self.wfs = GeoserverDataSource.WFCLASS(url=url, version='2.0.0')
+        self.session = wfs_pool.get_session(url, self.VERSION, kwargs.get('username'), kwargs.get('password'))
         self.output_format = output_format
 
+    def getfeature(self, layer_name, field_names, vparams, stream=False):
+        """
+        Issues GetFeature request through pooled http session,
+        so no GetCapabilities call nor new connection is needed.
+
+        With `stream`, returns response with content not read yet, which
+        should be closed by the caller, so connection is returned to pool.
+        """
+        url = self.wfs.getGETGetFeatureRequest(typename=[layer_name],
+                                               propertyname=field_names,
+                                               storedQueryID=1,
+                                               storedQueryParams=vparams,
+                                               outputFormat=self.output_format)
+        r = self.session.get(url, timeout=self.TIMEOUT, stream=stream)
+        r.raise_for_status()
+        if 'xml' in r.headers.get('Content-Type', ''):
+            # GeoServer reports errors as xml with 200 status
+            raise ServiceException(r.content)
+        if stream:
+            r.raw.decode_content = True
+            return r
+        return BytesIO(r.content)
+
     def prepare_vparams(self, vparams, separator=":"):
         u = urllib.quote
         return [separator.join((u(k), u(str(v)),)) for k, v in vparams.iteritems()]
 
+    def prepare_request(self, dim_name=None, cql_filter=None, **kwargs):
+        """
+        Returns (field names, stored query params) for GetFeature request.
+        Optional `cql_filter` is applied on rows returned by the view.
+        """
+        vparams_list = self.prepare_vparams(kwargs)
+        vparams = {'viewparams': ';'.join(vparams_list)}
+        if cql_filter:
+            vparams['cql_filter'] = cql_filter
+        field_names = DEFAULT_FIELD_NAMES if dim_name is None else dim_name
+        return (field_names, vparams,)
+
     def prepare_cql_params(self, vparams, separator="="):
         u = urllib.quote
         return [separator.join((u(k), "'{}'".format(v),)) for k, v in vparams.iteritems()]
@@ -39,11 +199,8 @@ class GeoserverDataSource(object):
         """
         #print('dim_name = {}'.format(dim_name))
         #kwargs['dim'] = dim_name
-        vparams_list = self.prepare_vparams(kwargs)
-        vparams = {'viewparams': ';'.join(vparams_list)}
-        #print(vparams)
-        field_names = ['dim1_value', 'dim2_value', 'value'] if dim_name is None else dim_name
-        r = self.wfs.getfeature('{}'.format(layer_name), propertyname=field_names, outputFormat=self.output_format, storedQueryParams=vparams, storedQueryID=1)
+        (field_names, vparams,) = self.prepare_request(dim_name, **kwargs)
+        r = self.getfeature('{}'.format(layer_name), field_names, vparams)
 
         """
         Using 'viewparams'
@@ -72,6 +229,94 @@ class GeoserverDataSource(object):
         
         return self.deserialize(r)
 
+    def iter_rows(self, layer_name, dim_name=None, **kwargs):
+        """
+        Yields feature properties for given params, decoding response
+        incrementally if ijson is available. Geometries are skipped and
+        never built in memory then.
+        """
+        (field_names, vparams,) = self.prepare_request(dim_name, **kwargs)
+        if ijson is None:
+            r = self.getfeature('{}'.format(layer_name), field_names, vparams)
+            for feature in json.load(r)['features']:
+                yield feature['properties']
+            return
+        r = self.getfeature('{}'.format(layer_name), field_names, vparams, stream=True)
+        try:
+            for props in ijson.items(r.raw, 'features.item.properties'):
+                # ijson returns Decimal for non-integer numbers,
+                # keep the same types json.load would give
+                for k, v in props.iteritems():
+                    if isinstance(v, Decimal):
+                        props[k] = float(v)
+                yield props
+        finally:
+            r.close()
+
+    def get_rows(self, layer_name, dim_name=None, **kwargs):
+        """
+        Return list of feature properties (plain rows) for given params
+        """
+        return list(self.iter_rows(layer_name, dim_name, **kwargs))
+
     def deserialize(self, val):
         d = self.OUTPUT_FORMATS[self.output_format]
         return d(val)
+
+
+class PostGISDataSource(object):
+    """
+    Runs risk data SQL views directly against datastore database,
+    bypassing GeoServer WFS.
+
+    Only layers listed in QUERIES are supported, use :py:meth:`supports`
+    to check before querying.
+    """
+
+    RISK_ANALYSIS_SQL = """SELECT d1.dim_value AS dim1_value,
+                                    d1.dim_order AS dim1_order,
+                                    d2.dim_value AS dim2_value,
+                                    d2.dim_order AS dim2_order,
+                                    NULLIF(rd.value, '')::float AS value
+                             FROM risk_dimensions rd
+                             JOIN risk_analysis ra ON ra.id = rd.risk_analysis_id
+                             JOIN adm_divisions adm ON adm.fid = rd.adm_fid
+                             LEFT JOIN dimensions d1 ON d1.dim_id = rd.dim1_id
+                             LEFT JOIN dimensions d2 ON d2.dim_id = rd.dim2_id
+                             WHERE ra.name = %(risk_analysis)s
+                               AND ra.hazard_type = %(hazard_type)s
+                               AND adm.adm_code = %(adm_code)s
+                               AND rd.event_id = ''
+                             ORDER BY d1.dim_order, d2.dim_order"""
+
+    QUERIES = {'risk_analysis': RISK_ANALYSIS_SQL}
+
+    def __init__(self, db_name=None):
+        self.db_name = db_name or settings.OGC_SERVER['default']['DATASTORE']
+
+    def get_query(self, layer_name):
+        """
+        Returns SQL for given layer name (workspace prefix is ignored)
+        """
+        name = layer_name.split(':')[-1]
+        return self.QUERIES.get(name)
+
+    def supports(self, layer_name):
+        return bool(self.db_name) and self.get_query(layer_name) is not None
+
+    def get_rows(self, layer_name, dim_name=None, **kwargs):
+        """
+        Return list of rows (dicts) for given params
+        @param kwargs keyword args used as query parameters
+        @param dim_name optional list of fields to return
+        """
+        sql = self.get_query(layer_name)
+        if sql is None:
+            raise ValueError("Layer {} is not supported by PostGIS data source".format(layer_name))
+        with connections[self.db_name].cursor() as cursor:
+            cursor.execute(sql, kwargs)
+            columns = [c[0] for c in cursor.description]
+            rows = [dict(zip(columns, r)) for r in cursor.fetchall()]
+        if dim_name is not None:
+            rows = [dict((f, r.get(f),) for f in dim_name) for r in rows]
+        return rows
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import json
+import logging
+import math
+
+from django.conf import settings
+from django.db import transaction
+
+log = logging.getLogger(__name__)
+
+# simplification tolerances (in degrees) geometries are prebuilt for,
+# 0 is original geometry
+TOLERANCES = tuple(sorted(set(getattr(settings, 'RISKS_GEOMETRY_TOLERANCES', (0, 0.001, 0.005, 0.02,)))))
+
+# number of divisions built in one transaction
+BATCH_SIZE = 500
+
+
+def get_tolerance(zoom=None, tolerance=None):
+    """
+    Returns prebuilt tolerance to use for requested map zoom level or
+    tolerance: the coarsest one which is not coarser than requested.
+    Original geometry is used if nothing was requested.
+    """
+    if zoom is not None:
+        # size of one pixel at given zoom level of 256px tiles, in degrees
+        tolerance = 360.0 / (256 * 2 ** zoom)
+    if tolerance is None:
+        return TOLERANCES[0]
+    matching = [t for t in TOLERANCES if t <= tolerance]
+    return matching[-1] if matching else TOLERANCES[0]
+
+
+def _round_coords(coords, digits):
+    if isinstance(coords[0], (list, tuple,)):
+        return [_round_coords(c, digits) for c in coords]
+    return [round(c, digits) for c in coords]
+
+
+def to_geojson(geom, tolerance):
+    """
+    Returns GeoJSON geometry string for geometry simplified with
+    tolerance. Coordinates of simplified geometries are rounded,
+    as precision finer than tolerance is not visible anyway.
+    """
+    if not tolerance:
+        return geom.json
+    simplified = geom.simplify(tolerance, preserve_topology=True)
+    out = json.loads(simplified.json)
+    digits = int(math.ceil(-math.log10(tolerance))) + 1
+    out['coordinates'] = _round_coords(out['coordinates'], digits)
+    return json.dumps(out, separators=(',', ':',))
+
+
+def build_geometries(adms, tolerances=TOLERANCES):
+    """
+    (Re)builds cached geometries of given divisions (queryset)
+    for all tolerances. Returns number of divisions built.
+    """
+    from risks.models import AdministrativeDivisionGeometry
+
+    count = 0
+    batch = []
+    # WKT is loaded only for divisions without WKB
+    for adm in adms.defer(None).only('id', 'geom_wkb', 'srid').iterator():
+        batch.append(adm)
+        if len(batch) >= BATCH_SIZE:
+            count += _build_batch(AdministrativeDivisionGeometry, batch, tolerances)
+            batch = []
+    if batch:
+        count += _build_batch(AdministrativeDivisionGeometry, batch, tolerances)
+    log.info("built cached geometries for %s administrative divisions", count)
+    return count
+
+
+def _build_batch(model, adms, tolerances):
+    rows = []
+    for adm in adms:
+        geom = adm.geometry
+        if geom is None:
+            continue
+        for tolerance in tolerances:
+            rows.append(model(administrativedivision_id=adm.id,
+                              tolerance=tolerance,
+                              geojson=to_geojson(geom, tolerance)))
+    with transaction.atomic():
+        model.objects.filter(administrativedivision_id__in=[adm.id for adm in adms]).delete()
+        model.objects.bulk_create(rows)
+    return len(adms)
+
+
+def get_geojson(adm_ids, tolerance):
+    """
+    Returns dict of division id -> GeoJSON geometry string for given
+    prebuilt tolerance. Original geometries are returned for divisions
+    missing in cache (imported before cache was added), as simplifying
+    them in request would take too long; cache is filled offline with
+    `build_adm_geometries` command. Divisions without geometry are
+    not in the output.
+    """
+    from risks.models import AdministrativeDivision, AdministrativeDivisionGeometry
+
+    out = dict(AdministrativeDivisionGeometry.objects
+                                             .filter(administrativedivision_id__in=adm_ids,
+                                                     tolerance=tolerance)
+                                             .values_list('administrativedivision_id', 'geojson'))
+    missing = [adm_id for adm_id in adm_ids if adm_id not in out]
+    if missing:
+        log.warning("%s administrative divisions have no cached geometries, "
+                    "run build_adm_geometries command", len(missing))
+        adms = AdministrativeDivision.objects.filter(id__in=missing).defer(None).only('id', 'geom', 'geom_wkb', 'srid')
+        for adm in adms.iterator():
+            geom = adm.geometry
+            if geom is not None:
+                out[adm.id] = geom.json
+    return out
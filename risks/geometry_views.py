@@ -6,13 +6,19 @@ import json
 import logging
 
 from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
 from django.views.generic import TemplateView, View
-from django.contrib.gis.gdal import OGRGeometry
 
 from geonode.utils import json_response
-from risks.models import (LocationAware, Region, HazardType, AdministrativeDivision,
+from risks import geometry_cache, tiles, topology
+from risks.adm_tree import adm_tree
+from risks.cube import risk_cubes
+from risks.models import (LocationAware, Region, HazardType, AdministrativeDivision, RiskAnalysis,
                                           RiskAnalysisDymensionInfoAssociation)
-from risks.views import AppAware
+from risks.versioning import data_versions
+from risks.views import AppAware, DataExtractionView
 
 from risks.datasource import GeoserverDataSource
 
@@ -20,34 +26,68 @@ log = logging.getLogger(__name__)
 
 
 class AdministrativeGeometry(AppAware, LocationAware, View):
-    
 
-    def _get_geometry(self, val):
-        """
-        converts geometry to geojson geom
-        """
-        g = OGRGeometry(val)
-        return json.loads(g.json)
+    TOPOLOGY_CACHE_KEY = 'risks:topology:{}:{}:{}:{}:{}'
 
     def _get_properties(self, val):
         return val.export()
 
-    def _make_feature(self, val, app, reg):
+    def _get_tolerance(self, request):
         """
-        Returns feature from the object
-
+        Returns prebuilt tolerance for `zoom` or `tolerance` request param.
+        Raises ValueError for invalid values.
         """
-        return {"type": "Feature",
-                "properties": self._get_properties(val.set_app(app).set_region(reg)),
-                "geometry": self._get_geometry(val.geom)
-                }
-
+        zoom = request.GET.get('zoom')
+        tolerance = request.GET.get('tolerance')
+        return geometry_cache.get_tolerance(zoom=int(zoom) if zoom else None,
+                                            tolerance=float(tolerance) if tolerance else None)
+
+    def _dump_feature(self, val, app, reg, geojson):
+        # geometry is already serialized, so it's pasted into output as is
+        return '{{"type": "Feature", "properties": {}, "geometry": {}}}'.format(
+                    json.dumps(self._get_properties(val.set_app(app).set_region(reg)), cls=DjangoJSONEncoder),
+                    geojson)
+
+    def _get_items(self, adm):
+        children = list(adm.children.all())
+        for child in children:
+            # parent is known, no need to fetch it for each child
+            child.parent = adm
+        return [adm] + children
+
+    def _get_topology(self, adm, app, reg, tolerance):
+        """
+        Returns TopoJSON of division and its children, built once
+        per region, division and tolerance and cached until
+        administrative divisions are imported again
+        """
+        cache = caches[getattr(settings, 'RISKS_TOPOLOGY_CACHE', 'default')]
+        version = data_versions.get_versions([data_versions.ADM_SCOPE])[0]
+        key = self.TOPOLOGY_CACHE_KEY.format(version, app.name if app else '', reg.name, adm.code, tolerance)
+        out = cache.get(key)
+        if out is None:
+            items = self._get_items(adm)
+            # topology is built from the most detailed geometries and
+            # simplified after that, so shared borders stay aligned
+            geometries = geometry_cache.get_geojson([item.id for item in items], geometry_cache.get_tolerance())
+            # divisions without geometry are left out
+            items = [item for item in items if item.id in geometries]
+            topo = topology.build_topology([json.loads(geometries[item.id]) for item in items],
+                                           [self._get_properties(item.set_app(app).set_region(reg)) for item in items],
+                                           tolerance)
+            out = json.dumps(topo, cls=DjangoJSONEncoder)
+            cache.set(key, out, getattr(settings, 'RISKS_DATA_CACHE_TTL', 86400))
+        return out
 
     def get(self, request, adm_code, **kwargs):
         try:
             app = self.get_app()
         except KeyError:
             app = None
+        try:
+            tolerance = self._get_tolerance(request)
+        except ValueError:
+            return json_response(errors=["Invalid zoom or tolerance"], status=400)
         try:
             adm = AdministrativeDivision.objects.get(code=adm_code)
         except AdministrativeDivision.DoesNotExist:
@@ -62,13 +102,69 @@ class AdministrativeGeometry(AppAware, LocationAware, View):
         if reg is None:
             return json_response(errors=["Invalid region"], status=404)
 
-        children = adm.children.all()
-        _features = [adm] + list(children)
+        if request.GET.get('format') == 'topojson':
+            return HttpResponse(self._get_topology(adm, app, reg, tolerance), content_type='application/json')
+
+        _features = self._get_items(adm)
+
+        geometries = geometry_cache.get_geojson([item.id for item in _features], tolerance)
+        features = [self._dump_feature(item, app, reg, geometries[item.id])
+                    for item in _features if item.id in geometries]
+        out = '{{"type": "FeatureCollection", "features": [{}]}}'.format(', '.join(features))
+        return HttpResponse(out, content_type='application/json')
+
+
+class AdministrativeTile(View):
+    """
+    Mapbox Vector Tile with administrative divisions at `level` (default 1),
+    optionally only ones in region `reg`.
+
+    If risk analysis `an` is given, features have `value` property with
+    risk analysis value for `dim1` and `dim2` dimension values.
+    """
+
+    def get(self, request, z, x, y, **kwargs):
+        z, x, y = int(z), int(x), int(y)
+        if not tiles.is_valid_tile(z, x, y):
+            return json_response(errors=["Invalid tile"], status=404)
+        try:
+            level = int(request.GET.get('level', 1))
+        except ValueError:
+            return json_response(errors=["Invalid level"], status=400)
+        max_level = adm_tree.get_max_level()
+        if max_level is None or not 0 <= level <= max_level:
+            return json_response(errors=["Invalid level"], status=400)
+
+        region_id = None
+        if request.GET.get('reg'):
+            try:
+                region_id = Region.objects.get(name=request.GET['reg']).id
+            except Region.DoesNotExist:
+                return json_response(errors=["Invalid region"], status=404)
+
+        risk = get_value = None
+        dim1 = request.GET.get('dim1')
+        dim2 = request.GET.get('dim2')
+        if request.GET.get('an'):
+            try:
+                risk = RiskAnalysis.objects.get(id=int(request.GET['an']))
+            except (ValueError, RiskAnalysis.DoesNotExist):
+                return json_response(errors=["Invalid risk analysis"], status=404)
+            if not DataExtractionView().is_user_allowed(request, risk):
+                return json_response(errors=['Data not available for current user'], status=403)
+            cube = risk_cubes.get(risk)
+            # only existing dimension values, so cached tiles are bounded
+            if dim1 not in cube.dim1_values or dim2 not in cube.dim2_values:
+                return json_response(errors=["Invalid dimension values"], status=400)
+            get_value = lambda code: cube.get_value(code, dim1, dim2)
+
+        key = tiles.get_tile_key(level, region_id, risk, dim1, dim2)
+        data = tiles.tile_cache.get(key, z, x, y)
+        if data is None:
+            data = tiles.build_tile(z, x, y, level, region_id, get_value)
+            tiles.tile_cache.set(key, z, x, y, data)
+        return HttpResponse(data, content_type=tiles.MVT_CONTENT_TYPE)
 
-        features = [self._make_feature(item, app, reg) for item in _features]
-        out = {'type': 'FeatureCollection',
-               'features': features}
-        return json_response(out)
-                           
 
 administrative_division_view = AdministrativeGeometry.as_view()
+administrative_tile_view = AdministrativeTile.as_view()
@@ -1,12 +1,165 @@
-import traceback
 import psycopg2
-
-from optparse import make_option
+from collections import namedtuple
+from io import BytesIO
 
 from django.conf import settings
-from django.core.management import call_command
-from django.core.management.base import BaseCommand, CommandError
-from django.contrib.gis import geos
+from django.core.management.base import CommandError
+
+from risks.models import AdministrativeDivision, Event
+from risks.models import RiskAnalysisAdministrativeDivisionAssociation
+from risks.models import EventAdministrativeDivisionAssociation
+
+# administrative division, as preloaded by ImportContext
+AdmEntry = namedtuple('AdmEntry', 'id code name level parent_code')
+
+
+class ImportContext(object):
+    """
+    Lookups shared by import commands, loaded once per import, so rows
+    can be handled without lookup queries:
+
+     * administrative divisions (of region, if given) by code
+     * events by event id
+     * datastore ids of adm divisions, dimensions and risk analyses,
+       and links between risk analyses and adm divisions
+     * django associations of risk analyses and events with divisions
+
+    Rows inserted during import are added to lookups.
+    """
+
+    def __init__(self, conn=None, region=None):
+        self.conn = conn
+        self.region = region
+        self._adm = None
+        self._events = {}
+        self._adm_fids = None
+        self._dimensions = None
+        self._risk_analyses = {}
+        self._ra_adm_links = {}
+        self._risk_adm = {}
+        self._event_adm = {}
+
+    def use_connection(self, conn):
+        """
+        Sets datastore connection for following rows. Datastore lookups
+        are reloaded for new connection, as rows inserted through previous
+        one may have been rolled back.
+        """
+        if conn is not self.conn:
+            self.conn = conn
+            self._adm_fids = None
+            self._dimensions = None
+            self._risk_analyses = {}
+            self._ra_adm_links = {}
+
+    def _fetch(self, sql, params=None):
+        curs = self.conn.cursor()
+        curs.execute(sql, params)
+        return curs.fetchall()
+
+    def get_adm(self, code):
+        """
+        Returns AdmEntry for code, or None if there's no such division
+        (in region)
+        """
+        if self._adm is None:
+            adms = AdministrativeDivision.objects.all()
+            if self.region is not None:
+                adms = adms.filter(regions=self.region)
+            self._adm = dict((row[1], AdmEntry(*row),)
+                             for row in adms.values_list('id', 'code', 'name', 'level', 'parent__code'))
+        return self._adm.get(code)
+
+    def get_geometry(self, adm):
+        """
+        Returns GEOS geometry of division. It's loaded on demand, as it's
+        needed only for divisions which are not in datastore yet.
+        """
+        return AdministrativeDivision.objects.with_geometry().get(id=adm.id).geometry
+
+    def get_event(self, event_id):
+        if event_id not in self._events:
+            self._events[event_id] = Event.objects.filter(event_id=event_id).first()
+        return self._events[event_id]
+
+    def get_adm_fid(self, adm):
+        """
+        Returns datastore fid of adm division, inserts it if missing
+        """
+        if self._adm_fids is None:
+            self._adm_fids = dict(((code, level,), fid,)
+                                  for fid, code, level in self._fetch("SELECT fid, adm_code, level FROM adm_divisions"))
+        key = (adm.code, adm.level,)
+        if key not in self._adm_fids:
+            self._adm_fids[key] = self._fetch(
+                """INSERT INTO adm_divisions (the_geom, adm_name, adm_code, parent_adm_code, level)
+                   VALUES (%s, %s, %s, %s, %s) RETURNING fid""",
+                (self.get_geometry(adm).ewkt, adm.name, adm.code, adm.parent_code or '', adm.level,))[0][0]
+        return self._adm_fids[key]
+
+    def get_dimension_id(self, dim_col, dim_value, dim_order):
+        """
+        Returns datastore id of dimension value, inserts it if missing
+        """
+        if self._dimensions is None:
+            self._dimensions = dict(((col, value,), dim_id,)
+                                    for dim_id, col, value in self._fetch("SELECT dim_id, dim_col, dim_value FROM dimensions"))
+        key = (dim_col, dim_value,)
+        if key not in self._dimensions:
+            self._dimensions[key] = self._fetch(
+                """INSERT INTO dimensions (dim_col, dim_value, dim_order)
+                   VALUES (%s, %s, %s) RETURNING dim_id""",
+                (dim_col, dim_value, dim_order,))[0][0]
+        return self._dimensions[key]
+
+    def get_risk_analysis_id(self, name, hazard_type):
+        """
+        Returns datastore id of risk analysis, or None if it's missing
+        """
+        key = (name, hazard_type,)
+        if self._risk_analyses.get(key) is None:
+            found = self._fetch("SELECT id FROM risk_analysis WHERE name = %s AND hazard_type = %s ORDER BY id LIMIT 1", key)
+            self._risk_analyses[key] = found[0][0] if found else None
+        return self._risk_analyses[key]
+
+    def link_risk_analysis_adm(self, risk_analysis_id, adm_fid):
+        """
+        Links risk analysis with adm division in datastore
+        """
+        if risk_analysis_id not in self._ra_adm_links:
+            self._ra_adm_links[risk_analysis_id] = set(
+                fid for (fid,) in self._fetch("SELECT adm_fid FROM risk_analysis_adm_divisions WHERE risk_analysis_id = %s",
+                                              (risk_analysis_id,)))
+        links = self._ra_adm_links[risk_analysis_id]
+        if adm_fid not in links:
+            self._fetch("""INSERT INTO risk_analysis_adm_divisions (risk_analysis_id, adm_fid)
+                           VALUES (%s, %s) RETURNING adm_fid""", (risk_analysis_id, adm_fid,))
+            links.add(adm_fid)
+
+    def associate_risk_analysis(self, risk, adm):
+        """
+        Same as get_or_create() of RiskAnalysisAdministrativeDivisionAssociation
+        """
+        if risk.id not in self._risk_adm:
+            self._risk_adm[risk.id] = set(RiskAnalysisAdministrativeDivisionAssociation.objects
+                                                                                      .filter(riskanalysis=risk)
+                                                                                      .values_list('administrativedivision_id', flat=True))
+        if adm.id not in self._risk_adm[risk.id]:
+            RiskAnalysisAdministrativeDivisionAssociation.objects.create(riskanalysis=risk, administrativedivision_id=adm.id)
+            self._risk_adm[risk.id].add(adm.id)
+
+    def associate_event(self, event, adm):
+        """
+        Same as get_or_create() of EventAdministrativeDivisionAssociation
+        """
+        if event.id not in self._event_adm:
+            self._event_adm[event.id] = set(EventAdministrativeDivisionAssociation.objects
+                                                                                 .filter(event=event)
+                                                                                 .values_list('adm_id', flat=True))
+        if adm.id not in self._event_adm[event.id]:
+            EventAdministrativeDivisionAssociation.objects.create(event=event, adm_id=adm.id)
+            self._event_adm[event.id].add(adm.id)
+
 
 class DbUtils:
 
@@ -25,6 +178,24 @@ class DbUtils:
             "dbname='%s' user='%s' port='%s' host='%s' password='%s'" % (db_name, db_user, db_port, db_host, db_passwd)
         )
         return conn
+
+    def _copy_value(self, val):
+        if val is None:
+            return '\\N'
+        if isinstance(val, unicode):
+            val = val.encode('utf-8')
+        return str(val).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def copy_rows(self, curs, table, columns, rows):
+        """
+        Loads rows into table with single COPY (text format)
+        """
+        buf = BytesIO()
+        for row in rows:
+            buf.write('\t'.join(self._copy_value(val) for val in row))
+            buf.write('\n')
+        buf.seek(0)
+        curs.copy_expert('COPY {} ({}) FROM STDIN'.format(table, ', '.join(columns)), buf)
     
     #no longer used
     def insert_aggregate_values(self, conn, values):
@@ -54,52 +225,21 @@ class DbUtils:
 
         curs.execute(insert_template.format(**values))
     
-    def insert_db(self, conn, values, first_call):
-        """Remove spurious records from GeoNode DB"""
+    def insert_db(self, conn, values, first_call, context=None):
+        """
+        Inserts risk value for adm division (values['adm'], AdmEntry)
+        into datastore, with adm division, risk analysis and dimensions
+        if they are missing. Lookups are done through `context`
+        (:py:class:`ImportContext`), which should be shared by all rows
+        of an import.
+        """
+        if context is None:
+            context = ImportContext(conn)
         curs = conn.cursor()
 
-        insert_template = """INSERT INTO adm_divisions (
-                          the_geom,                          
-                          adm_name, adm_code,
-                          parent_adm_code, level)
-                  SELECT '{the_geom}',                          
-                          '{adm_name}', '{adm_code}',
-                          '{parent_adm_code}', {adm_level}
-                  WHERE
-                  NOT EXISTS (SELECT fid FROM adm_divisions WHERE                                        
-                    adm_code = '{adm_code}' AND
-                    level = {adm_level})
-                  RETURNING fid;"""
-
-        curs.execute(insert_template.format(**values))
-        id_of_new_row = curs.fetchone()
-        next_table_fid = None
-        if id_of_new_row:
-            next_table_fid = id_of_new_row[0]
-        else:
-            next_table_fid = None
-
-        if next_table_fid is None:
-            select_template = """SELECT fid FROM adm_divisions WHERE                                        
-                    adm_code = '{adm_code}' AND
-                    level = {adm_level} """
-
-            curs.execute(select_template.format(**values))
-            id_of_new_row = curs.fetchone()
-            if id_of_new_row:
-                next_table_fid = id_of_new_row[0]
-            else:
-                raise CommandError("Could not find adm division on target DB!")
+        next_table_fid = context.get_adm_fid(values['adm'])
 
-        #print('column index = {}'.format(new_adm))
-            
-        select_ra_template = """SELECT id FROM risk_analysis WHERE name = '{risk_analysis}' AND hazard_type = '{hazard_type}'"""
-        curs.execute(select_ra_template.format(**values))
-        id_new_ra = curs.fetchone()
-        if id_new_ra:
-            next_ra_id = id_new_ra[0]
-        else:
-            next_ra_id = None
+        next_ra_id = context.get_risk_analysis_id(values['risk_analysis'], values['hazard_type'])
                 
         if first_call and next_ra_id is None:
             insert_risk_analysis_template = """INSERT INTO risk_analysis (id, name, hazard_type, region)
@@ -120,17 +260,7 @@ class DbUtils:
             if next_ra_id is None:                
                 raise CommandError("Could not find any suitable Risk Analysis on target DB!")
             
-        rel_ids = {
-            'risk_analysis_id': values['risk_analysis_id'],
-            'adm_fid': next_table_fid
-        }
-        
-        insert_adm_risk_analysis_relation_template = """INSERT INTO risk_analysis_adm_divisions (risk_analysis_id, adm_fid)
-            SELECT {risk_analysis_id}, {adm_fid}
-            WHERE NOT EXISTS (SELECT adm_fid FROM risk_analysis_adm_divisions WHERE risk_analysis_id = {risk_analysis_id} AND adm_fid = {adm_fid})
-            RETURNING adm_fid"""
-        #print(insert_adm_risk_analysis_relation_template.format(**rel_ids))
-        curs.execute(insert_adm_risk_analysis_relation_template.format(**rel_ids))
+        context.link_risk_analysis_adm(values['risk_analysis_id'], next_table_fid)
         
         dim_ids = {
             'fid': next_table_fid,
@@ -143,35 +273,7 @@ class DbUtils:
             dim_col = 'dim{}'.format(dim_idx)
             dim_order = 'dim{}_order'.format(dim_idx)
             if values[dim_col]:
-                values['dim_col'] = dim_col
-                values['dim_order'] = values[dim_order]
-                values['dim_value'] = values[dim_col]
-                insert_dimension_template = "INSERT INTO public.dimensions(dim_col, dim_value, dim_order) " +\
-                                            "SELECT %(dim_col)s, %(dim_value)s, %(dim_order)s " +\
-                                            "WHERE NOT EXISTS " +\
-                                            "(SELECT dim_id FROM public.dimensions " +\
-                                            "WHERE dim_col = %(dim_col)s AND dim_value = %(dim_value)s) " +\
-                                            "RETURNING dim_id;"
-
-                curs.execute(insert_dimension_template.format(**values), values)
-                id_of_new_row = curs.fetchone()
-                next_dim_id = None
-                if id_of_new_row:
-                    next_dim_id = id_of_new_row[0]
-
-                if next_dim_id is None:
-                    select_dimension_template = "SELECT dim_id FROM public.dimensions " +\
-                        "WHERE dim_col = %(dim_col)s AND dim_value = %(dim_value)s;"
-
-
-                    curs.execute(select_dimension_template.format(**values), values)
-                    id_of_new_row = curs.fetchone()
-                    if id_of_new_row:
-                        next_dim_id = id_of_new_row[0]
-                    else:
-                        raise CommandError("Could not find any suitable Dimension on target DB!")
-
-                dim_ids[dim_col] = next_dim_id
+                dim_ids[dim_col] = context.get_dimension_id(dim_col, values[dim_col], values[dim_order])
             else:
                 dim_ids[dim_col] = 'NULL'
 
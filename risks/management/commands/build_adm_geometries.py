@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from risks.models import AdministrativeDivision, AdministrativeDivisionGeometry
+from risks.geometry_cache import build_geometries
+from risks.versioning import data_versions
+from risks.adm_tree import adm_tree
+from risks.point_index import adm_point_index
+
+
+class Command(BaseCommand):
+    help = 'Build cached simplified geometries of Administrative Divisions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-a',
+            '--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Rebuild geometries of all divisions, not only missing ones.')
+        return parser
+
+    def handle(self, **options):
+        adms = AdministrativeDivision.objects.all()
+        if not options.get('all'):
+            cached_ids = AdministrativeDivisionGeometry.objects.values('administrativedivision_id')
+            adms = adms.exclude(id__in=cached_ids)
+
+        count = build_geometries(adms)
+        if count:
+            # views, tiles and point index cache data built from geometries
+            data_versions.bump_adm_divisions()
+            adm_tree.invalidate()
+            adm_point_index.invalidate()
+        print("Built cached geometries for {} Administrative Divisions".format(count))
@@ -8,16 +8,15 @@ from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.gis import geos
 
-from risks.models import Region, AdministrativeDivision, Event, RiskAnalysis
+from risks.models import Region, RiskAnalysis
 from risks.models import HazardType, RiskApp
 from risks.models import RiskAnalysisDymensionInfoAssociation
-from risks.models import RiskAnalysisAdministrativeDivisionAssociation
-from risks.models import EventAdministrativeDivisionAssociation
+from risks.versioning import data_versions
 
 import xlrd
 from xlrd.sheet import ctype_text
 
-from action_utils import DbUtils
+from action_utils import DbUtils, ImportContext
 
 
 class Command(BaseCommand):
@@ -90,13 +89,14 @@ class Command(BaseCommand):
         wb = xlrd.open_workbook(filename=excel_file)
         region = Region.objects.get(name=region_name)        
 
-        axis_x = RiskAnalysisDymensionInfoAssociation.objects.filter(riskanalysis=risk, axis='x')
-        axis_y = RiskAnalysisDymensionInfoAssociation.objects.filter(riskanalysis=risk, axis='y')
+        axis_x = dict((x.value, x,) for x in RiskAnalysisDymensionInfoAssociation.objects.filter(riskanalysis=risk, axis='x'))
+        axis_y = dict((y.value, y,) for y in RiskAnalysisDymensionInfoAssociation.objects.filter(riskanalysis=risk, axis='y'))
         
         sheet = wb.sheet_by_index(0)
         row_headers = sheet.row(0)            
         db = DbUtils()
         conn = db.get_db_conn()        
+        context = ImportContext(conn)
         first_call = True
         event_id = ''
                 
@@ -108,17 +108,15 @@ class Command(BaseCommand):
                 dim2 = str(sheet.cell(row_num, 3).value).strip()
                 attribute_value = str(sheet.cell(row_num, 4).value).strip()
                                                                 
-                try:
-                    event = Event.objects.get(event_id=event_id)                                        
-                except Event.DoesNotExist:                        
+                event = context.get_event(event_id)
+                if event is None:
                     raise CommandError('Incorrect Event ID: {}'.format(event_id))                                          
                 
-                if (attribute_value or allow_null_values) and any(x.value == dim1 for x in axis_x) and any(y.value == dim2 for y in axis_y):                    
-                    x = axis_x.get(value=dim1)
-                    y = axis_y.get(value=dim2)                                        
-                    try:
-                        adm_div = AdministrativeDivision.objects.get(code=adm_code)  
-                    except AdministrativeDivision.DoesNotExist:
+                x = axis_x.get(dim1)
+                y = axis_y.get(dim2)
+                if (attribute_value or allow_null_values) and x is not None and y is not None:
+                    adm_div = context.get_adm(adm_code)
+                    if adm_div is None:
                         raise CommandError('No adm unit found with code: {}'.format(adm_code))                  
                         
                     params = {
@@ -131,20 +129,20 @@ class Command(BaseCommand):
                         'y': y,
                         'first_call': first_call,
                         'create_django_association': True,
-                        'conn': conn
+                        'conn': conn,
+                        'context': context
                     }
                     self.handle_row(params)
                     first_call = False
                     nuts3_list = event.nuts3.split(';')
                     for nuts3 in nuts3_list:                        
-                        try:
-                            adm_div = AdministrativeDivision.objects.get(code=nuts3)
-                            params['adm_div'] = adm_div                            
-                            params['create_django_association'] = True if len(nuts3_list) == 1 else False
-                            self.handle_row(params)
-                        except AdministrativeDivision.DoesNotExist:
-                            traceback.print_exc()
-                            pass
+                        adm_div = context.get_adm(nuts3)
+                        if adm_div is None:
+                            print('No adm unit found with code: {}'.format(nuts3))
+                            continue
+                        params['adm_div'] = adm_div                            
+                        params['create_django_association'] = True if len(nuts3_list) == 1 else False
+                        self.handle_row(params)
             
             #following lines are commented because values for every administrative division will be included in excel files
             '''calculate aggregate values for Region (eg. Europe)
@@ -155,6 +153,7 @@ class Command(BaseCommand):
             '''
 
             conn.commit()            
+            data_versions.bump(region, risk)
         except Exception:
             try:
                 conn.rollback()
@@ -169,7 +168,7 @@ class Command(BaseCommand):
     def handle_row(self, params):                 
         db_values = {
             #'table': table_name,  # From rp.layer
-            'the_geom': geos.fromstr(params['adm_div'].geom, srid=params['adm_div'].srid),
+            'adm': params['adm_div'],
             'dim1': params['x'].value,
             'dim1_order': params['x'].order,
             'dim2': params['y'].value,
@@ -180,17 +179,12 @@ class Command(BaseCommand):
             'risk_analysis_id': params['risk'].id,
             'risk_analysis': params['risk'].name,
             'hazard_type': params['risk'].hazard_type.mnemonic,
-            'adm_name': params['adm_div'].name.encode('utf-8').replace("'", "''"),
-            'adm_code': params['adm_div'].code,
             'region': params['region'].name,
-            'adm_level': params['adm_div'].level,
-            'parent_adm_code': params['adm_div'].parent.code,
             'event_id': params['event'].event_id,
             'value': params['attribute_value']
         }
         db = DbUtils()
-        db.insert_db(params['conn'], db_values, params['first_call'])
+        db.insert_db(params['conn'], db_values, params['first_call'], params['context'])
         if params['create_django_association']:
-            risk_adm, created = RiskAnalysisAdministrativeDivisionAssociation.objects.get_or_create(riskanalysis=params['risk'], administrativedivision=params['adm_div'])
-            event_adm, created = EventAdministrativeDivisionAssociation.objects.get_or_create(event=params['event'], adm=params['adm_div'])
-    
\ No newline at end of file
+            params['context'].associate_risk_analysis(params['risk'], params['adm_div'])
+            params['context'].associate_event(params['event'], params['adm_div'])
@@ -1,10 +1,11 @@
 import os
-import traceback
 from optparse import make_option
 from django.conf import settings
 from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
-from risks.models import AdministrativeDivision, AdministrativeData, AdministrativeDivisionDataAssociation
+from risks.models import AdministrativeData, AdministrativeDivisionDataAssociation
+
+from action_utils import ImportContext
 
 import xlrd
 
@@ -40,6 +41,7 @@ class Command(BaseCommand):
         commit = options.get('commit')        
         basedir = "/home/geonode/import_data/countries"
         allowed_extensions = [".xlsx"]
+        context = ImportContext()
                 
         for file in os.listdir(basedir):
             if file.endswith(tuple(allowed_extensions)):                    
@@ -49,30 +51,39 @@ class Command(BaseCommand):
                     print('start importing {}'.format(dataset))
                     sheet = wb.sheet_by_name(dataset)
                     row_headers = sheet.row(0)
+                    admin_data, created = AdministrativeData.objects.get_or_create(name=dataset)
+                    # (adm id, dimension) -> (association id, value)
+                    associations = dict(((adm_id, dimension,), (pk, value,))
+                                        for pk, adm_id, dimension, value in AdministrativeDivisionDataAssociation.objects
+                                                                                                                 .filter(data=admin_data)
+                                                                                                                 .values_list('id', 'adm_id', 'dimension', 'value'))
                     col_num = 0
                     for idx, cell_obj in enumerate(row_headers):
                         col_num += 1
                         if idx >= FIRST_VALUE_COLUMN:  
                             print('coloumn n. {}'.format(idx))
+                            dimension = unicode(to_int_if_number(sheet.cell(0, idx).value))
                             for row_num in range(1, sheet.nrows):
                                 adm_code = sheet.cell(row_num, ADMCODE).value
-                                try:
-                                    adm_div = AdministrativeDivision.objects.get(code=adm_code)                                        
-                                except AdministrativeDivision.DoesNotExist:
-                                    traceback.print_exc()
-                                    pass
+                                adm_div = context.get_adm(adm_code)
+                                if adm_div is None:
+                                    print('No adm unit found with code: {}'.format(adm_code))
+                                    continue
                                 
-                                dimension = to_int_if_number(sheet.cell(0, idx).value)
                                 value = sheet.cell(row_num, idx).value
                                 if value:
-                                    admin_data, created = AdministrativeData.objects.get_or_create(name=dataset)
-                                    association, created = AdministrativeDivisionDataAssociation.objects.get_or_create(
-                                        adm=adm_div,
-                                        data=admin_data,
-                                        dimension=dimension
-                                    )
-                                    association_updated = AdministrativeDivisionDataAssociation.objects.filter(pk=association.pk).update(value=value)                                
+                                    key = (adm_div.id, dimension,)
+                                    if key not in associations:
+                                        association = AdministrativeDivisionDataAssociation.objects.create(
+                                            adm_id=adm_div.id,
+                                            data=admin_data,
+                                            dimension=dimension,
+                                            value=value
+                                        )
+                                        associations[key] = (association.pk, unicode(value),)
+                                    elif associations[key][1] != unicode(value):
+                                        AdministrativeDivisionDataAssociation.objects.filter(pk=associations[key][0]).update(value=value)
+                                        associations[key] = (associations[key][0], unicode(value),)
 
                                 
                                     print('Imported data: ADM = {} - TYPE = {} - DIMENSION = {} - VALUE = {}'.format(adm_div.code, dataset, dimension, value))
-                                    
\ No newline at end of file
@@ -21,17 +21,20 @@
 import traceback
 import psycopg2
 
+from collections import OrderedDict
 from optparse import make_option
 
 from django.conf import settings
 from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
-from django.contrib.gis import geos
 
 from risks.models import Region, AdministrativeDivision
 from risks.models import RiskAnalysis, RiskApp
 from risks.models import RiskAnalysisDymensionInfoAssociation
 from risks.models import RiskAnalysisAdministrativeDivisionAssociation
+from risks.cube import risk_cubes
+from risks.versioning import data_versions
+from action_utils import AdmEntry, DbUtils, ImportContext
 
 import xlrd
 from xlrd.sheet import ctype_text
@@ -82,6 +85,13 @@ class Command(BaseCommand):
             default=RiskApp.APP_DATA_EXTRACTION,
             help="Name of Risk App, default: {}".format(RiskApp.APP_DATA_EXTRACTION),
             )
+        parser.add_argument(
+            '-b',
+            '--bulk',
+            action='store_true',
+            dest='bulk',
+            default=False,
+            help='Loads whole workbook at once with COPY (Data Extraction app only).')
         return parser
 
     def handle(self, **options):
@@ -91,6 +101,7 @@ class Command(BaseCommand):
         risk_analysis = options.get('risk_analysis')
         excel_metadata_file = options.get('excel_metadata_file')
         risk_app =  options.get('risk_app')
+        bulk = options.get('bulk')
         app = RiskApp.objects.get(name=risk_app)
 
         if region is None:
@@ -117,148 +128,153 @@ class Command(BaseCommand):
         table_name = risk.layer.typename.split(":")[1] \
             if ":" in risk.layer.typename else risk.layer.typename
 
-        for scenario in scenarios:
-            # Dump Vectorial Data from DB
-            datastore = settings.OGC_SERVER['default']['DATASTORE']
-            if (datastore):
-                ogc_db_name = settings.DATABASES[datastore]['NAME']
-                ogc_db_user = settings.DATABASES[datastore]['USER']
-                ogc_db_passwd = settings.DATABASES[datastore]['PASSWORD']
-                ogc_db_host = settings.DATABASES[datastore]['HOST']
-                ogc_db_port = settings.DATABASES[datastore]['PORT']
-
-            sheet = wb.sheet_by_name(scenario.value)
-            row_headers = sheet.row(0)
-            for rp_idx, rp in enumerate(round_periods):
-                col_num = -1
-                if app.name == RiskApp.APP_DATA_EXTRACTION:
-                    for idx, cell_obj in enumerate(row_headers):
-                        # cell_type_str = ctype_text.get(cell_obj.ctype, 'unknown type')
-                        # print('(%s) %s %s' % (idx, cell_type_str, cell_obj.value))
-                        try:
-                            # if int(cell_obj.value) == int(rp.value):
-                            # print('{} =? {}'.format(rp.value, cell_obj.value))
-                            if self.to_int_if_number(str(cell_obj.value).strip()) == self.to_int_if_number(str(rp.value).strip()):
-                                # print('[%s] (%s) RP-%s' % (scenario.value, idx, rp.value))
-                                col_num = idx
-                                break
-                        except:
-                            traceback.print_exc()
-                            pass
-                elif app.name == RiskApp.APP_COST_BENEFIT:
-                     col_num = 0
+        # scenario/round period imports which failed, and whether any
+        # changes were committed to datastore
+        failed = []
+        imported = False
+        if bulk and app.name == RiskApp.APP_DATA_EXTRACTION:
+            conn = DbUtils().get_db_conn()
+            try:
+                self.bulk_import(conn, risk, region, self.read_rows(wb, scenarios, round_periods))
+                conn.commit()
+                imported = True
+            except Exception:
+                try:
+                    conn.rollback()
+                except:
+                    pass
+                raise
+            finally:
+                conn.close()
+        else:
+            # adm divisions, dimensions etc. are looked up once per import
+            context = ImportContext(region=region)
+            for scenario in scenarios:
+                # Dump Vectorial Data from DB
+                datastore = settings.OGC_SERVER['default']['DATASTORE']
+                if (datastore):
+                    ogc_db_name = settings.DATABASES[datastore]['NAME']
+                    ogc_db_user = settings.DATABASES[datastore]['USER']
+                    ogc_db_passwd = settings.DATABASES[datastore]['PASSWORD']
+                    ogc_db_host = settings.DATABASES[datastore]['HOST']
+                    ogc_db_port = settings.DATABASES[datastore]['PORT']
+
+                sheet = wb.sheet_by_name(scenario.value)
+                row_headers = sheet.row(0)
+                for rp_idx, rp in enumerate(round_periods):
+                    col_num = -1
+                    if app.name == RiskApp.APP_DATA_EXTRACTION:
+                        for idx, cell_obj in enumerate(row_headers):
+                            # cell_type_str = ctype_text.get(cell_obj.ctype, 'unknown type')
+                            # print('(%s) %s %s' % (idx, cell_type_str, cell_obj.value))
+                            try:
+                                # if int(cell_obj.value) == int(rp.value):
+                                # print('{} =? {}'.format(rp.value, cell_obj.value))
+                                if self.to_int_if_number(str(cell_obj.value).strip()) == self.to_int_if_number(str(rp.value).strip()):
+                                    # print('[%s] (%s) RP-%s' % (scenario.value, idx, rp.value))
+                                    col_num = idx
+                                    break
+                            except:
+                                traceback.print_exc()
+                                pass
+                    elif app.name == RiskApp.APP_COST_BENEFIT:
+                         col_num = 0
                                 
-                if col_num >= 0:                    
-                    conn = self.get_db_conn(ogc_db_name, ogc_db_user, ogc_db_port, ogc_db_host, ogc_db_passwd)
-                    try:
-                        if app.name == RiskApp.APP_DATA_EXTRACTION:
-                            for row_num in range(1, sheet.nrows):
-                                cell_obj = sheet.cell(row_num, 5)
-                                iso_country = str(sheet.cell(row_num, 2).value)[:2]
-                                cell_type_str = ctype_text.get(cell_obj.ctype, 'unknown type')
-                                value = sheet.cell(row_num, col_num).value if self.is_number(sheet.cell(row_num, col_num).value) else None
-                                # print('(%s) %s %s' % (idx, cell_type_str, cell_obj.value))
-                                if cell_obj.value and value is not None:
-                                    adm_code = cell_obj.value \
-                                        if cell_type_str == 'text' \
-                                        else iso_country + '{:05d}'.format(int(cell_obj.value))
-                                    print('adm code read from cell: {}'.format(adm_code))
+                    if col_num >= 0:                    
+                        conn = self.get_db_conn(ogc_db_name, ogc_db_user, ogc_db_port, ogc_db_host, ogc_db_passwd)
+                        context.use_connection(conn)
+                        try:
+                            if app.name == RiskApp.APP_DATA_EXTRACTION:
+                                for row_num in range(1, sheet.nrows):
+                                    cell_obj = sheet.cell(row_num, 5)
+                                    iso_country = str(sheet.cell(row_num, 2).value)[:2]
+                                    cell_type_str = ctype_text.get(cell_obj.ctype, 'unknown type')
+                                    value = sheet.cell(row_num, col_num).value if self.is_number(sheet.cell(row_num, col_num).value) else None
+                                    # print('(%s) %s %s' % (idx, cell_type_str, cell_obj.value))
+                                    if cell_obj.value and value is not None:
+                                        adm_code = cell_obj.value \
+                                            if cell_type_str == 'text' \
+                                            else iso_country + '{:05d}'.format(int(cell_obj.value))
+                                        print('adm code read from cell: {}'.format(adm_code))
                                     
-                                    #check if exists ADM unit with given code and if ADM unit belongs to given region
-                                    try:
-                                        adm_div = AdministrativeDivision.objects.get(code=adm_code)
-                                        region_match = adm_div.regions.get(name=region.name)
-                                    except AdministrativeDivision.DoesNotExist:
-                                        traceback.print_exc()
-                                        pass                                    
+                                        #check if exists ADM unit with given code and if ADM unit belongs to given region
+                                        adm_div = context.get_adm(adm_code)
+                                        if adm_div is None:
+                                            print('no adm unit with code {} in region {}'.format(adm_code, region.name))
+                                            continue
                                     
-                                    parent_adm_div = None
-                                    if adm_div.parent is not None:
-                                        try:                                            
-                                            parent_adm_div = AdministrativeDivision.objects.get(id=adm_div.parent.id)                                        
-                                        except AdministrativeDivision.DoesNotExist:
-                                            traceback.print_exc()
-                                            pass
-                                    #print('parent_adm_div = {}'.format(parent_adm_div.name))
+                                        #print('[%s] (%s) %s (%s) / %s' % (scenario.value, rp.value, adm_div.name.encode('utf-8'), adm_code, value))
+                                        print('[%s] (%s) (%s) / %s' % (scenario.value, rp.value, adm_code, value))
+
+                                        db_values = {
+                                            'table': table_name,  # From rp.layer
+                                            'adm': adm_div,
+                                            'dim1': scenario.value,
+                                            'dim1_order': scenario.order,
+                                            'dim2': rp.value,
+                                            'dim2_order': rp.order,
+                                            'dim3': None,
+                                            'dim4': None,
+                                            'dim5': None,
+                                            'risk_analysis_id': risk.id,
+                                            'risk_analysis': risk_analysis,
+                                            'hazard_type': risk.hazard_type.mnemonic,
+                                            'region': region.name,
+                                            'value': value
+                                        }
+                                        self.insert_db(conn, db_values, rp_idx, context)
+                                        context.associate_risk_analysis(risk, adm_div)
                                     
-                                    #print('[%s] (%s) %s (%s) / %s' % (scenario.value, rp.value, adm_div.name.encode('utf-8'), adm_code, value))
-                                    print('[%s] (%s) (%s) / %s' % (scenario.value, rp.value, adm_code, value))
+                            elif app.name == RiskApp.APP_COST_BENEFIT:
+                                cell_obj = sheet.cell(rp_idx + 1, 0)
+                                cell_type_str = ctype_text.get(cell_obj.ctype, 'unknown type')
+                                if cell_obj.value:
+                                    adm = AdministrativeDivision.objects.select_related('parent').get(name=region)
+                                    adm_div = AdmEntry(adm.id, adm.code, adm.name, adm.level,
+                                                       adm.parent.code if adm.parent is not None else None)
+                                    value = sheet.cell_value(rp_idx + 1, 1)
+                                    print('[%s] (%s) %s / %s' % (scenario.value, rp.value, adm_div.name, value))
 
                                     db_values = {
-                                        'table': table_name,  # From rp.layer
-                                        'the_geom': geos.fromstr(adm_div.geom, srid=adm_div.srid),
-                                        'dim1': scenario.value,
-                                        'dim1_order': scenario.order,
-                                        'dim2': rp.value,
-                                        'dim2_order': rp.order,
-                                        'dim3': None,
-                                        'dim4': None,
-                                        'dim5': None,
-                                        'risk_analysis_id': risk.id,
-                                        'risk_analysis': risk_analysis,
-                                        'hazard_type': risk.hazard_type.mnemonic,
-                                        'adm_name': adm_div.name.encode('utf-8').replace("'", "''"),
-                                        'adm_code': adm_div.code,
-                                        'region': region.name,
-                                        'adm_level': adm_div.level,
-                                        'parent_adm_code': '' if parent_adm_div is None else parent_adm_div.code,
-                                        'value': value
+                                    'table': table_name,  # From rp.layer
+                                    'adm': adm_div,
+                                    'dim1': scenario.value,
+                                    'dim1_order': scenario.order,
+                                    'dim2': rp.value,
+                                    'dim2_order': rp.order,
+                                    'dim3': None,
+                                    'dim4': None,
+                                    'dim5': None,
+                                    'risk_analysis_id': risk.id,
+                                    'risk_analysis': risk_analysis,
+                                    'hazard_type': risk.hazard_type.mnemonic,
+                                    'region': region.name,
+                                    'value': value
                                     }
-                                    self.insert_db(conn, db_values, rp_idx)
-                                    '''risk_adm = RiskAnalysisAdministrativeDivisionAssociation.\
-                                        objects.\
-                                        filter(riskanalysis=risk, administrativedivision=adm_div)
-                                    if len(risk_adm) == 0:
-                                        RiskAnalysisAdministrativeDivisionAssociation.\
-                                            objects.\
-                                            create(riskanalysis=risk, administrativedivision=adm_div)'''
-                                    risk_adm, created = RiskAnalysisAdministrativeDivisionAssociation.objects.get_or_create(riskanalysis=risk, administrativedivision=adm_div)
-                                    
-                        elif app.name == RiskApp.APP_COST_BENEFIT:
-                            cell_obj = sheet.cell(rp_idx + 1, 0)
-                            cell_type_str = ctype_text.get(cell_obj.ctype, 'unknown type')
-                            if cell_obj.value:
-                                adm_div = AdministrativeDivision.objects.get(name=region)
-                                value = sheet.cell_value(rp_idx + 1, 1)
-                                print('[%s] (%s) %s / %s' % (scenario.value, rp.value, adm_div.name, value))
-
-                                db_values = {
-                                'table': table_name,  # From rp.layer
-                                'the_geom': geos.fromstr(adm_div.geom, srid=adm_div.srid),
-                                'dim1': scenario.value,
-                                'dim1_order': scenario.order,
-                                'dim2': rp.value,
-                                'dim2_order': rp.order,
-                                'dim3': None,
-                                'dim4': None,
-                                'dim5': None,
-                                'risk_analysis': risk_analysis,
-                                'hazard_type': risk.hazard_type.mnemonic,
-                                'adm_name': adm_div.name.encode('utf-8').replace("'", "''"),
-                                'adm_code': adm_div.code,
-                                'region': region.name,
-                                'value': value
-                                }
-                                self.insert_db(conn, db_values, rp_idx)
-                                risk_adm = RiskAnalysisAdministrativeDivisionAssociation.\
-                                objects.\
-                                filter(riskanalysis=risk, administrativedivision=adm_div)
-                                if len(risk_adm) == 0:
-                                    RiskAnalysisAdministrativeDivisionAssociation.\
-                                    objects.\
-                                    create(riskanalysis=risk, administrativedivision=adm_div)
-
-                        # Finished Import: Commit on DB
-                        conn.commit()
-                    except Exception:
-                        try:
-                            conn.rollback()
-                        except:
-                            pass
+                                    self.insert_db(conn, db_values, rp_idx, context)
+                                    context.associate_risk_analysis(risk, adm_div)
+
+                            # Finished Import: Commit on DB
+                            conn.commit()
+                            imported = True
+                        except Exception:
+                            try:
+                                conn.rollback()
+                            except:
+                                pass
 
-                        traceback.print_exc()
-                    finally:
-                        conn.close()
+                            traceback.print_exc()
+                            failed.append('{} / {}'.format(scenario.value, rp.value))
+                        finally:
+                            conn.close()
+
+        # Invalidate cached data of the analysis if anything was written
+        if imported:
+            data_versions.bump(region, risk)
+        if failed:
+            raise CommandError("Import of Risk Data failed for: {}".format(', '.join(failed)))
+        # Refresh precomputed values for the analysis
+        risk_cubes.rebuild(risk)
 
         # Import or Update Metadata if Metadata File has been specified/found
         if excel_metadata_file:
@@ -277,6 +293,145 @@ class Command(BaseCommand):
 
         return risk_analysis
 
+    BULK_TEMP_TABLES = """CREATE TEMP TABLE import_adm (
+                              adm_code text, level integer) ON COMMIT DROP;
+                          CREATE TEMP TABLE import_adm_geom (
+                              adm_code text, adm_name text, parent_adm_code text,
+                              level integer, the_geom text) ON COMMIT DROP;
+                          CREATE TEMP TABLE import_values (
+                              adm_code text, dim1_value text, dim1_order integer,
+                              dim2_value text, dim2_order integer, value text) ON COMMIT DROP;"""
+
+    # staged adm divisions not present in datastore yet
+    BULK_MISSING_ADM_SQL = """SELECT i.adm_code FROM import_adm i
+                              WHERE NOT EXISTS (SELECT fid FROM adm_divisions a
+                                                WHERE a.adm_code = i.adm_code AND a.level = i.level)"""
+
+    # same steps as insert_db(), for all staged rows at once
+    BULK_IMPORT_SQL = (
+        """INSERT INTO adm_divisions (the_geom, adm_name, adm_code, parent_adm_code, level)
+           SELECT g.the_geom::geometry, g.adm_name, g.adm_code, g.parent_adm_code, g.level
+           FROM import_adm_geom g""",
+        """INSERT INTO risk_analysis (id, name, hazard_type, region)
+           SELECT %(risk_analysis_id)s, %(risk_analysis)s, %(hazard_type)s, %(region)s
+           WHERE NOT EXISTS (SELECT id FROM risk_analysis
+                             WHERE name = %(risk_analysis)s AND hazard_type = %(hazard_type)s)""",
+        """INSERT INTO risk_analysis_adm_divisions (risk_analysis_id, adm_fid)
+           SELECT %(risk_analysis_id)s, a.fid
+           FROM import_adm i
+           JOIN adm_divisions a ON a.adm_code = i.adm_code AND a.level = i.level
+           WHERE NOT EXISTS (SELECT adm_fid FROM risk_analysis_adm_divisions r
+                             WHERE r.risk_analysis_id = %(risk_analysis_id)s AND r.adm_fid = a.fid)""",
+        """INSERT INTO dimensions (dim_col, dim_value, dim_order)
+           SELECT DISTINCT ON (v.dim1_value) 'dim1', v.dim1_value, v.dim1_order
+           FROM import_values v
+           WHERE NOT EXISTS (SELECT dim_id FROM dimensions d
+                             WHERE d.dim_col = 'dim1' AND d.dim_value = v.dim1_value)""",
+        """INSERT INTO dimensions (dim_col, dim_value, dim_order)
+           SELECT DISTINCT ON (v.dim2_value) 'dim2', v.dim2_value, v.dim2_order
+           FROM import_values v
+           WHERE NOT EXISTS (SELECT dim_id FROM dimensions d
+                             WHERE d.dim_col = 'dim2' AND d.dim_value = v.dim2_value)""",
+        """INSERT INTO risk_dimensions (adm_fid, risk_analysis_id, dim1_id, dim2_id, dim3_id, dim4_id, dim5_id, value, event_id)
+           SELECT a.fid,
+                  -- first one, as in insert_db(): there may be a row per region
+                  (SELECT id FROM risk_analysis
+                   WHERE name = %(risk_analysis)s AND hazard_type = %(hazard_type)s
+                   ORDER BY id LIMIT 1),
+                  d1.dim_id, d2.dim_id, NULL, NULL, NULL, v.value, ''
+           FROM import_values v
+           JOIN import_adm i ON i.adm_code = v.adm_code
+           JOIN adm_divisions a ON a.adm_code = i.adm_code AND a.level = i.level
+           JOIN dimensions d1 ON d1.dim_col = 'dim1' AND d1.dim_value = v.dim1_value
+           JOIN dimensions d2 ON d2.dim_col = 'dim2' AND d2.dim_value = v.dim2_value
+           ON CONFLICT (adm_fid, dim1_id, dim2_id, risk_analysis_id, event_id) DO UPDATE
+           SET value = excluded.value""",
+    )
+
+    def find_column(self, row_headers, rp):
+        """
+        Returns index of column for round period, or -1
+        """
+        for idx, cell_obj in enumerate(row_headers):
+            if self.to_int_if_number(unicode(cell_obj.value).strip()) == self.to_int_if_number(unicode(rp.value).strip()):
+                return idx
+        return -1
+
+    def read_rows(self, wb, scenarios, round_periods):
+        """
+        Reads whole workbook into (adm_code, dim1 value, dim1 order,
+        dim2 value, dim2 order, value) rows. Value read last wins
+        for repeated cells, same as with row by row import.
+        """
+        rows = OrderedDict()
+        for scenario in scenarios:
+            sheet = wb.sheet_by_name(scenario.value)
+            row_headers = sheet.row(0)
+            for rp in round_periods:
+                col_num = self.find_column(row_headers, rp)
+                if col_num < 0:
+                    continue
+                for row_num in range(1, sheet.nrows):
+                    cell_obj = sheet.cell(row_num, 5)
+                    value = sheet.cell(row_num, col_num).value
+                    if not cell_obj.value or not self.is_number(value):
+                        continue
+                    if ctype_text.get(cell_obj.ctype, 'unknown type') == 'text':
+                        adm_code = cell_obj.value
+                    else:
+                        iso_country = str(sheet.cell(row_num, 2).value)[:2]
+                        adm_code = iso_country + '{:05d}'.format(int(cell_obj.value))
+                    rows[(adm_code, scenario.value, rp.value,)] = (adm_code, scenario.value, scenario.order,
+                                                                   rp.value, rp.order, '{}'.format(value),)
+        return rows.values()
+
+    def bulk_import(self, conn, risk, region, rows):
+        """
+        Loads rows into datastore: stages them with COPY, then resolves
+        adm divisions, risk analysis and dimensions and upserts values
+        with set-based statements.
+        """
+        context = ImportContext(conn, region)
+        codes = set(row[0] for row in rows)
+        adm_divs = dict((code, context.get_adm(code),) for code in codes)
+        missing = set(code for code, adm in adm_divs.iteritems() if adm is None)
+        if missing:
+            print('skipping adm codes not found in region {}: {}'.format(region.name, ', '.join(sorted(missing))))
+            rows = [row for row in rows if row[0] not in missing]
+            for code in missing:
+                del adm_divs[code]
+
+        db = DbUtils()
+        curs = conn.cursor()
+        curs.execute(self.BULK_TEMP_TABLES)
+        db.copy_rows(curs, 'import_adm', ('adm_code', 'level',),
+                     [(adm.code, adm.level,) for adm in adm_divs.itervalues()])
+        db.copy_rows(curs, 'import_values', ('adm_code', 'dim1_value', 'dim1_order', 'dim2_value', 'dim2_order', 'value',),
+                     rows)
+
+        # geometries are loaded and sent only for divisions new in datastore
+        curs.execute(self.BULK_MISSING_ADM_SQL)
+        new_ids = [adm_divs[code].id for (code,) in curs.fetchall()]
+        db.copy_rows(curs, 'import_adm_geom', ('adm_code', 'adm_name', 'parent_adm_code', 'level', 'the_geom',),
+                     [(adm.code, adm.name, adm.parent.code if adm.parent else '', adm.level, adm.geometry.ewkt,)
+                      for adm in AdministrativeDivision.objects.with_geometry()
+                                                               .filter(id__in=new_ids)
+                                                               .select_related('parent')])
+
+        params = {'risk_analysis_id': risk.id,
+                  'risk_analysis': risk.name,
+                  'hazard_type': risk.hazard_type.mnemonic,
+                  'region': region.name}
+        for sql in self.BULK_IMPORT_SQL:
+            curs.execute(sql, params)
+        print('imported {} values for {} adm divisions'.format(curs.rowcount, len(adm_divs)))
+
+        existing = set(RiskAnalysisAdministrativeDivisionAssociation.objects.filter(riskanalysis=risk)
+                                                                       .values_list('administrativedivision_id', flat=True))
+        RiskAnalysisAdministrativeDivisionAssociation.objects.bulk_create(
+            [RiskAnalysisAdministrativeDivisionAssociation(riskanalysis=risk, administrativedivision_id=adm.id)
+             for adm in adm_divs.itervalues() if adm.id not in existing])
+
     def get_db_conn(self, db_name, db_user, db_port, db_host, db_passwd):
         """Get db conn (GeoNode)"""
         db_host = db_host if db_host is not None else 'localhost'
@@ -286,60 +441,20 @@ class Command(BaseCommand):
         )
         return conn
 
-    def insert_db(self, conn, values, column_index):
-        """Remove spurious records from GeoNode DB"""
+    def insert_db(self, conn, values, column_index, context):
+        """Insert risk value for adm division (values['adm']) into datastore"""
         curs = conn.cursor()
 
         #check adm divisions
-        select_template = """SELECT fid FROM adm_divisions WHERE                                        
-                adm_code = '{adm_code}' AND
-                level = {adm_level}"""
-
-        curs.execute(select_template.format(**values))
-        id_of_new_row = curs.fetchone()
-        if id_of_new_row:
-            next_table_fid = id_of_new_row[0]
-        else:
-            next_table_fid = None
+        next_table_fid = context.get_adm_fid(values['adm'])
 
         #check risk analysis
-        select_ra_template = """SELECT id FROM risk_analysis WHERE name = '{risk_analysis}' AND hazard_type = '{hazard_type}'"""
-        curs.execute(select_ra_template.format(**values))
-        id_new_ra = curs.fetchone()
-        if id_new_ra:
-            next_ra_id = id_new_ra[0]
-        else:
-            next_ra_id = None
+        next_ra_id = context.get_risk_analysis_id(values['risk_analysis'], values['hazard_type'])
 
         if int(column_index) == 0:
-            if next_table_fid is None:
-                insert_template = """INSERT INTO adm_divisions (
-                                the_geom,                          
-                                adm_name, adm_code,
-                                parent_adm_code, level)
-                        SELECT '{the_geom}',                          
-                                '{adm_name}', '{adm_code}',
-                                '{parent_adm_code}', {adm_level}
-                        WHERE
-                        NOT EXISTS (SELECT fid FROM adm_divisions WHERE                                        
-                            adm_code = '{adm_code}' AND
-                            level = {adm_level})
-                        RETURNING fid;"""
-
-                curs.execute(insert_template.format(**values))
-                id_of_new_row = curs.fetchone()
-            
-                if id_of_new_row:
-                    next_table_fid = id_of_new_row[0]
-                else:
-                    next_table_fid = None
-
-            if next_table_fid is None:                                            
-                raise CommandError("Couldn' insert adm division!")
-
             if next_ra_id is None:
-                insert_risk_analysis_template = """INSERT INTO risk_analysis (id, name, hazard_type)
-                    SELECT {risk_analysis_id}, '{risk_analysis}', '{hazard_type}'
+                insert_risk_analysis_template = """INSERT INTO risk_analysis (id, name, hazard_type, region)
+                    SELECT {risk_analysis_id}, '{risk_analysis}', '{hazard_type}', '{region}'
                     WHERE
                     NOT EXISTS (SELECT id FROM risk_analysis WHERE
                         name = '{risk_analysis}' AND
@@ -355,16 +470,7 @@ class Command(BaseCommand):
                 if next_ra_id is None:                
                     raise CommandError("Could not find any suitable Risk Analysis on target DB!")
             
-            rel_ids = {
-                'risk_analysis_id': values['risk_analysis_id'],
-                'adm_fid': next_table_fid
-            }
-            insert_adm_risk_analysis_relation_template = """INSERT INTO risk_analysis_adm_divisions (risk_analysis_id, adm_fid)
-                SELECT {risk_analysis_id}, {adm_fid}
-                WHERE NOT EXISTS (SELECT adm_fid FROM risk_analysis_adm_divisions WHERE risk_analysis_id = {risk_analysis_id} AND adm_fid = {adm_fid})
-                RETURNING adm_fid"""
-            #print(insert_adm_risk_analysis_relation_template.format(**rel_ids))
-            curs.execute(insert_adm_risk_analysis_relation_template.format(**rel_ids))
+            context.link_risk_analysis_adm(values['risk_analysis_id'], next_table_fid)
         
         dim_ids = {
             'fid': next_table_fid,
@@ -376,35 +482,7 @@ class Command(BaseCommand):
             dim_col = 'dim{}'.format(dim_idx)
             dim_order = 'dim{}_order'.format(dim_idx)
             if values[dim_col]:
-                values['dim_col'] = dim_col
-                values['dim_order'] = values[dim_order]
-                values['dim_value'] = values[dim_col]
-                insert_dimension_template = "INSERT INTO public.dimensions(dim_col, dim_value, dim_order) " +\
-                                            "SELECT %(dim_col)s, %(dim_value)s, %(dim_order)s " +\
-                                            "WHERE NOT EXISTS " +\
-                                            "(SELECT dim_id FROM public.dimensions " +\
-                                            "WHERE dim_col = %(dim_col)s AND dim_value = %(dim_value)s) " +\
-                                            "RETURNING dim_id;"
-
-                curs.execute(insert_dimension_template.format(**values), values)
-                id_of_new_row = curs.fetchone()
-                next_dim_id = None
-                if id_of_new_row:
-                    next_dim_id = id_of_new_row[0]
-
-                if next_dim_id is None:
-                    select_dimension_template = "SELECT dim_id FROM public.dimensions " +\
-                        "WHERE dim_col = %(dim_col)s AND dim_value = %(dim_value)s;"
-
-
-                    curs.execute(select_dimension_template.format(**values), values)
-                    id_of_new_row = curs.fetchone()
-                    if id_of_new_row:
-                        next_dim_id = id_of_new_row[0]
-                    else:
-                        raise CommandError("Could not find any suitable Dimension on target DB!")
-
-                dim_ids[dim_col] = next_dim_id
+                dim_ids[dim_col] = context.get_dimension_id(dim_col, values[dim_col], values[dim_order])
             else:
                 dim_ids[dim_col] = 'NULL'
 
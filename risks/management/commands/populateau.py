@@ -26,6 +26,10 @@ from django.contrib.gis import geos
 from mptt.managers import TreeManager
 
 from risks.models import Region, AdministrativeDivision, RegionAdministrativeDivisionAssociation 
+from risks.versioning import data_versions
+from risks.adm_tree import adm_tree
+from risks.point_index import adm_point_index
+from risks.geometry_cache import build_geometries
 
 
 class Command(BaseCommand):
@@ -105,6 +109,9 @@ is mandatory")
         #AdministrativeDivision.objects.rebuild()
         #print('rebuilding complete!')                                            
 
+        # codes of imported divisions, their cached geometries are rebuilt
+        imported_codes = []
+
         for layer in ds:
             print('Layer "%s": %i %ss' %
                   (layer.name, len(layer), layer.geom_type.name))
@@ -130,19 +137,21 @@ is mandatory")
                 if isinstance(geom, geos.Polygon):
                     geom = geos.MultiPolygon(geom)
 
+                imported_codes.append(feat.get('HRPcode' if adm_level == 0 else 'HRpcode'))
+
                 if adm_level == 0:
                     (adm_division, is_new_amdiv) = \
-                        AdministrativeDivision.objects.get_or_create(
+                        AdministrativeDivision.objects.with_geometry().get_or_create(
                             code=feat.get('HRPcode'),
                             defaults=dict(
                                 name=feat.get('HRname'),
-                                geom=geom.wkt                                
+                                **AdministrativeDivision.geometry_fields(geom)
                             )
                         )                    
 
                     if not is_new_amdiv:
                         adm_division.name = feat.get('HRname')
-                        adm_division.geom = geom.wkt                        
+                        adm_division.set_geometry(geom)
                         adm_division.save()
                     else:
                         #region_obj.administrative_divisions.add(adm_division)
@@ -153,18 +162,18 @@ is mandatory")
                         AdministrativeDivision.objects.get(
                             code=feat.get('HRparent'))
                     (adm_division, is_new_amdiv) = \
-                        AdministrativeDivision.objects.get_or_create(
+                        AdministrativeDivision.objects.with_geometry().get_or_create(
                             code=feat.get('HRpcode'),
                             defaults=dict(
                                 name=feat.get('HRname'),
-                                geom=geom.wkt,                                
-                                parent=adm_division_0
+                                parent=adm_division_0,
+                                **AdministrativeDivision.geometry_fields(geom)
                             )
                         )
 
                     if not is_new_amdiv:
                         adm_division.name = feat.get('HRname')
-                        adm_division.geom = geom.wkt                        
+                        adm_division.set_geometry(geom)
                         adm_division.parent = adm_division_0
                         adm_division.save()
                     else:
@@ -174,18 +183,18 @@ is mandatory")
                 if adm_level == 2:
                     print('region = {}'.format(feat))
                     adm_division_1 = AdministrativeDivision.objects.get(code=feat.get('HRparent'))
-                    (adm_division, is_new_amdiv) = AdministrativeDivision.objects.get_or_create(
+                    (adm_division, is_new_amdiv) = AdministrativeDivision.objects.with_geometry().get_or_create(
                         code=feat.get('HRpcode'),
                         defaults=dict(
                             name=feat.get('HRname'),
-                            geom=geom.wkt,                            
-                            parent=adm_division_1
+                            parent=adm_division_1,
+                            **AdministrativeDivision.geometry_fields(geom)
                         )
                     )
 
                     if not is_new_amdiv:
                         adm_division.name = feat.get('HRname')
-                        adm_division.geom = geom.wkt                        
+                        adm_division.set_geometry(geom)
                         adm_division.parent = adm_division_1
                         adm_division.save()
                     else:
@@ -222,9 +231,9 @@ is mandatory")
                                         
                     lookup_obj = AdministrativeDivision.objects.filter(code=feat.get('HRpcode'))
                     if lookup_obj.exists():
-                        adm_division = AdministrativeDivision.objects.get(code=feat.get('HRpcode'))
+                        adm_division = AdministrativeDivision.objects.with_geometry().get(code=feat.get('HRpcode'))
                         adm_division.name = feat.get('HRname')
-                        adm_division.geom = geom.wkt                        
+                        adm_division.set_geometry(geom)
                         adm_division.parent = adm_division_2
                         adm_division.save()
                         association, created = RegionAdministrativeDivisionAssociation.objects.get_or_create(region=region_obj, administrativedivision=adm_division)                        
@@ -233,12 +242,12 @@ is mandatory")
                         adm_division = AdministrativeDivision(
                             code=feat.get('HRpcode'),
                             name=feat.get('HRname'),
-                            geom=geom.wkt,                            
                             level=adm_level,
                             parent=adm_division_2,
                             lft=1,
                             rght=1,
                             tree_id=1,
+                            **AdministrativeDivision.geometry_fields(geom)
                         )                        
                         adm_rows.append(adm_division)
 
@@ -264,3 +273,10 @@ is mandatory")
                 #print('rebuilding tree')
                 #AdministrativeDivision.objects.rebuild()
                 #print('rebuilding complete!')                                            
+
+        print('building cached geometries')
+        build_geometries(AdministrativeDivision.objects.filter(code__in=imported_codes))
+
+        data_versions.bump_adm_divisions()
+        adm_tree.invalidate()
+        adm_point_index.invalidate()
@@ -11,6 +11,9 @@ from risks.models import HazardType, RiskApp
 from risks.models import RiskAnalysisDymensionInfoAssociation
 from risks.models import RiskAnalysisAdministrativeDivisionAssociation
 from risks.models import EventAdministrativeDivisionAssociation
+from risks.versioning import data_versions
+from risks.adm_tree import adm_tree
+from risks.point_index import adm_point_index
 
 
 class Command(BaseCommand):
@@ -42,6 +45,9 @@ class Command(BaseCommand):
             print("Start rebuilding {}...".format(model))
             if model == 'AdministrativeDivision':
                 AdministrativeDivision.objects.rebuild()
+                data_versions.bump_adm_divisions()
+                adm_tree.invalidate()
+                adm_point_index.invalidate()
             print("Finished rebuilding {}!".format(model))
         
     
\ No newline at end of file
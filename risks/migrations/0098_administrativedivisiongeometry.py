@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('risks', '0097_auto_20180727_1542'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdministrativeDivisionGeometry',
+            fields=[
+                ('id', models.AutoField(serialize=False, primary_key=True)),
+                ('tolerance', models.FloatField()),
+                ('geojson', models.TextField()),
+                ('administrativedivision', models.ForeignKey(related_name='geometries', to='risks.AdministrativeDivision')),
+            ],
+            options={
+                'db_table': 'risks_administrativedivisiongeometry',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='administrativedivisiongeometry',
+            unique_together=set([('administrativedivision', 'tolerance')]),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.gis import geos
+from django.db import migrations, models
+
+
+def fill_geom_wkb(apps, schema_editor):
+    AdministrativeDivision = apps.get_model('risks', 'AdministrativeDivision')
+    for adm in AdministrativeDivision.objects.filter(geom_wkb__isnull=True).only('id', 'geom', 'srid').iterator():
+        if not adm.geom:
+            continue
+        geom = geos.GEOSGeometry(adm.geom, srid=adm.srid)
+        minx, miny, maxx, maxy = geom.extent
+        AdministrativeDivision.objects.filter(id=adm.id).update(geom_wkb=geom.wkb,
+                                                                bbox_minx=minx, bbox_miny=miny,
+                                                                bbox_maxx=maxx, bbox_maxy=maxy)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('risks', '0098_administrativedivisiongeometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='administrativedivision',
+            name='geom_wkb',
+            field=models.BinaryField(null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='administrativedivision',
+            name='bbox_minx',
+            field=models.FloatField(null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='administrativedivision',
+            name='bbox_miny',
+            field=models.FloatField(null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='administrativedivision',
+            name='bbox_maxx',
+            field=models.FloatField(null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='administrativedivision',
+            name='bbox_maxy',
+            field=models.FloatField(null=True, editable=False),
+        ),
+        migrations.RunPython(fill_geom_wkb, migrations.RunPython.noop),
+        migrations.RunSQL(
+            "CREATE INDEX risks_administrativedivision_bbox_gist ON risks_administrativedivision "
+            "USING gist (box(point(bbox_minx, bbox_miny), point(bbox_maxx, bbox_maxy)))",
+            "DROP INDEX risks_administrativedivision_bbox_gist",
+        ),
+    ]
@@ -20,14 +20,18 @@
 
 from django.core.urlresolvers import reverse
 from django.db import models
-from django.db.models import Q
+from django.db.models import Q, Count
 from django.conf import settings
+from django.contrib.gis import geos
+from django.utils import six
 from risk_data_hub import settings as rdh_settings
+from mptt.managers import TreeManager
 from mptt.models import MPTTModel, TreeForeignKey
 from django.core import files
 from geonode.base.models import ResourceBase, TopicCategory
 from geonode.layers.models import Layer, Style
 from risks.customs.custom_storage import ReplacingFileStorage
+from risks.versioning import data_versions
 from jsonfield import JSONField
 import xlrd
 
@@ -365,6 +369,9 @@ class HazardType(RiskAppAware, LocationAware, Exportable, Schedulable, models.Mo
 
     @property
     def risk_analysis_count(self):
+        overview = getattr(self, '_overview', None)
+        if overview is not None:
+            return overview[0]
         loc = self.get_location()
         reg = self.get_region()
         ra = RiskAnalysis.objects.filter(administrative_divisions=loc,
@@ -386,13 +393,48 @@ class HazardType(RiskAppAware, LocationAware, Exportable, Schedulable, models.Mo
     def default_analysis_type(self):
         reg = self.get_region()
         loc = self.get_location()
-        at = self.get_analysis_types()
-        if at.exists():
-            at = at.first()
-            return {'href': self.get_url('analysis_type', reg.name, loc.code, self.mnemonic, at.name)}
+        overview = getattr(self, '_overview', None)
+        if overview is not None:
+            at_name = overview[1]
+        else:
+            at = self.get_analysis_types().first()
+            at_name = at.name if at is not None else None
+        if at_name is not None:
+            return {'href': self.get_url('analysis_type', reg.name, loc.code, self.mnemonic, at_name)}
         else:
             return {}
 
+    @classmethod
+    def export_overview(cls, hazard_types, region, location):
+        """
+        Exports hazard types for location overview.
+
+        Risk analysis counts and default analysis types are computed
+        for all hazard types with one grouped query.
+        """
+        hazard_types = list(hazard_types)
+        ht_apps = dict((ht.id, ht.app_id,) for ht in hazard_types)
+        groups = RiskAnalysis.objects.filter(administrative_divisions=location,
+                                             region=region,
+                                             hazard_type__in=hazard_types)\
+                                     .values_list('hazard_type', 'app', 'analysis_type__app', 'analysis_type__name')\
+                                     .annotate(ra_count=Count('id'))\
+                                     .order_by('analysis_type__name')
+        counts = {}
+        default_atypes = {}
+        for ht_id, app_id, at_app_id, at_name, ra_count in groups:
+            counts[ht_id] = counts.get(ht_id, 0) + ra_count
+            # analysis types are sorted by name, first one is the default
+            if ht_id not in default_atypes and app_id == at_app_id == ht_apps[ht_id]:
+                default_atypes[ht_id] = at_name
+
+        out = []
+        for ht in hazard_types:
+            ht.set_region(region).set_location(location)
+            ht._overview = (counts.get(ht.id, 0), default_atypes.get(ht.id),)
+            out.append(ht.export())
+        return out
+
     @property
     def href(self):
         reg = self.get_region()
@@ -650,9 +692,36 @@ class RiskAnalysis(OwnedModel, RiskAppAware, Schedulable, LocationAware, HazardT
             out.append(at_data)
         return out
 
-class AdministrativeDivisionManager(models.Manager):
+class AdministrativeDivisionManager(TreeManager):
     """
+    Geometry columns are big and used only by geometry views and
+    importers, so they are not loaded unless asked with `with_geometry()`.
     """
+
+    GEOMETRY_FIELDS = ('geom', 'geom_wkb',)
+
+    # uses GiST index on bounding box created in migration 0099
+    BBOX_INTERSECTS = ("box(point(risks_administrativedivision.bbox_minx, risks_administrativedivision.bbox_miny), "
+                       "point(risks_administrativedivision.bbox_maxx, risks_administrativedivision.bbox_maxy)) "
+                       "&& box(point(%s, %s), point(%s, %s))")
+
+    def get_queryset(self, *args, **kwargs):
+        return super(AdministrativeDivisionManager, self).get_queryset(*args, **kwargs)\
+                                                         .defer(*self.GEOMETRY_FIELDS)
+
+    def with_geometry(self):
+        """
+        Returns queryset loading geometry columns. It should be used
+        when geometry is updated: assigned deferred fields are not saved.
+        """
+        return self.get_queryset().defer(None)
+
+    def intersecting_bbox(self, minx, miny, maxx, maxy):
+        """
+        Returns divisions which bounding boxes intersect given one
+        """
+        return self.get_queryset().extra(where=[self.BBOX_INTERSECTS], params=[minx, miny, maxx, maxy])
+
     def get_by_natural_key(self, code):
         return self.get(code=code)
 
@@ -675,6 +744,14 @@ class AdministrativeDivision(RiskAppAware, LocationAware, Exportable, MPTTModel)
     # GeoDjango-specific: a geometry field (MultiPolygonField)
     # geom = gismodels.MultiPolygonField() - does not work w/ default db
     geom = models.TextField()  # As WKT
+    # the same geometry as WKB, with its bounding box; use `geometry`
+    # to read it and `set_geometry()` to update it. WKT is kept until
+    # all readers use WKB
+    geom_wkb = models.BinaryField(null=True, editable=False)
+    bbox_minx = models.FloatField(null=True, editable=False)
+    bbox_miny = models.FloatField(null=True, editable=False)
+    bbox_maxx = models.FloatField(null=True, editable=False)
+    bbox_maxy = models.FloatField(null=True, editable=False)
     srid = models.IntegerField(default=4326)
 
     level = models.IntegerField()
@@ -702,6 +779,38 @@ class AdministrativeDivision(RiskAppAware, LocationAware, Exportable, MPTTModel)
         through='AdministrativeDivisionDataAssociation'        
     )
 
+    objects = AdministrativeDivisionManager()
+
+    @property
+    def geometry(self):
+        """
+        Returns GEOS geometry, read from WKB, or from WKT for
+        divisions stored before WKB column was added. Returns None
+        if division has no geometry.
+        """
+        if self.geom_wkb:
+            return geos.GEOSGeometry(six.memoryview(self.geom_wkb), srid=self.srid)
+        if self.geom:
+            return geos.GEOSGeometry(self.geom, srid=self.srid)
+
+    @staticmethod
+    def geometry_fields(geom):
+        """
+        Returns field values storing GEOS geometry, as WKT and WKB,
+        with its bounding box
+        """
+        minx, miny, maxx, maxy = geom.extent
+        return {'geom': geom.wkt,
+                'geom_wkb': geom.wkb,
+                'bbox_minx': minx,
+                'bbox_miny': miny,
+                'bbox_maxx': maxx,
+                'bbox_maxy': maxy}
+
+    def set_geometry(self, geom):
+        for fname, val in self.geometry_fields(geom).iteritems():
+            setattr(self, fname, val)
+
     @property
     def href(self):
         reg = self.get_region()
@@ -751,6 +860,29 @@ class AdministrativeDivisionMappings(models.Model):
     child = models.ForeignKey(AdministrativeDivision, related_name='mapping_parent')
 
 
+class AdministrativeDivisionGeometry(models.Model):
+    """
+    AdministrativeDivision geometry as GeoJSON, simplified with given
+    tolerance (0 for original geometry). Prebuilt on import, see
+    :py:mod:`risks.geometry_cache`.
+    """
+    id = models.AutoField(primary_key=True)
+    tolerance = models.FloatField()
+    geojson = models.TextField()
+
+    # Relationships
+    administrativedivision = models.ForeignKey(AdministrativeDivision, related_name='geometries')
+
+    def __unicode__(self):
+        return u"{0} ({1})".format(self.administrativedivision_id, self.tolerance)
+
+    class Meta:
+        """
+        """
+        db_table = 'risks_administrativedivisiongeometry'
+        unique_together = (('administrativedivision', 'tolerance',),)
+
+
 class DymensionInfo(RiskAnalysisAware, Exportable, models.Model):
     """
     Set of Dymensions (here we have the descriptors), to be used
@@ -1602,10 +1734,26 @@ def get_risk_app_default():
     return RiskApp.objects.get(name=RiskApp.APP_DATA_EXTRACTION).id
 
 
+class EventQuerySet(models.QuerySet):
+    def for_adm_division(self, adm, subtree=False):
+        """
+        Returns events associated with administrative division or, with
+        `subtree`, with any division in its subtree. Uses associations
+        table, so lookups go through indexes instead of matching `nuts3`.
+        """
+        adm_filter = {'adm__tree_id': adm.tree_id,
+                      'adm__lft__gte': adm.lft,
+                      'adm__rght__lte': adm.rght} if subtree else {'adm': adm}
+        event_ids = EventAdministrativeDivisionAssociation.objects.filter(**adm_filter).values('event_id')
+        return self.filter(event_id__in=event_ids)
+
+
 class Event(RiskAppAware, LocationAware, HazardTypeAware, Exportable, Schedulable, models.Model):
     EXPORT_FIELDS = (('event_id', 'event_id',),                     
                      ('href', 'href',),)    
 
+    objects = EventQuerySet.as_manager()
+
     event_id = models.CharField(max_length=25, primary_key=True)
     
     hazard_type = models.ForeignKey(
@@ -1661,10 +1809,46 @@ class Event(RiskAppAware, LocationAware, HazardTypeAware, Exportable, Schedulabl
     
 
     def get_event_plain(self):
-        nuts3_adm_divs = AdministrativeDivision.objects.filter(level=2, code__in=self.nuts3.split(';'))
-        nuts3_ids = nuts3_adm_divs.values_list('id', flat=True)        
-        nuts2_affected_names = AdministrativeDivisionMappings.objects.filter(child__pk__in=nuts3_ids).order_by('name').values_list('name', flat=True).distinct()        
-        nuts3_affected_names = nuts3_adm_divs.values_list('name', flat=True)
+        return Event.get_events_plain([self])[0]
+
+    @classmethod
+    def get_events_plain(cls, events):
+        """
+        Returns plain representation of events, resolving names of
+        affected NUTS2/NUTS3 divisions for all of them with two queries.
+        Affected divisions are read from event associations.
+
+        Events should have `hazard_type` and `region` already selected.
+        """
+        events = list(events)
+
+        # rows keep db ordering, so names come in the same order
+        # as when they were queried for each event separately
+        nuts3 = {}
+        affected = EventAdministrativeDivisionAssociation.objects.filter(event__in=[e.event_id for e in events], adm__level=2)\
+                                                                .order_by('adm__code', 'adm__name')\
+                                                                .values_list('event_id', 'adm_id', 'adm__name')
+        for rank, (event_id, adm_id, name,) in enumerate(affected):
+            nuts3.setdefault(event_id, []).append((rank, adm_id, name,))
+        nuts2 = {}
+        mappings = AdministrativeDivisionMappings.objects.filter(child__pk__in=[row[1] for rows in nuts3.values() for row in rows])\
+                                                         .order_by('name')\
+                                                         .values_list('child_id', 'name')
+        for rank, (child_id, name,) in enumerate(mappings):
+            nuts2.setdefault(child_id, []).append((rank, name,))
+
+        out = []
+        for event in events:
+            nuts3_rows = nuts3.get(event.event_id, [])
+            nuts2_rows = sorted(row for nuts3_row in nuts3_rows for row in nuts2.get(nuts3_row[1], ()))
+            nuts2_names = []
+            for rank, name in nuts2_rows:
+                if name not in nuts2_names:
+                    nuts2_names.append(name)
+            out.append(event._get_plain(nuts2_names, [name for rank, adm_id, name in nuts3_rows]))
+        return out
+
+    def _get_plain(self, nuts2_affected_names, nuts3_affected_names):
         return {
             'event_id': self.event_id,
             'hazard_type': self.hazard_type.mnemonic,
@@ -1876,3 +2060,25 @@ class AdministrativeDivisionDataAssociation(models.Model):
         """
         """
         db_table = 'risks_administrativedivisiondataassociation'
+
+
+def bump_risk_analysis_version(sender, instance, **kwargs):
+    data_versions.bump(instance.region, instance)
+
+
+def bump_hazard_set_version(sender, instance, **kwargs):
+    data_versions.bump(instance.country)
+    for risk in RiskAnalysis.objects.filter(hazardset=instance):
+        data_versions.bump(risk.region, risk)
+
+
+def bump_event_version(sender, instance, **kwargs):
+    data_versions.bump(instance.region)
+
+
+# admin edits and imports invalidate cached data responses
+for model, handler in ((RiskAnalysis, bump_risk_analysis_version,),
+                       (HazardSet, bump_hazard_set_version,),
+                       (Event, bump_event_version,),):
+    models.signals.post_save.connect(handler, sender=model, dispatch_uid='risks_version_{}'.format(model.__name__))
+    models.signals.post_delete.connect(handler, sender=model, dispatch_uid='risks_version_{}'.format(model.__name__))
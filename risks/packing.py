@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import sys
+from array import array
+
+import msgpack
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+MSGPACK_CONTENT_TYPE = 'application/x-msgpack'
+MSGPACK_FORMAT = 'msgpack'
+
+# marks column-encoded matrix in packed response
+COLUMNAR_KEY = '$columnar'
+
+_json_encoder = DjangoJSONEncoder()
+
+
+def accepts_msgpack(request):
+    """
+    Checks if client asked for msgpack response, with `format`
+    request param or with Accept header. Explicit `format` wins.
+    """
+    fmt = request.GET.get('format')
+    if fmt:
+        return fmt == MSGPACK_FORMAT
+    return MSGPACK_CONTENT_TYPE in request.META.get('HTTP_ACCEPT', '')
+
+
+def _le_bytes(arr):
+    # all binary columns are sent little-endian
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return bytearray(arr.tostring())
+
+
+def _is_number(val):
+    return val is None or (isinstance(val, (int, long, float,)) and not isinstance(val, bool))
+
+
+def pack_column(col):
+    """
+    Encodes one column of values matrix.
+
+    Numeric columns are sent as float64 buffer (NaN for missing values),
+    others are dictionary-encoded: list of distinct values, in order of
+    appearance, and uint32 buffer of indexes into that list.
+    """
+    if all(_is_number(val) for val in col):
+        data = array('d', [float('nan') if val is None else val for val in col])
+        return {'type': 'float64', 'data': _le_bytes(data)}
+
+    lookup = {}
+    dictionary = []
+    indices = array('I')
+    for val in col:
+        idx = lookup.get(val)
+        if idx is None:
+            idx = lookup[val] = len(dictionary)
+            dictionary.append(val)
+        indices.append(idx)
+    return {'type': 'dictionary',
+            'dictionary': dictionary,
+            'indices': _le_bytes(indices)}
+
+
+def pack_values(values):
+    """
+    Returns column-encoded values matrix (list of rows)
+    """
+    return {COLUMNAR_KEY: True,
+            'length': len(values),
+            'columns': [pack_column(col) for col in zip(*values)]}
+
+
+def _text(obj):
+    # py2 str would be packed as binary, so we send all text as unicode
+    if isinstance(obj, str):
+        return obj.decode('utf-8')
+    if isinstance(obj, dict):
+        return dict((_text(k), _text(v),) for k, v in obj.iteritems())
+    if isinstance(obj, (list, tuple,)):
+        return [_text(v) for v in obj]
+    return obj
+
+
+def _default(obj):
+    # same conversions as json_response
+    return _text(_json_encoder.default(obj))
+
+
+def msgpack_response(body, status=None):
+    """
+    msgpack counterpart of :py:func:`geonode.utils.json_response`
+    """
+    payload = msgpack.packb(_text(body), use_bin_type=True, default=_default)
+    return HttpResponse(payload, content_type=MSGPACK_CONTENT_TYPE, status=status)
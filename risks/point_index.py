@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import json
+import logging
+import threading
+
+from shapely.geometry import Point, shape
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+from risks import geometry_cache
+from risks.adm_tree import adm_tree
+from risks.versioning import data_versions
+
+log = logging.getLogger(__name__)
+
+
+class RegionPointIndex(object):
+    """
+    Spatial index of administrative divisions geometries of one region
+    """
+
+    def __init__(self, nodes, geometries):
+        self.geoms = []
+        self.entries = {}
+        for adm_id, code, name in nodes:
+            if adm_id not in geometries:
+                # division without geometry
+                continue
+            geom = shape(json.loads(geometries[adm_id]))
+            self.geoms.append(geom)
+            self.entries[id(geom)] = (prep(geom), adm_tree.get_level(code), code,)
+        # tree keeps pointers to geometries only, they're kept in self.geoms
+        self.tree = STRtree(self.geoms) if self.geoms else None
+
+    def find(self, lon, lat):
+        """
+        Returns code of the most detailed division containing point, or None
+        """
+        if self.tree is None:
+            return
+        point = Point(lon, lat)
+        found = None
+        for candidate in self.tree.query(point):
+            prepared, level, code = self.entries[id(candidate)]
+            if (found is None or level > found[0]) and prepared.contains(point):
+                found = (level, code,)
+        return found[1] if found else None
+
+
+class AdmDivisionPointIndex(object):
+    """
+    Process-level point-in-polygon index of administrative divisions,
+    built lazily per region from the most detailed cached geometries.
+
+    Indexes are dropped when administrative divisions data version
+    changes (it's bumped by `populateau`) or on `invalidate()`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._version = None
+
+    def _build(self, region_id):
+        nodes = adm_tree.get_level_nodes(None, region_id)
+        geometries = geometry_cache.get_geojson([adm_id for adm_id, code, name in nodes],
+                                                geometry_cache.get_tolerance())
+        index = RegionPointIndex(nodes, geometries)
+        log.info("built point index for region %s: %s divisions", region_id, len(nodes))
+        return index
+
+    def get_index(self, region_id):
+        version = data_versions.get_versions([data_versions.ADM_SCOPE])[0]
+        with self._lock:
+            if version != self._version:
+                self._indexes = {}
+                self._version = version
+            index = self._indexes.get(region_id)
+        if index is None:
+            index = self._build(region_id)
+            with self._lock:
+                if version == self._version:
+                    self._indexes[region_id] = index
+        return index
+
+    def invalidate(self):
+        with self._lock:
+            self._indexes = {}
+
+    def find(self, region_id, lon, lat):
+        """
+        Returns code of the most detailed division of region
+        containing point, or None
+        """
+        return self.get_index(region_id).find(lon, lat)
+
+
+adm_point_index = AdmDivisionPointIndex()
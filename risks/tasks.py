@@ -57,6 +57,7 @@ def import_risk_data(filepath, risk_app_name, risk_analysis_name, region_name, f
                          region=region_name,
                          excel_file=filepath,
                          risk_analysis=risk_analysis_name,   
+                         bulk=True,
                          stdout=out)
             risk_analysis.refresh_from_db()
             risk_analysis.data_file = final_name
@@ -20,8 +20,9 @@
 
 import os
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.db import connections
+from django.core.cache import caches
 from django.core.management import call_command
 
 from geonode.utils import designals, resignals
@@ -34,6 +35,51 @@ TESTDATA_SQL_TEARDOWN = os.path.join(
     os.path.dirname(__file__),
     'resources/test_data_teardown.sql')
 
+DATASTORE_SQL_INIT = os.path.join(
+    os.path.dirname(__file__),
+    'resources/datastore_setup.sql')
+
+DATASTORE_SQL_TEARDOWN = os.path.join(
+    os.path.dirname(__file__),
+    'resources/datastore_teardown.sql')
+
+# versions, cubes and responses are kept in per-process cache in tests
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                           'LOCATION': 'risks-tests'}}
+
+
+def run_sql_file(db_name, path):
+    with connections[db_name].cursor() as cursor:
+        sql_file = open(path, 'r')
+        sql = " ".join(sql_file.readlines())
+        cursor.execute(sql)
+        connections[db_name].commit()
+        sql_file.close()
+
+
+def square_wkt(x, y, size=1):
+    """
+    Returns WKT of square polygon with lower left corner at x, y
+    """
+    return 'POLYGON(({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))'.format(x, y, x + size, y + size)
+
+
+def create_adm(code, name, level, parent=None, geom=None):
+    """
+    Creates administrative division, with optional geometry (WKT)
+    stored as WKT and WKB. Tree must be rebuilt after nodes are
+    created, with `AdministrativeDivision.objects.rebuild()`.
+    """
+    from django.contrib.gis import geos
+    from risks.models import AdministrativeDivision
+
+    adm = AdministrativeDivision(code=code, name=name, level=level, parent=parent)
+    if geom is not None:
+        adm.set_geometry(geos.GEOSGeometry(geom, srid=4326))
+    adm.save()
+    return adm
+
+
 class RisksTestCase(TestCase):
     fixtures = [
         'sample_admin',
@@ -70,3 +116,72 @@ class RisksTestCase(TestCase):
             cursor.execute(sql)
             connections['datastore'].commit()
             sql_file.close()
+
+
+def insert_risk_rows(risk_analysis, hazard_type, region, rows, risk_analysis_id=1):
+    """
+    Inserts risk analysis values to datastore, from (adm_code,
+    dim1_value, dim1_order, dim2_value, dim2_order, value, event_id)
+    rows. Missing divisions and dimension values are created.
+    """
+    conn = connections['datastore']
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO risk_analysis (id, name, hazard_type, region) "
+                       "VALUES (%s, %s, %s, %s)", [risk_analysis_id, risk_analysis, hazard_type, region])
+        fids = {}
+        dims = {}
+        for adm_code, dim1_value, dim1_order, dim2_value, dim2_order, value, event_id in rows:
+            if adm_code not in fids:
+                cursor.execute("INSERT INTO adm_divisions (adm_name, adm_code, level) "
+                               "VALUES (%s, %s, 1) RETURNING fid", [adm_code, adm_code])
+                fids[adm_code] = cursor.fetchone()[0]
+            dim_ids = []
+            for dim_col, dim_value, dim_order in (('dim1', dim1_value, dim1_order,),
+                                                  ('dim2', dim2_value, dim2_order,),):
+                key = (dim_col, dim_value,)
+                if key not in dims:
+                    cursor.execute("INSERT INTO dimensions (dim_col, dim_value, dim_order) "
+                                   "VALUES (%s, %s, %s) RETURNING dim_id", [dim_col, dim_value, dim_order])
+                    dims[key] = cursor.fetchone()[0]
+                dim_ids.append(dims[key])
+            cursor.execute("INSERT INTO risk_dimensions (adm_fid, risk_analysis_id, dim1_id, dim2_id, value, event_id) "
+                           "VALUES (%s, %s, %s, %s, %s, %s)",
+                           [fids[adm_code], risk_analysis_id, dim_ids[0], dim_ids[1], value, event_id])
+        conn.commit()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RisksDataTestCase(TestCase):
+    """
+    Base for tests of risks data layer, no fixtures are loaded.
+    Caches and process-level indexes are cleared, so nothing is
+    kept between tests.
+    """
+
+    def setUp(self):
+        from risks.adm_tree import adm_tree
+        from risks.cube import risk_cubes
+        from risks.point_index import adm_point_index
+
+        designals()
+        caches['default'].clear()
+        adm_tree.invalidate()
+        adm_point_index.invalidate()
+        risk_cubes._cubes.clear()
+
+    def tearDown(self):
+        resignals()
+
+
+class DatastoreTestCase(RisksDataTestCase):
+    """
+    Creates datastore tables with current schema
+    """
+
+    def setUp(self):
+        super(DatastoreTestCase, self).setUp()
+        run_sql_file('datastore', DATASTORE_SQL_INIT)
+
+    def tearDown(self):
+        super(DatastoreTestCase, self).tearDown()
+        run_sql_file('datastore', DATASTORE_SQL_TEARDOWN)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2017 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+import json
+
+from django.test import RequestFactory
+
+from risks.adm_tree import AdmDivisionTree
+from risks.models import (AdministrativeDivision, Region,
+                          RegionAdministrativeDivisionAssociation)
+from risks.versioning import data_versions
+from risks.views import AdmLookupView
+from risks.tests import RisksDataTestCase, create_adm, square_wkt
+
+
+# code, name, level, parent code, lower left corner of 1x1 square geometry
+TEST_TREE = [('EU', 'Europe', 0, None, None),
+             ('DE', 'Germany', 1, 'EU', None),
+             ('DE5', 'Berg', 2, 'DE', (0, 0,)),
+             ('DE6', u'Bérgheim', 2, 'DE', (1, 0,)),
+             ('DE7', 'Bad Berg', 2, 'DE', (2, 0,)),
+             ('DE8', 'Heidelberg', 2, 'DE', (3, 0,)),
+             ('IT', 'Italy', 1, 'EU', None),
+             ('IT1', 'Bergamo', 2, 'IT', (0, 1,)),
+             ]
+
+
+def create_tree(region_name='Europe'):
+    """
+    Creates TEST_TREE divisions, all in one region.
+    Returns (region, dict of code -> division)
+    """
+    region = Region.objects.create(name=region_name, level=0)
+    adms = {}
+    for code, name, level, parent, corner in TEST_TREE:
+        geom = square_wkt(*corner) if corner else None
+        adms[code] = create_adm(code, name, level, adms.get(parent), geom)
+        RegionAdministrativeDivisionAssociation.objects.create(region=region, administrativedivision=adms[code])
+    AdministrativeDivision.objects.rebuild()
+    data_versions.bump_adm_divisions()
+    return (region, adms,)
+
+
+class AdmDivisionTreeTestCase(RisksDataTestCase):
+
+    def setUp(self):
+        super(AdmDivisionTreeTestCase, self).setUp()
+        self.region, self.adms = create_tree()
+        self.tree = AdmDivisionTree(check_interval=0)
+
+    def test_chain(self):
+        chain = self.tree.get_chain('DE5')
+        self.assertEqual([adm.code for adm in chain], ['EU', 'DE', 'DE5'])
+        self.assertIs(chain[-1].parent, chain[1])
+        self.assertIs(chain[1].parent, chain[0])
+        self.assertIsNone(chain[0].parent)
+        self.assertEqual(chain[-1].id, self.adms['DE5'].id)
+        self.assertIsNone(self.tree.get_chain('XX'))
+        self.assertEqual(self.tree.get_parents_chain('XX'), [])
+        self.assertEqual([adm.code for adm in self.tree.get_parents_chain('DE5')], ['EU', 'DE'])
+
+        # nodes are copies, views may change them
+        adm = self.tree.get('DE5')
+        adm.name = 'changed'
+        self.assertEqual(self.tree.get('DE5').name, 'Berg')
+
+    def test_children(self):
+        children = self.tree.get_children('DE')
+        tree_order = AdministrativeDivision.objects.filter(parent=self.adms['DE']).order_by('lft')
+        self.assertEqual([adm.code for adm in children], [adm.code for adm in tree_order])
+        self.assertEqual(len(children), 4)
+        self.assertEqual(set(adm.parent.code for adm in children), set(['DE']))
+        self.assertEqual(self.tree.get_children('DE5'), [])
+        self.assertEqual(self.tree.get_children('XX'), [])
+
+    def test_levels(self):
+        self.assertEqual(self.tree.get_level('IT'), 1)
+        self.assertIsNone(self.tree.get_level('XX'))
+        self.assertEqual(self.tree.get_max_level(), 2)
+        self.assertEqual(self.tree.get_region_ids('IT1'), set([self.region.id]))
+        self.assertEqual(self.tree.get_region_ids('XX'), set())
+        nodes = self.tree.get_level_nodes(1, self.region.id)
+        self.assertEqual(sorted(code for adm_id, code, name in nodes), ['DE', 'IT'])
+        self.assertEqual(self.tree.get_level_nodes(1, self.region.id + 1), [])
+        self.assertEqual(len(self.tree.get_level_nodes(None)), len(TEST_TREE))
+
+    def test_reload(self):
+        """
+        Check if tree is reloaded when adm divisions version is bumped
+        """
+        self.assertIsNone(self.tree.get('IT2'))
+        create_adm('IT2', 'Roma', 2, self.adms['IT'])
+        AdministrativeDivision.objects.rebuild()
+        self.assertIsNone(self.tree.get('IT2'))
+        data_versions.bump_adm_divisions()
+        self.assertEqual([adm.code for adm in self.tree.get_chain('IT2')], ['EU', 'IT', 'IT2'])
+
+
+class AdmLookupTestCase(RisksDataTestCase):
+
+    def setUp(self):
+        super(AdmLookupTestCase, self).setUp()
+        self.region, self.adms = create_tree()
+        self.tree = AdmDivisionTree(check_interval=0)
+
+    def test_search(self):
+        """
+        Check if matches are ranked: exact, prefix, word prefix, others
+        """
+        expected = [('DE5', 'Berg', 'DE'),
+                    ('IT1', 'Bergamo', 'IT'),
+                    ('DE6', u'Bérgheim', 'DE'),
+                    ('DE7', 'Bad Berg', 'DE'),
+                    ('DE8', 'Heidelberg', 'DE')]
+        self.assertEqual(self.tree.search('berg'), expected)
+        self.assertEqual(self.tree.search(u' BÉRG '), expected)
+        self.assertEqual(self.tree.search('berg', limit=2), expected[:2])
+        self.assertEqual(self.tree.search('berga'), expected[1:2])
+        self.assertEqual(self.tree.search('xyz'), [])
+        self.assertEqual(self.tree.search(' '), [])
+
+        # countries are their own country, root has none
+        self.assertEqual(self.tree.search('italy'), [('IT', 'Italy', 'IT')])
+        self.assertEqual(self.tree.search('europe'), [('EU', 'Europe', '')])
+
+    def test_search_short(self):
+        """
+        Check if queries shorter than trigrams match anywhere in names
+        """
+        self.assertEqual(self.tree.search('lb'), [('DE8', 'Heidelberg', 'DE')])
+        self.assertEqual(self.tree.search('it'), [('IT', 'Italy', 'IT')])
+        self.assertEqual([code for code, name, country in self.tree.search('b')],
+                         ['DE7', 'DE5', 'IT1', 'DE6', 'DE8'])
+
+    def test_lookup_view(self):
+        view = AdmLookupView.as_view()
+        request = RequestFactory().get('/risks/data_extraction/admlookup/berg/')
+        response = view(request, admlookup='berg')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data[0], {'admCode': 'DE5', 'admName': 'Berg', 'country': 'DE'})
+        self.assertEqual(len(data), 5)
+
+        response = view(request, admlookup='xyz')
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2017 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+import pickle
+
+from django.test import SimpleTestCase, override_settings
+
+from risks.cube import RiskAnalysisCube, RiskAnalysisCubeStore
+from risks.datasource import PostGISDataSource
+from risks.versioning import data_versions
+from risks.tests import DatastoreTestCase, TEST_CACHES, insert_risk_rows
+from risks.tests.datasource import TEST_ROWS
+
+
+CUBE_ROWS = [('AF', 'Hospital', 1, '10', 1, 1.5),
+             ('AF', 'Hospital', 1, '100', 2, None),
+             ('AF', 'School', 2, '10', 1, 3.0),
+             ('AF01', 'School', 2, '100', 2, 4.0),
+             ]
+
+
+class FakeHazardType(object):
+
+    def __init__(self, mnemonic):
+        self.mnemonic = mnemonic
+
+
+class FakeRiskAnalysis(object):
+
+    def __init__(self, id, name='analysis', hazard_type='EQ'):
+        self.id = id
+        self.name = name
+        self.hazard_type = FakeHazardType(hazard_type)
+
+
+class CountingCubeStore(RiskAnalysisCubeStore):
+    """
+    Store building cubes from fixed rows, counting builds
+    """
+
+    def __init__(self):
+        super(CountingCubeStore, self).__init__()
+        self.built = []
+
+    def build(self, risk):
+        self.built.append(risk.id)
+        return RiskAnalysisCube.from_rows(CUBE_ROWS)
+
+
+class RiskAnalysisCubeTestCase(SimpleTestCase):
+
+    def test_get_rows(self):
+        cube = RiskAnalysisCube.from_rows(CUBE_ROWS)
+        self.assertEqual(len(cube), 4)
+        self.assertEqual(cube.dim1_values, ['Hospital', 'School'])
+        self.assertEqual(cube.dim2_values, ['10', '100'])
+        self.assertEqual(cube.get_rows('AF'),
+                         [{'dim1_value': 'Hospital', 'dim1_order': 1,
+                           'dim2_value': '10', 'dim2_order': 1, 'value': 1.5},
+                          {'dim1_value': 'Hospital', 'dim1_order': 1,
+                           'dim2_value': '100', 'dim2_order': 2, 'value': None},
+                          {'dim1_value': 'School', 'dim1_order': 2,
+                           'dim2_value': '10', 'dim2_order': 1, 'value': 3.0}])
+        self.assertEqual(cube.get_rows('AF01'),
+                         [{'dim1_value': 'School', 'dim1_order': 2,
+                           'dim2_value': '100', 'dim2_order': 2, 'value': 4.0}])
+        self.assertEqual(cube.get_rows('XX'), [])
+
+    def test_get_value(self):
+        cube = RiskAnalysisCube.from_rows(CUBE_ROWS)
+        self.assertEqual(cube.get_value('AF', 'School', '10'), 3.0)
+        self.assertEqual(cube.get_value('AF01', 'School', '100'), 4.0)
+        self.assertIsNone(cube.get_value('AF', 'Hospital', '100'))
+        self.assertIsNone(cube.get_value('AF01', 'School', '10'))
+        self.assertIsNone(cube.get_value('XX', 'School', '10'))
+
+    def test_pickle(self):
+        # cubes are shared through django cache
+        cube = pickle.loads(pickle.dumps(RiskAnalysisCube.from_rows(CUBE_ROWS), pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(cube.get_rows('AF01')[0]['value'], 4.0)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RiskAnalysisCubeStoreTestCase(SimpleTestCase):
+
+    def setUp(self):
+        data_versions.cache.clear()
+
+    def test_get(self):
+        """
+        Check if cube is built once per version and rebuilt after bump
+        """
+        store = CountingCubeStore()
+        risk = FakeRiskAnalysis(1)
+        cube = store.get(risk)
+        self.assertIs(store.get(risk), cube)
+        self.assertEqual(store.built, [1])
+
+        # other process finds cube in shared cache
+        other = CountingCubeStore()
+        self.assertEqual(other.get(risk).get_rows('AF'), cube.get_rows('AF'))
+        self.assertEqual(other.built, [])
+
+        data_versions.bump(risk_analysis=risk)
+        self.assertIsNot(store.get(risk), cube)
+        self.assertEqual(store.built, [1, 1])
+        other.get(risk)
+        self.assertEqual(other.built, [])
+
+        # bumps of other analyses don't invalidate the cube
+        data_versions.bump(risk_analysis=2)
+        store.get(risk)
+        self.assertEqual(store.built, [1, 1])
+
+    def test_rebuild(self):
+        store = CountingCubeStore()
+        risk = FakeRiskAnalysis(1)
+        store.get(risk)
+        data_versions.bump(risk_analysis=risk)
+        cube = store.rebuild(risk)
+        self.assertIs(store.get(risk), cube)
+        self.assertEqual(store.built, [1, 1])
+
+    @override_settings(RISKS_CUBE_LOCAL_SIZE=2)
+    def test_local_size(self):
+        """
+        Check if only recently used cubes are kept in process memory
+        """
+        store = CountingCubeStore()
+        risks = [FakeRiskAnalysis(idx) for idx in range(3)]
+        store.get(risks[0])
+        store.get(risks[1])
+        store.get(risks[0])
+        store.get(risks[2])
+        self.assertEqual(list(store._cubes), [0, 2])
+
+
+class RiskAnalysisCubeBuildTestCase(DatastoreTestCase):
+
+    def test_build(self):
+        """
+        Check if cube built from datastore has the same rows
+        as returned by PostGIS data source
+        """
+        insert_risk_rows('analysis', 'EQ', 'Afghanistan', TEST_ROWS)
+        insert_risk_rows('analysis', 'FL', 'Afghanistan', [('AF', 'Hospital', 2, '10', 1, '9', '')],
+                         risk_analysis_id=2)
+        with self.settings(OGC_SERVER={'default': {'DATASTORE': 'datastore'}}):
+            cube = RiskAnalysisCubeStore().build(FakeRiskAnalysis(1))
+        datasource = PostGISDataSource('datastore')
+        for adm_code in ('AF', 'AF01', 'XX',):
+            self.assertEqual(cube.get_rows(adm_code),
+                             datasource.get_rows('geonode:risk_analysis', risk_analysis='analysis',
+                                                 hazard_type='EQ', adm_code=adm_code))
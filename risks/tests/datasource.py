@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2017 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+import json
+import threading
+from io import BytesIO
+
+from django.test import SimpleTestCase
+
+from risks import datasource
+from risks.datasource import (PostGISDataSource, WFSClientPool, GeoserverDataSource,
+                              DEFAULT_FIELD_NAMES, cql_in)
+from risks.tests import DatastoreTestCase, insert_risk_rows
+
+
+TEST_ROWS = [('AF', 'Hospital', 2, '100', 2, '3.5', ''),
+             ('AF', 'Hospital', 2, '10', 1, '1.5', ''),
+             ('AF', 'School', 1, '10', 1, '', ''),
+             ('AF', 'Hospital', 2, '10', 1, '7', 'EV1'),
+             ('AF01', 'Hospital', 2, '10', 1, '2', ''),
+             ]
+
+
+class PostGISDataSourceTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(PostGISDataSourceTestCase, self).setUp()
+        insert_risk_rows('analysis', 'EQ', 'Afghanistan', TEST_ROWS)
+        insert_risk_rows('analysis', 'FL', 'Afghanistan', [('AF', 'Hospital', 2, '10', 1, '9', '')],
+                         risk_analysis_id=2)
+        self.datasource = PostGISDataSource('datastore')
+
+    def test_supports(self):
+        self.assertTrue(self.datasource.supports('geonode:risk_analysis'))
+        self.assertTrue(self.datasource.supports('risk_analysis'))
+        self.assertFalse(self.datasource.supports('geonode:risk_analysis_event_details'))
+        self.assertRaises(ValueError, self.datasource.get_rows, 'geonode:risk_analysis_event_details')
+
+    def test_get_rows(self):
+        """
+        Check if only rows of analysis, hazard type and location are
+        returned, without event rows, sorted by dimension orders
+        """
+        rows = self.datasource.get_rows('geonode:risk_analysis', risk_analysis='analysis',
+                                        hazard_type='EQ', adm_code='AF')
+        self.assertEqual(rows, [{'dim1_value': 'School', 'dim1_order': 1,
+                                 'dim2_value': '10', 'dim2_order': 1, 'value': None},
+                                {'dim1_value': 'Hospital', 'dim1_order': 2,
+                                 'dim2_value': '10', 'dim2_order': 1, 'value': 1.5},
+                                {'dim1_value': 'Hospital', 'dim1_order': 2,
+                                 'dim2_value': '100', 'dim2_order': 2, 'value': 3.5}])
+
+        rows = self.datasource.get_rows('geonode:risk_analysis', risk_analysis='analysis',
+                                        hazard_type='FL', adm_code='AF')
+        self.assertEqual([r['value'] for r in rows], [9.0])
+
+        rows = self.datasource.get_rows('geonode:risk_analysis', risk_analysis='analysis',
+                                        hazard_type='EQ', adm_code='XX')
+        self.assertEqual(rows, [])
+
+    def test_get_rows_fields(self):
+        rows = self.datasource.get_rows('geonode:risk_analysis', ['dim1_value', 'value'],
+                                        risk_analysis='analysis', hazard_type='EQ', adm_code='AF01')
+        self.assertEqual(rows, [{'dim1_value': 'Hospital', 'value': 2.0}])
+
+
+class CountingFactory(object):
+    """
+    WFS client factory counting clients created
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, url, version, **kwargs):
+        self.calls.append((url, version, kwargs,))
+        return object()
+
+
+class WFSClientPoolTestCase(SimpleTestCase):
+
+    def test_get_client(self):
+        """
+        Check if capabilities are fetched once per url and credentials,
+        until ttl passes
+        """
+        pool = WFSClientPool(ttl=300)
+        factory = CountingFactory()
+        wfs = pool.get_client(factory, 'http://gs/wfs', '2.0.0')
+        self.assertIs(pool.get_client(factory, 'http://gs/wfs', '2.0.0'), wfs)
+        self.assertEqual(len(factory.calls), 1)
+
+        other = pool.get_client(factory, 'http://gs/wfs', '2.0.0', username='u', password='p')
+        self.assertIsNot(other, wfs)
+        self.assertEqual(factory.calls[-1], ('http://gs/wfs', '2.0.0', {'username': 'u', 'password': 'p'},))
+
+        pool.clear()
+        self.assertIsNot(pool.get_client(factory, 'http://gs/wfs', '2.0.0'), wfs)
+        self.assertEqual(len(factory.calls), 3)
+
+        pool = WFSClientPool(ttl=0)
+        pool.get_client(factory, 'http://gs/wfs', '2.0.0')
+        pool.get_client(factory, 'http://gs/wfs', '2.0.0')
+        self.assertEqual(len(factory.calls), 5)
+
+    def test_get_session(self):
+        """
+        Check if sessions are reused in thread and not shared between threads
+        """
+        pool = WFSClientPool()
+        session = pool.get_session('http://gs/wfs', '2.0.0', 'u', 'p')
+        self.assertIs(pool.get_session('http://gs/wfs', '2.0.0', 'u', 'p'), session)
+        self.assertEqual(session.auth, ('u', 'p',))
+        self.assertIsNot(pool.get_session('http://gs/wfs', '2.0.0'), session)
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(pool.get_session('http://gs/wfs', '2.0.0', 'u', 'p')))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], session)
+
+
+class FakeResponse(object):
+
+    def __init__(self, content):
+        self.raw = BytesIO(content)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeGeoserverDataSource(GeoserverDataSource):
+    """
+    Data source returning given GetFeature response content
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.output_format = 'application/json'
+        self.requests = []
+        self.responses = []
+
+    def getfeature(self, layer_name, field_names, vparams, stream=False):
+        self.requests.append((layer_name, field_names, vparams, stream,))
+        if not stream:
+            return BytesIO(self.content)
+        r = FakeResponse(self.content)
+        self.responses.append(r)
+        return r
+
+
+class GeoserverDataSourceTestCase(SimpleTestCase):
+
+    FEATURES = {'type': 'FeatureCollection',
+                'features': [{'type': 'Feature',
+                              'geometry': {'type': 'Point', 'coordinates': [1.5, 2.5]},
+                              'properties': {'dim1_value': 'Hospital', 'dim2_value': '10', 'value': 1.25}},
+                             {'type': 'Feature',
+                              'geometry': None,
+                              'properties': {'dim1_value': u'école', 'dim2_value': '100', 'value': 3}}]}
+
+    def test_cql_in(self):
+        self.assertEqual(cql_in('event_id', ['a', "b'c"]), "event_id IN ('a', 'b''c')")
+        self.assertEqual(cql_in('event_id', [u'é']), u"event_id IN ('é')".encode('utf-8'))
+
+    def test_iter_rows(self):
+        """
+        Check if streamed rows are the same as parsed with json.load,
+        and response is closed
+        """
+        expected = [f['properties'] for f in self.FEATURES['features']]
+        ds = FakeGeoserverDataSource(json.dumps(self.FEATURES))
+        rows = ds.get_rows('geonode:risk_analysis', risk_analysis='analysis', adm_code='AF')
+        self.assertEqual(rows, expected)
+        self.assertTrue(isinstance(rows[0]['value'], float))
+        self.assertTrue(all(r.closed for r in ds.responses))
+
+        layer_name, field_names, vparams, stream = ds.requests[0]
+        self.assertEqual(field_names, DEFAULT_FIELD_NAMES)
+        self.assertEqual(sorted(vparams['viewparams'].split(';')), ['adm_code:AF', 'risk_analysis:analysis'])
+
+        # response is closed when rows are not read to the end
+        ds = FakeGeoserverDataSource(json.dumps(self.FEATURES))
+        rows = ds.iter_rows('geonode:risk_analysis', adm_code='AF')
+        next(rows)
+        rows.close()
+        self.assertTrue(ds.responses[0].closed)
+
+    def test_iter_rows_without_ijson(self):
+        expected = [f['properties'] for f in self.FEATURES['features']]
+        backend = datasource.ijson
+        datasource.ijson = None
+        try:
+            ds = FakeGeoserverDataSource(json.dumps(self.FEATURES))
+            self.assertEqual(ds.get_rows('geonode:risk_analysis', adm_code='AF'), expected)
+            self.assertFalse(ds.requests[0][3])
+        finally:
+            datasource.ijson = backend
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2017 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+import base64
+import json
+from datetime import date
+
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+
+from geonode.layers.models import Layer
+
+from risks.models import (RiskApp, HazardType, Event, AdministrativeDivisionMappings,
+                          EventAdministrativeDivisionAssociation, AnalysisType, RiskAnalysis,
+                          RiskAnalysisAdministrativeDivisionAssociation, Region,
+                          AdministrativeData, AdministrativeDivisionDataAssociation,
+                          AdministrativeDivision)
+from risks.views import DataExtractionView, EventDetailsView, EventListView
+from risks.tests import RisksDataTestCase
+from risks.tests.adm_tree import create_tree
+
+
+# event id, begin date, affected divisions
+TEST_EVENTS = [('E01', date(2017, 1, 1), ['DE5', 'DE6', 'DE']),
+               ('E02', date(2017, 1, 1), ['IT1']),
+               ('E03', date(2017, 1, 1), []),
+               ('E04', date(2017, 2, 1), ['DE8']),
+               ('E05', date(2017, 2, 1), ['DE5']),
+               ('E06', date(2016, 5, 5), ['DE7']),
+               ('E07', date(2018, 1, 1), ['IT']),
+               ]
+
+
+def create_risk_analysis(name, analysis_type, hazard_type, region, adms=()):
+    """
+    Creates risk analysis of hazard type app, available at given divisions
+    """
+    atype, created = AnalysisType.objects.get_or_create(name=analysis_type, app=hazard_type.app,
+                                                        defaults={'title': analysis_type})
+    layer = Layer.objects.create(name=name)
+    risk = RiskAnalysis.objects.create(name=name, analysis_type=atype, hazard_type=hazard_type,
+                                       region=region, layer=layer, app=hazard_type.app)
+    for adm in adms:
+        RiskAnalysisAdministrativeDivisionAssociation.objects.create(riskanalysis=risk, administrativedivision=adm)
+    return risk
+
+
+def create_events():
+    """
+    Creates TEST_EVENTS in test tree region, with flood hazard type.
+    Returns (region, dict of code -> division, app, hazard type)
+    """
+    region, adms = create_tree()
+    app = RiskApp.objects.create(name=RiskApp.APP_DATA_EXTRACTION)
+    hazard_type = HazardType.objects.create(mnemonic='FL', title='Flood', order=1, app=app)
+    for event_id, begin_date, adm_codes in TEST_EVENTS:
+        event = Event.objects.create(event_id=event_id, hazard_type=hazard_type, region=region,
+                                     iso2='DE', nuts3=';'.join(adm_codes), begin_date=begin_date,
+                                     end_date=begin_date, year=begin_date.year, event_type='flood',
+                                     event_source='test', cause='rain', sources='test')
+        for adm_code in adm_codes:
+            EventAdministrativeDivisionAssociation.objects.create(event=event, adm=adms[adm_code])
+
+    mapping = AdministrativeDivisionMappings.objects.create
+    mapping(code='N1', name='Nord', parent=adms['DE'], child=adms['DE5'])
+    mapping(code='A1', name='Alpha', parent=adms['DE'], child=adms['DE6'])
+    mapping(code='N1', name='Nord', parent=adms['DE'], child=adms['DE6'])
+    return (region, adms, app, hazard_type,)
+
+
+class EventsTestCase(RisksDataTestCase):
+
+    def setUp(self):
+        super(EventsTestCase, self).setUp()
+        (self.region, self.adms, self.app, self.hazard_type,) = create_events()
+
+    def test_get_events_plain(self):
+        """
+        Check if names of affected divisions are resolved for all
+        events at once
+        """
+        events = Event.objects.select_related('hazard_type', 'region').order_by('event_id')
+        with self.assertNumQueries(3):
+            plain = Event.get_events_plain(events)
+        by_id = dict((e['event_id'], e,) for e in plain)
+        self.assertEqual([e['event_id'] for e in plain], [e[0] for e in TEST_EVENTS])
+
+        self.assertEqual(by_id['E01']['nuts3_names'], u'Berg, Bérgheim')
+        self.assertEqual(by_id['E01']['nuts2_names'], 'Alpha, Nord')
+        self.assertEqual(by_id['E01']['nuts3'], 'DE5;DE6;DE')
+        self.assertEqual(by_id['E01']['hazard_type'], 'FL')
+        self.assertEqual(by_id['E01']['region'], 'Europe')
+        self.assertEqual(by_id['E01']['begin_date'], date(2017, 1, 1))
+        self.assertEqual(by_id['E02']['nuts3_names'], 'Bergamo')
+        self.assertEqual(by_id['E02']['nuts2_names'], '')
+        self.assertEqual(by_id['E05']['nuts2_names'], 'Nord')
+        # level 1 divisions are not listed
+        self.assertEqual(by_id['E07']['nuts3_names'], '')
+        self.assertEqual(by_id['E03']['nuts3_names'], '')
+
+        self.assertEqual(Event.objects.get(event_id='E01').get_event_plain(), by_id['E01'])
+        self.assertEqual(Event.get_events_plain([]), [])
+
+    def test_get_administrative_data(self):
+        """
+        Check if the latest value is returned for each data and location,
+        and data is mapped to the first analysis type matching it
+        """
+        create_risk_analysis('B analysis', 'r_population_x', self.hazard_type, self.region)
+        create_risk_analysis('C analysis', 'e_population', self.hazard_type, self.region)
+        create_risk_analysis('A analysis', 'r_gdp', self.hazard_type, self.region)
+        other_region = Region.objects.create(name='Other', level=0)
+        create_risk_analysis('A0 analysis', 'r_area', self.hazard_type, other_region)
+
+        population = AdministrativeData.objects.create(name='Population', indicator_type='population',
+                                                       unit_of_measure='people')
+        gdp = AdministrativeData.objects.create(name='GDP', indicator_type='gdp', unit_of_measure='EUR')
+        AdministrativeData.objects.create(name='Area', indicator_type='area')
+        value = AdministrativeDivisionDataAssociation.objects.create
+        value(data=population, adm=self.adms['DE5'], dimension='2010', value='100')
+        value(data=population, adm=self.adms['DE5'], dimension='2015', value='150')
+        value(data=population, adm=self.adms['DE6'], dimension='2010', value='7')
+        value(data=population, adm=self.adms['IT1'], dimension='2015', value='5')
+        value(data=gdp, adm=self.adms['DE5'], dimension='2015', value='9')
+
+        view = EventDetailsView()
+        (administrative_data, risk_analysis_mapping,) = \
+            view.get_administrative_data(self.hazard_type, self.region, [self.adms['DE5'], self.adms['DE6']])
+        self.assertEqual(administrative_data,
+                         {'Population': {'unitOfMeasure': 'people', 'values': {'DE5': '150', 'DE6': '7'}},
+                          'GDP': {'unitOfMeasure': 'EUR', 'values': {'DE5': '9'}},
+                          'Area': {'unitOfMeasure': None, 'values': {}}})
+        self.assertEqual(risk_analysis_mapping, {'Population': 'r_population_x', 'GDP': 'r_gdp'})
+
+    def test_get_location_events(self):
+        """
+        Check if events of location subtree are found through associations
+        """
+        view = DataExtractionView()
+        expected = {'EU': ['E01', 'E02', 'E03', 'E04', 'E05', 'E06', 'E07'],
+                    'DE': ['E01', 'E04', 'E05', 'E06'],
+                    'DE5': ['E01', 'E05'],
+                    'IT': ['E02', 'E07'],
+                    'DE8': ['E04']}
+        for code, event_ids in expected.iteritems():
+            loc = AdministrativeDivision.objects.get(code=code)
+            events = view.get_location_events(self.hazard_type, self.region, loc)
+            self.assertEqual(sorted(events.values_list('event_id', flat=True)), event_ids, code)
+
+        other = HazardType.objects.create(mnemonic='EQ', title='Earthquake', order=2, app=self.app)
+        loc = AdministrativeDivision.objects.get(code='DE')
+        self.assertFalse(view.get_location_events(other, self.region, loc).exists())
+        self.assertEqual(Event.objects.for_adm_division(loc).count(), 1)
+
+
+class FakeEventListView(EventListView):
+    """
+    Event list without risk analysis values from GeoServer
+    """
+
+    def get_event_values_for(self, risk, loc, event_ids=None, **kwargs):
+        return {}
+
+
+class EventListTestCase(RisksDataTestCase):
+
+    def setUp(self):
+        super(EventListTestCase, self).setUp()
+        (self.region, self.adms, self.app, self.hazard_type,) = create_events()
+        self.risk = create_risk_analysis('analysis', 'r_flood', self.hazard_type, self.region,
+                                         [self.adms['EU'], self.adms['DE']])
+        self.view = FakeEventListView.as_view()
+        self.factory = RequestFactory()
+
+    def get(self, loc='EU', **params):
+        request = self.factory.get('/risks/data_extraction/events/', params)
+        request.user = AnonymousUser()
+        return self.view(request, app=RiskApp.APP_DATA_EXTRACTION, reg=self.region.name, loc=loc,
+                         ht=self.hazard_type.mnemonic, at='r_flood', an=str(self.risk.id))
+
+    def get_pages(self, **params):
+        """
+        Returns event ids of all pages, following cursors
+        """
+        pages = []
+        cursor = None
+        while True:
+            if cursor:
+                params['cursor'] = cursor
+            response = self.get(**params)
+            self.assertEqual(response.status_code, 200, response.content)
+            data = json.loads(response.content)
+            pages.append([e['event_id'] for e in data['events']])
+            cursor = data['nextCursor']
+            if not cursor:
+                return pages
+
+    def test_pages(self):
+        """
+        Check if pages cover all events once, newest first, also when
+        page ends between events with the same begin date
+        """
+        expected = ['E07', 'E05', 'E04', 'E03', 'E02', 'E01', 'E06']
+        for page_size in range(1, 9):
+            pages = self.get_pages(page_size=page_size)
+            self.assertEqual(sum(pages, []), expected, page_size)
+            self.assertTrue(all(len(page) == page_size for page in pages[:-1]))
+            self.assertEqual(len(pages), max(1, (len(expected) + page_size - 1) // page_size))
+
+        self.assertEqual(self.get_pages(page_size=2, loc='DE'), [['E05', 'E04'], ['E01', 'E06']])
+        self.assertEqual(self.get_pages(page_size=2, **{'from': '2017-01-01', 'to': '2017-01-31'}),
+                         [['E03', 'E02'], ['E01']])
+
+    def test_cursor(self):
+        view = EventListView()
+        event = Event.objects.get(event_id='E02')
+        self.assertEqual(view.decode_cursor(view.encode_cursor(event)), (date(2017, 1, 1), 'E02',))
+
+        response = self.get(cursor=base64.urlsafe_b64encode('garbage'))
+        self.assertEqual(response.status_code, 400)
+        response = self.get(cursor='$')
+        self.assertEqual(response.status_code, 400)
+
+    def test_risk_analysis(self):
+        """
+        Check if risk analysis must be available at location
+        """
+        self.assertEqual(self.get(loc='IT').status_code, 404)
+        self.assertEqual(self.get(loc='XX').status_code, 404)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2017 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+import math
+import random
+import sys
+from array import array
+from datetime import date
+
+import msgpack
+from django.test import SimpleTestCase, RequestFactory
+
+from risks.packing import (pack_values, msgpack_response, accepts_msgpack,
+                           COLUMNAR_KEY, MSGPACK_CONTENT_TYPE)
+from risks.views import DataExtractionView
+
+
+class FakeDimension(object):
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+    def set_risk_analysis(self, risk):
+        return self
+
+    def export(self):
+        return {'name': self.name}
+
+
+class FakeDataExtractionView(DataExtractionView):
+
+    def get_dim_fields(self, analysis, dims):
+        return ['dim{}'.format(idx + 1) for idx in range(len(dims))]
+
+
+def reformat_features_rowwise(dims, features, capitalize=False):
+    """
+    Values built line by line, as before reformat_features was
+    rewritten column-wise; features are wrapped as WFS features
+    """
+    fields = ['dim{}_value'.format(idx + 1) for idx in range(len(dims))]
+    field_orders = ['dim{}_order'.format(idx + 1) for idx in range(len(dims))]
+
+    def make_order_val(feat):
+        _order_vals = []
+        for idx, field_name in enumerate(field_orders):
+            order_val = feat['properties'].get(field_name)
+            if order_val is None:
+                order_val = 0
+            mag = 1000 if idx == 0 else 1
+            _order_vals.append(int('{}'.format(order_val * mag)))
+        return sum(_order_vals)
+
+    values = []
+    for feat in features:
+        p = feat['properties']
+        line = [p[f] for f in fields]
+        line.append(p['value'])
+        line.append(make_order_val(feat))
+        if capitalize:
+            line = [str(item).capitalize() for item in line]
+        values.append(line)
+    values.sort(key=lambda line: line.pop(-1))
+    return values
+
+
+class ReformatFeaturesTestCase(SimpleTestCase):
+
+    def make_rows(self, count, seed):
+        rnd = random.Random(seed)
+        rows = []
+        for idx in range(count):
+            dim1_order = rnd.choice([None, 0, 1, 2, 3])
+            dim2_order = rnd.choice([None, 0, 1, 2, 10, 999])
+            rows.append({'dim1_value': 'scenario {}'.format(dim1_order),
+                         'dim1_order': dim1_order,
+                         'dim2_value': str(dim2_order),
+                         'dim2_order': dim2_order,
+                         'value': rnd.choice([None, 0.0, rnd.random() * 1000])})
+        return rows
+
+    def test_same_as_rowwise(self):
+        """
+        Check if values and their order (including ties and missing
+        orders) are the same as built line by line
+        """
+        view = FakeDataExtractionView()
+        dim1 = FakeDimension(1, 'Scenario')
+        dim2 = FakeDimension(2, 'Round Period')
+        for seed in range(5):
+            rows = self.make_rows(200, seed)
+            features = [{'properties': dict(r)} for r in rows]
+            for capitalize in (False, True,):
+                out = view.reformat_features(None, dim1, [dim1, dim2], rows, capitalize)
+                self.assertEqual(out['dimensions'], [{'name': 'Scenario'}, {'name': 'Round Period'}])
+                self.assertEqual(out['values'], reformat_features_rowwise([dim1, dim2], features, capitalize))
+
+        # the other dimension first
+        rows = self.make_rows(50, 10)
+        swapped = [{'dim1_value': r['dim2_value'], 'dim1_order': r['dim2_order'],
+                    'dim2_value': r['dim1_value'], 'dim2_order': r['dim1_order'],
+                    'value': r['value']} for r in rows]
+        out = view.reformat_features(None, dim2, [dim1, dim2], iter(swapped))
+        self.assertEqual(out['dimensions'], [{'name': 'Round Period'}, {'name': 'Scenario'}])
+        self.assertEqual(out['values'], reformat_features_rowwise([dim2, dim1],
+                                                                  [{'properties': r} for r in swapped]))
+
+    def test_empty(self):
+        view = FakeDataExtractionView()
+        dim1 = FakeDimension(1, 'Scenario')
+        out = view.reformat_features(None, dim1, [dim1], [])
+        self.assertEqual(out['values'], [])
+
+
+def unpack_values(packed):
+    """
+    Decodes column-encoded values matrix, as clients do
+    """
+    columns = []
+    for col in packed['columns']:
+        data = array('d' if col['type'] == 'float64' else 'I')
+        data.fromstring(bytes(col['data'] if col['type'] == 'float64' else col['indices']))
+        if sys.byteorder == 'big':
+            data.byteswap()
+        if col['type'] == 'float64':
+            columns.append([None if math.isnan(v) else v for v in data])
+        else:
+            columns.append([col['dictionary'][idx] for idx in data])
+    return [list(row) for row in zip(*columns)] if columns else []
+
+
+class PackingTestCase(SimpleTestCase):
+
+    VALUES = [['Hospital', '10', 1.5],
+              ['Hospital', '100', None],
+              [u'\xe9cole', '10', 3],
+              ['Hospital', None, 0.0]]
+
+    def test_pack_values(self):
+        packed = pack_values(self.VALUES)
+        self.assertTrue(packed[COLUMNAR_KEY])
+        self.assertEqual(packed['length'], 4)
+        self.assertEqual([c['type'] for c in packed['columns']], ['dictionary', 'dictionary', 'float64'])
+        self.assertEqual(packed['columns'][0]['dictionary'], ['Hospital', u'\xe9cole'])
+        self.assertEqual(unpack_values(packed), self.VALUES)
+        self.assertEqual(unpack_values(pack_values([])), [])
+
+    def test_msgpack_response(self):
+        """
+        Check if values survive msgpack round-trip
+        """
+        body = {'riskAnalysisData': {'data': {'values': pack_values(self.VALUES)}},
+                'date': date(2017, 1, 2),
+                'name': 'analysis'}
+        response = msgpack_response(body)
+        self.assertEqual(response['Content-Type'], MSGPACK_CONTENT_TYPE)
+        data = msgpack.unpackb(response.content, raw=False)
+        self.assertEqual(data['name'], u'analysis')
+        self.assertEqual(data['date'], u'2017-01-02')
+        self.assertEqual(unpack_values(data['riskAnalysisData']['data']['values']), self.VALUES)
+
+    def test_accepts_msgpack(self):
+        factory = RequestFactory()
+        self.assertTrue(accepts_msgpack(factory.get('/', HTTP_ACCEPT=MSGPACK_CONTENT_TYPE)))
+        self.assertTrue(accepts_msgpack(factory.get('/', {'format': 'msgpack'})))
+        self.assertFalse(accepts_msgpack(factory.get('/', {'format': 'json'}, HTTP_ACCEPT=MSGPACK_CONTENT_TYPE)))
+        self.assertFalse(accepts_msgpack(factory.get('/', HTTP_ACCEPT='application/json')))
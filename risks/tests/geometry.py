@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2017 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+import json
+import os
+import shutil
+import tempfile
+from importlib import import_module
+from StringIO import StringIO
+
+import mapbox_vector_tile
+from django.apps import apps
+from django.contrib.gis import geos
+from django.core.management import call_command
+from django.test import SimpleTestCase, RequestFactory
+from django.utils import six
+
+from risks import geometry_cache, tiles, topology
+from risks.adm_tree import adm_tree
+from risks.models import AdministrativeDivision, AdministrativeDivisionGeometry, Region, RiskApp
+from risks.point_index import RegionPointIndex, adm_point_index
+from risks.versioning import data_versions
+from risks.views import ReverseGeocodeView
+from risks.tests import RisksDataTestCase, create_adm, square_wkt
+from risks.tests.adm_tree import create_tree, TEST_TREE
+from risks.tests.cube import FakeRiskAnalysis
+
+# divisions of test tree with geometry
+GEOMETRY_CODES = [code for code, name, level, parent, corner in TEST_TREE if corner]
+
+
+class GeometryCacheTestCase(RisksDataTestCase):
+
+    def setUp(self):
+        super(GeometryCacheTestCase, self).setUp()
+        self.region, self.adms = create_tree()
+
+    def test_get_tolerance(self):
+        tolerances = geometry_cache.TOLERANCES
+        self.assertEqual(geometry_cache.get_tolerance(), tolerances[0])
+        self.assertEqual(geometry_cache.get_tolerance(tolerance=tolerances[-1] * 10), tolerances[-1])
+        self.assertEqual(geometry_cache.get_tolerance(tolerance=-1), tolerances[0])
+        # tolerance never gets coarser with zoom
+        by_zoom = [geometry_cache.get_tolerance(zoom=z) for z in range(0, 20)]
+        self.assertEqual(by_zoom, sorted(by_zoom, reverse=True))
+        self.assertEqual(by_zoom[-1], tolerances[0])
+
+    def test_to_geojson(self):
+        geom = geos.GEOSGeometry('POLYGON((0 0, 1 0, 1.00001 0.5, 1 1, 0 1, 0.123456789 0.5, 0 0))', srid=4326)
+        self.assertEqual(geometry_cache.to_geojson(geom, 0), geom.json)
+        simplified = json.loads(geometry_cache.to_geojson(geom, 0.001))
+        self.assertEqual(simplified['type'], 'Polygon')
+        # point closer than tolerance to the edge is removed,
+        # coordinates are rounded to tolerance precision
+        self.assertEqual(len(simplified['coordinates'][0]), 6)
+        self.assertIn([0.1235, 0.5], simplified['coordinates'][0])
+
+    def test_build_geometries(self):
+        count = geometry_cache.build_geometries(AdministrativeDivision.objects.all())
+        self.assertEqual(count, len(TEST_TREE))
+        self.assertEqual(AdministrativeDivisionGeometry.objects.count(),
+                         len(GEOMETRY_CODES) * len(geometry_cache.TOLERANCES))
+
+        adm = AdministrativeDivision.objects.with_geometry().get(code='DE5')
+        for tolerance in geometry_cache.TOLERANCES:
+            geojson = geometry_cache.get_geojson([adm.id], tolerance)
+            self.assertEqual(geojson, {adm.id: geometry_cache.to_geojson(adm.geometry, tolerance)})
+
+        # rebuild replaces entries
+        geometry_cache.build_geometries(AdministrativeDivision.objects.filter(code='DE5'))
+        self.assertEqual(AdministrativeDivisionGeometry.objects.count(),
+                         len(GEOMETRY_CODES) * len(geometry_cache.TOLERANCES))
+
+    def test_get_geojson_missing(self):
+        """
+        Check if original geometries are returned for divisions
+        missing in cache, without building them
+        """
+        geometry_cache.build_geometries(AdministrativeDivision.objects.filter(code='DE5'))
+        tolerance = geometry_cache.TOLERANCES[-1]
+        AdministrativeDivisionGeometry.objects.filter(tolerance=tolerance).update(geojson='cached')
+
+        ids = [self.adms[code].id for code in ('DE5', 'DE6', 'EU',)]
+        geojson = geometry_cache.get_geojson(ids, tolerance)
+        self.assertEqual(set(geojson), set(ids[:2]))
+        self.assertEqual(geojson[ids[0]], 'cached')
+        adm = AdministrativeDivision.objects.with_geometry().get(code='DE6')
+        self.assertEqual(geojson[ids[1]], adm.geometry.json)
+        self.assertFalse(AdministrativeDivisionGeometry.objects.filter(administrativedivision_id=ids[1]).exists())
+
+    def test_build_adm_geometries(self):
+        """
+        Check if command builds only missing geometries, unless all are
+        requested, and bumps adm divisions version if anything was built
+        """
+        geometry_cache.build_geometries(AdministrativeDivision.objects.filter(code='DE5'))
+        AdministrativeDivisionGeometry.objects.filter(administrativedivision=self.adms['DE5']).update(geojson='cached')
+
+        version = data_versions.get_versions([data_versions.ADM_SCOPE])[0]
+        call_command('build_adm_geometries', stdout=StringIO())
+        self.assertEqual(AdministrativeDivisionGeometry.objects.count(),
+                         len(GEOMETRY_CODES) * len(geometry_cache.TOLERANCES))
+        self.assertEqual(set(AdministrativeDivisionGeometry.objects.filter(administrativedivision=self.adms['DE5'])
+                                                                   .values_list('geojson', flat=True)),
+                         set(['cached']))
+        bumped = data_versions.get_versions([data_versions.ADM_SCOPE])[0]
+        self.assertTrue(bumped > version)
+
+        call_command('build_adm_geometries', all=True, stdout=StringIO())
+        self.assertFalse(AdministrativeDivisionGeometry.objects.filter(geojson='cached').exists())
+
+
+class TilesTestCase(RisksDataTestCase):
+
+    def setUp(self):
+        super(TilesTestCase, self).setUp()
+        self.region, self.adms = create_tree()
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TilesTestCase, self).tearDown()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_tile_bounds(self):
+        self.assertEqual(tiles.tile_bounds(0, 0, 0), (-tiles.ORIGIN, -tiles.ORIGIN, tiles.ORIGIN, tiles.ORIGIN,))
+        self.assertEqual(tiles.tile_bounds(1, 1, 0), (0, 0, tiles.ORIGIN, tiles.ORIGIN,))
+        self.assertTrue(tiles.is_valid_tile(1, 1, 1))
+        self.assertFalse(tiles.is_valid_tile(1, 2, 0))
+        self.assertFalse(tiles.is_valid_tile(-1, 0, 0))
+        self.assertFalse(tiles.is_valid_tile(tiles.MAX_ZOOM + 1, 0, 0))
+
+    def test_tile_key(self):
+        """
+        Check if tile keys change with adm divisions and analysis versions
+        """
+        risk = FakeRiskAnalysis(1)
+        base = tiles.get_tile_key(2, self.region.id)
+        key = tiles.get_tile_key(2, self.region.id, risk, 'Hospital', '10')
+        self.assertEqual(tiles.get_tile_key(2, self.region.id), base)
+        self.assertTrue(base.endswith('base'))
+        self.assertNotEqual(tiles.get_tile_key(2, None), base)
+        self.assertNotEqual(tiles.get_tile_key(2, self.region.id, risk, 'Hospital', '100'), key)
+
+        data_versions.bump(risk_analysis=risk)
+        self.assertEqual(tiles.get_tile_key(2, self.region.id), base)
+        bumped = tiles.get_tile_key(2, self.region.id, risk, 'Hospital', '10')
+        self.assertNotEqual(bumped, key)
+        self.assertEqual(bumped.split(os.sep)[:3], key.split(os.sep)[:3])
+
+        data_versions.bump_adm_divisions()
+        self.assertNotEqual(tiles.get_tile_key(2, self.region.id), base)
+
+    def test_tile_cache(self):
+        """
+        Check if tiles of older versions are removed when newer one is set
+        """
+        cache = tiles.TileCache(self.root)
+        key = os.path.join('1', 'l2-r', 'a1', '1', 'dims')
+        other_analysis = os.path.join('1', 'l2-r', 'a2', '1', 'dims')
+        self.assertIsNone(cache.get(key, 1, 0, 0))
+        cache.set(key, 1, 0, 0, 'tile')
+        cache.set(other_analysis, 1, 0, 0, 'other')
+        self.assertEqual(cache.get(key, 1, 0, 0), 'tile')
+
+        new_analysis_version = os.path.join('1', 'l2-r', 'a1', '2', 'dims')
+        cache.set(new_analysis_version, 1, 0, 0, 'new')
+        self.assertIsNone(cache.get(key, 1, 0, 0))
+        self.assertEqual(cache.get(other_analysis, 1, 0, 0), 'other')
+        self.assertEqual(cache.get(new_analysis_version, 1, 0, 0), 'new')
+
+        new_adm_version = os.path.join('2', 'l2-r', 'base')
+        cache.set(new_adm_version, 1, 0, 0, 'base')
+        self.assertEqual(os.listdir(self.root), ['2'])
+        self.assertEqual(cache.get(new_adm_version, 1, 0, 0), 'base')
+
+    def test_build_tile(self):
+        values = {'DE5': 1.5}
+        data = tiles.build_tile(0, 0, 0, 2, self.region.id, values.get)
+        features = mapbox_vector_tile.decode(data)[tiles.LAYER_NAME]['features']
+        self.assertEqual(sorted(f['properties']['code'] for f in features), sorted(GEOMETRY_CODES))
+        by_code = dict((f['properties']['code'], f['properties'],) for f in features)
+        self.assertEqual(by_code['DE5'], {'code': 'DE5', 'name': 'Berg', 'value': 1.5})
+        self.assertNotIn('value', by_code['DE6'])
+
+        # other region divisions are not in the tile
+        other = Region.objects.create(name='Other', level=0)
+        data = tiles.build_tile(0, 0, 0, 2, other.id)
+        self.assertEqual(mapbox_vector_tile.decode(data).get(tiles.LAYER_NAME, {}).get('features', []), [])
+
+        # tile far from divisions
+        data = tiles.build_tile(4, 0, 0, 2)
+        self.assertEqual(mapbox_vector_tile.decode(data).get(tiles.LAYER_NAME, {}).get('features', []), [])
+
+
+def square_geojson(x, y, size=1):
+    return {'type': 'Polygon',
+            'coordinates': [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]}
+
+
+def decode_rings(topo, obj):
+    """
+    Returns absolute coordinates of rings of topology object
+    """
+    (kx, ky,) = topo['transform']['scale']
+    (x0, y0,) = topo['transform']['translate']
+    arcs = []
+    for arc in topo['arcs']:
+        x = y = 0
+        points = []
+        for dx, dy in arc:
+            x += dx
+            y += dy
+            points.append((x * kx + x0, y * ky + y0,))
+        arcs.append(points)
+
+    rings = []
+    for polygon in obj['arcs']:
+        for ring_arcs in polygon:
+            ring = []
+            for idx in ring_arcs:
+                points = arcs[idx] if idx >= 0 else arcs[~idx][::-1]
+                ring.extend(points if not ring else points[1:])
+            rings.append(ring)
+    return rings
+
+
+class TopologyTestCase(SimpleTestCase):
+
+    def assertRingEqual(self, ring, coordinates):
+        self.assertEqual(ring[0], ring[-1])
+        self.assertEqual(len(ring), len(coordinates))
+        for (x, y), (ex, ey) in zip(sorted(ring[:-1]), sorted(tuple(c) for c in coordinates[:-1])):
+            self.assertAlmostEqual(x, ex, places=4)
+            self.assertAlmostEqual(y, ey, places=4)
+
+    def test_shared_border(self):
+        """
+        Check if border of neighbours is stored once and geometries
+        are restored from arcs
+        """
+        geometries = [square_geojson(0, 0), square_geojson(1, 0),
+                      {'type': 'Point', 'coordinates': [5, 5]}]
+        topo = topology.build_topology(geometries, [{'code': 'A'}, {'code': 'B'}, {'code': 'C'}])
+        objects = topo['objects']['divisions']['geometries']
+        self.assertEqual([o['properties'] for o in objects], [{'code': 'A'}, {'code': 'B'}, {'code': 'C'}])
+        self.assertEqual(len(topo['arcs']), 3)
+
+        arc_ids = [set(idx if idx >= 0 else ~idx for polygon in o['arcs'] for ring in polygon for idx in ring)
+                   for o in objects]
+        self.assertEqual(len(arc_ids[0] & arc_ids[1]), 1)
+        self.assertEqual(arc_ids[2], set())
+
+        for obj, geom in zip(objects, geometries[:2]):
+            (ring,) = decode_rings(topo, obj)
+            self.assertRingEqual(ring, geom['coordinates'][0])
+
+    def test_multipolygon(self):
+        geometry = {'type': 'MultiPolygon',
+                    'coordinates': [square_geojson(0, 0)['coordinates'], square_geojson(3, 3)['coordinates']]}
+        topo = topology.build_topology([geometry, geometry], [{}, {}])
+        (first, second,) = topo['objects']['divisions']['geometries']
+        # the same rings are shared whole
+        self.assertEqual(first['arcs'], second['arcs'])
+        rings = decode_rings(topo, first)
+        self.assertEqual(len(rings), 2)
+        self.assertRingEqual(rings[1], geometry['coordinates'][1][0])
+
+    def test_tolerance(self):
+        geometry = {'type': 'Polygon',
+                    'coordinates': [[[0, 0], [0.5, 0.0001], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+        topo = topology.build_topology([geometry], [{}])
+        (ring,) = decode_rings(topo, topo['objects']['divisions']['geometries'][0])
+        self.assertEqual(len(ring), 6)
+
+        topo = topology.build_topology([geometry], [{}], tolerance=0.01)
+        (ring,) = decode_rings(topo, topo['objects']['divisions']['geometries'][0])
+        self.assertRingEqual(ring, square_geojson(0, 0)['coordinates'][0])
+
+
+class GeometryStorageTestCase(RisksDataTestCase):
+
+    def setUp(self):
+        super(GeometryStorageTestCase, self).setUp()
+        self.region, self.adms = create_tree()
+
+    def test_fill_geom_wkb(self):
+        """
+        Check if migration fills WKB and bounding box from WKT
+        of divisions stored before
+        """
+        migration = import_module('risks.migrations.0099_administrativedivision_geom_wkb')
+        wkt = 'MULTIPOLYGON(((10 20, 12 20, 12 23, 10 23, 10 20)))'
+        create_adm('OLD', 'Old', 2, geom=None)
+        AdministrativeDivision.objects.filter(code='OLD').update(geom=wkt)
+        create_adm('EMPTY', 'Empty', 2)
+        stored = AdministrativeDivision.objects.with_geometry().get(code='DE5')
+
+        migration.fill_geom_wkb(apps, None)
+
+        adm = AdministrativeDivision.objects.with_geometry().get(code='OLD')
+        self.assertTrue(adm.geom_wkb)
+        self.assertEqual((adm.bbox_minx, adm.bbox_miny, adm.bbox_maxx, adm.bbox_maxy,), (10, 20, 12, 23,))
+        self.assertTrue(adm.geometry.equals(geos.GEOSGeometry(wkt)))
+        self.assertEqual(adm.geometry.geom_type, 'MultiPolygon')
+        self.assertEqual(adm.geometry.srid, 4326)
+
+        adm = AdministrativeDivision.objects.with_geometry().get(code='EMPTY')
+        self.assertIsNone(adm.geom_wkb)
+        self.assertIsNone(adm.geometry)
+
+        adm = AdministrativeDivision.objects.with_geometry().get(code='DE5')
+        self.assertEqual(bytes(adm.geom_wkb), bytes(stored.geom_wkb))
+
+    def test_geometry(self):
+        """
+        Check if geometry is read from WKB, or from WKT if WKB is missing
+        """
+        adm = AdministrativeDivision.objects.with_geometry().get(code='DE6')
+        self.assertTrue(adm.geometry.equals(geos.GEOSGeometry(square_wkt(1, 0))))
+        adm.geom = ''
+        self.assertTrue(adm.geometry.equals(geos.GEOSGeometry(square_wkt(1, 0))))
+
+        adm.geom = square_wkt(5, 5)
+        adm.geom_wkb = None
+        self.assertTrue(adm.geometry.equals(geos.GEOSGeometry(square_wkt(5, 5))))
+
+        fields = AdministrativeDivision.geometry_fields(geos.GEOSGeometry(square_wkt(5, 5)))
+        self.assertEqual((fields['bbox_minx'], fields['bbox_miny'], fields['bbox_maxx'], fields['bbox_maxy'],),
+                         (5, 5, 6, 6,))
+        self.assertTrue(geos.GEOSGeometry(six.memoryview(fields['geom_wkb'])).equals(geos.GEOSGeometry(fields['geom'])))
+
+    def test_deferred_geometry(self):
+        # geometry is not loaded unless asked for
+        adm = AdministrativeDivision.objects.get(code='DE6')
+        self.assertEqual(set(adm.get_deferred_fields()), set(['geom', 'geom_wkb']))
+
+    def test_intersecting_bbox(self):
+        codes = AdministrativeDivision.objects.intersecting_bbox(0.5, 0.5, 1.5, 0.8).values_list('code', flat=True)
+        self.assertEqual(sorted(codes), ['DE5', 'DE6'])
+        codes = AdministrativeDivision.objects.intersecting_bbox(0.2, 1.2, 0.3, 1.3).values_list('code', flat=True)
+        self.assertEqual(list(codes), ['IT1'])
+        self.assertFalse(AdministrativeDivision.objects.intersecting_bbox(50, 50, 51, 51).exists())
+
+
+class ReverseGeocodeTestCase(RisksDataTestCase):
+
+    def setUp(self):
+        super(ReverseGeocodeTestCase, self).setUp()
+        self.region, self.adms = create_tree()
+        self.app = RiskApp.objects.create(name=RiskApp.APP_DATA_EXTRACTION)
+
+    def test_region_point_index(self):
+        """
+        Check if the most detailed division containing point is found
+        """
+        nodes = adm_tree.get_level_nodes(None, self.region.id)
+        geometries = {self.adms['DE'].id: json.dumps(square_geojson(0, 0, 4)),
+                      self.adms['DE5'].id: json.dumps(square_geojson(0, 0)),
+                      self.adms['IT1'].id: json.dumps(square_geojson(0, 1))}
+        index = RegionPointIndex(nodes, geometries)
+        self.assertEqual(index.find(0.5, 0.5), 'DE5')
+        self.assertEqual(index.find(3.5, 0.5), 'DE')
+        self.assertEqual(index.find(0.5, 1.5), 'IT1')
+        self.assertIsNone(index.find(10, 10))
+        self.assertIsNone(RegionPointIndex(nodes, {}).find(0.5, 0.5))
+
+    def get(self, reg=None, **params):
+        request = RequestFactory().get('/risks/data_extraction/reg/Europe/point/', params)
+        return ReverseGeocodeView.as_view()(request, app=RiskApp.APP_DATA_EXTRACTION, reg=reg or self.region.name)
+
+    def test_view(self):
+        response = self.get(lon='2.5', lat='0.5')
+        self.assertEqual(response.status_code, 200, response.content)
+        data = json.loads(response.content)
+        self.assertEqual([item['label'] for item in data['navItems']], ['Europe', 'Germany', 'Bad Berg'])
+
+        self.assertEqual(adm_point_index.find(self.region.id, 0.5, 1.5), 'IT1')
+        self.assertEqual(self.get(lon='20', lat='20').status_code, 404)
+        self.assertEqual(self.get(lon='x', lat='0.5').status_code, 400)
+        self.assertEqual(self.get(lat='0.5').status_code, 400)
+        self.assertEqual(self.get(reg='Other', lon='2.5', lat='0.5').status_code, 404)
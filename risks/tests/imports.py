@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2017 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+import xlrd
+from xlrd.sheet import Cell
+
+from django.db import connections
+from django.test import SimpleTestCase, override_settings
+
+from risks.models import RiskApp, HazardType, RiskAnalysisAdministrativeDivisionAssociation
+from risks.management.commands.importriskdata import Command
+from risks.management.commands.action_utils import AdmEntry, DbUtils, ImportContext
+from risks.tests import DatastoreTestCase, create_adm, square_wkt
+from risks.tests.adm_tree import create_tree
+from risks.tests.events import create_risk_analysis
+
+DATASTORE_OGC_SERVER = {'default': {'DATASTORE': 'datastore'}}
+
+
+def fetch(sql, params=None):
+    with connections['datastore'].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+class Dimension(object):
+    """
+    Scenario or round period, as read from risk analysis metadata
+    """
+
+    def __init__(self, value, order):
+        self.value = value
+        self.order = order
+
+
+class FakeSheet(object):
+
+    def __init__(self, rows):
+        self.rows = [[self.make_cell(value) for value in row] for row in rows]
+        self.nrows = len(rows)
+
+    def make_cell(self, value):
+        if isinstance(value, float):
+            return Cell(xlrd.XL_CELL_NUMBER, value)
+        if value:
+            return Cell(xlrd.XL_CELL_TEXT, value)
+        return Cell(xlrd.XL_CELL_EMPTY, value)
+
+    def row(self, row_num):
+        return self.rows[row_num]
+
+    def cell(self, row_num, col_num):
+        return self.rows[row_num][col_num]
+
+
+class FakeWorkbook(object):
+
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def sheet_by_name(self, name):
+        return self.sheets[name]
+
+
+class ReadRowsTestCase(SimpleTestCase):
+
+    def test_read_rows(self):
+        """
+        Check if value read last wins, numeric adm codes get country
+        prefix and cells without number are skipped
+        """
+        hospital = FakeSheet([['', '', 'iso', '', '', 'code', 10.0, 100.0],
+                              ['', '', 'DE', '', '', 'DE5', 1.5, 2.0],
+                              ['', '', 'DE', '', '', 7.0, 3.0, 'n/a'],
+                              ['', '', 'DE', '', '', '', 4.0, 4.0],
+                              ['', '', 'DE', '', '', 'DE5', 9.0, 8.0]])
+        school = FakeSheet([['', '', 'iso', '', '', 'code', ' 10 '],
+                            ['', '', 'DE', '', '', 'DE6', 5.0]])
+        wb = FakeWorkbook({'Hospital': hospital, 'School': school})
+        scenarios = [Dimension('Hospital', 1), Dimension('School', 2)]
+        round_periods = [Dimension('10', 1), Dimension('100', 2), Dimension('1000', 3)]
+
+        rows = Command().read_rows(wb, scenarios, round_periods)
+        self.assertEqual(rows, [('DE5', 'Hospital', 1, '10', 1, '9.0'),
+                                ('DE00007', 'Hospital', 1, '10', 1, '3.0'),
+                                ('DE5', 'Hospital', 1, '100', 2, '8.0'),
+                                ('DE6', 'School', 2, '10', 1, '5.0')])
+        self.assertEqual(Command().read_rows(wb, scenarios, [Dimension('1000', 3)]), [])
+
+
+@override_settings(OGC_SERVER=DATASTORE_OGC_SERVER)
+class BulkImportTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(BulkImportTestCase, self).setUp()
+        self.region, self.adms = create_tree()
+        app = RiskApp.objects.create(name=RiskApp.APP_DATA_EXTRACTION)
+        self.hazard_type = HazardType.objects.create(mnemonic='FL', title='Flood', order=1, app=app)
+        self.risk = create_risk_analysis('flood risk', 'r_flood', self.hazard_type, self.region)
+        # division outside of region
+        create_adm('FR1', 'Paris', 2, geom='POLYGON((5 5, 6 5, 6 6, 5 6, 5 5))')
+
+    def import_rows(self, rows):
+        """
+        Runs bulk import in own transaction, as import command does
+        """
+        conn = DbUtils().get_db_conn()
+        try:
+            Command().bulk_import(conn, self.risk, self.region, rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_values(self):
+        return fetch("""SELECT a.adm_code, d1.dim_value, d2.dim_value, rd.value, rd.risk_analysis_id
+                        FROM risk_dimensions rd
+                        JOIN adm_divisions a ON a.fid = rd.adm_fid
+                        JOIN dimensions d1 ON d1.dim_id = rd.dim1_id
+                        JOIN dimensions d2 ON d2.dim_id = rd.dim2_id
+                        ORDER BY 1, 2, 3""")
+
+    def get_associated_codes(self):
+        return sorted(RiskAnalysisAdministrativeDivisionAssociation.objects.filter(riskanalysis=self.risk)
+                                                                   .values_list('administrativedivision__code',
+                                                                                flat=True))
+
+    def test_bulk_import(self):
+        """
+        Check if divisions and dimensions are created once, only new
+        divisions get geometry, and values are upserted on reimport
+        """
+        fetch("INSERT INTO adm_divisions (adm_name, adm_code, level) VALUES ('Bergheim', 'DE6', 2)")
+        connections['datastore'].commit()
+
+        self.import_rows([('DE5', 'Hospital', 1, '10', 1, '1.5'),
+                          ('DE6', 'Hospital', 1, '10', 1, '2.0'),
+                          ('DE6', 'School', 2, '100', 2, '3.0'),
+                          ('XX1', 'Hospital', 1, '10', 1, '4.0'),
+                          ('FR1', 'Hospital', 1, '10', 1, '5.0')])
+
+        rid = self.risk.id
+        self.assertEqual(fetch("SELECT id, name, hazard_type, region FROM risk_analysis"),
+                         [(rid, 'flood risk', 'FL', 'Europe',)])
+        self.assertEqual(fetch("""SELECT adm_code, level, parent_adm_code, the_geom IS NOT NULL
+                                  FROM adm_divisions ORDER BY adm_code"""),
+                         [('DE5', 2, 'DE', True,), ('DE6', 2, None, False,)])
+        self.assertEqual(fetch("""SELECT dim_col, dim_value, dim_order FROM dimensions
+                                  ORDER BY dim_col, dim_value"""),
+                         [('dim1', 'Hospital', 1,), ('dim1', 'School', 2,), ('dim2', '10', 1,), ('dim2', '100', 2,)])
+        self.assertEqual(self.get_values(), [('DE5', 'Hospital', '10', '1.5', rid,),
+                                             ('DE6', 'Hospital', '10', '2.0', rid,),
+                                             ('DE6', 'School', '100', '3.0', rid,)])
+        self.assertEqual(fetch("SELECT COUNT(*), COUNT(DISTINCT adm_fid) FROM risk_analysis_adm_divisions"),
+                         [(2, 2,)])
+        self.assertEqual(self.get_associated_codes(), ['DE5', 'DE6'])
+
+        self.import_rows([('DE5', 'Hospital', 1, '10', 1, '7.5'),
+                          ('DE8', 'Hospital', 1, '10', 1, '1.0')])
+
+        self.assertEqual(fetch("SELECT COUNT(*) FROM risk_analysis"), [(1,)])
+        self.assertEqual(fetch("SELECT adm_code FROM adm_divisions ORDER BY adm_code"),
+                         [('DE5',), ('DE6',), ('DE8',)])
+        self.assertEqual(fetch("SELECT COUNT(*) FROM dimensions"), [(4,)])
+        self.assertEqual(self.get_values(), [('DE5', 'Hospital', '10', '7.5', rid,),
+                                             ('DE6', 'Hospital', '10', '2.0', rid,),
+                                             ('DE6', 'School', '100', '3.0', rid,),
+                                             ('DE8', 'Hospital', '10', '1.0', rid,)])
+        self.assertEqual(fetch("SELECT COUNT(*), COUNT(DISTINCT adm_fid) FROM risk_analysis_adm_divisions"),
+                         [(3, 3,)])
+        self.assertEqual(self.get_associated_codes(), ['DE5', 'DE6', 'DE8'])
+
+    def test_existing_risk_analysis(self):
+        """
+        Check if values go to the first datastore risk analysis with
+        the same name and hazard type, as with row by row import
+        """
+        other_id = self.risk.id + 100
+        fetch("INSERT INTO risk_analysis (id, name, hazard_type, region) VALUES (%s, 'flood risk', 'FL', 'Other')",
+              [other_id])
+        connections['datastore'].commit()
+
+        self.import_rows([('DE5', 'Hospital', 1, '10', 1, '1.5')])
+        self.assertEqual(fetch("SELECT id FROM risk_analysis"), [(other_id,)])
+        self.assertEqual(self.get_values(), [('DE5', 'Hospital', '10', '1.5', other_id,)])
+
+
+@override_settings(OGC_SERVER=DATASTORE_OGC_SERVER)
+class ImportContextTestCase(DatastoreTestCase):
+
+    def setUp(self):
+        super(ImportContextTestCase, self).setUp()
+        self.region, self.adms = create_tree()
+        create_adm('FR1', 'Paris', 2)
+        self.conn = self.get_conn()
+        self.context = ImportContext(self.conn, self.region)
+
+    def get_conn(self):
+        conn = DbUtils().get_db_conn()
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_get_adm(self):
+        """
+        Check if divisions of region are loaded with one query
+        """
+        with self.assertNumQueries(1):
+            de5 = self.context.get_adm('DE5')
+            self.assertIsNone(self.context.get_adm('EU').parent_code)
+            self.assertIsNone(self.context.get_adm('FR1'))
+            self.assertIsNone(self.context.get_adm('XX'))
+        self.assertEqual(de5, AdmEntry(self.adms['DE5'].id, 'DE5', 'Berg', 2, 'DE'))
+        self.assertIsNotNone(ImportContext(self.conn).get_adm('FR1'))
+
+    def test_get_adm_fid(self):
+        """
+        Check if existing datastore division is reused, and missing
+        one is inserted with geometry once
+        """
+        fetch("INSERT INTO adm_divisions (adm_name, adm_code, level) VALUES ('Bergheim', 'DE6', 2)")
+        connections['datastore'].commit()
+        ((existing_fid,),) = fetch("SELECT fid FROM adm_divisions")
+
+        de5 = self.context.get_adm('DE5')
+        self.assertEqual(self.context.get_adm_fid(self.context.get_adm('DE6')), existing_fid)
+        fid = self.context.get_adm_fid(de5)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.context.get_adm_fid(de5), fid)
+        self.conn.commit()
+
+        self.assertEqual(fetch("""SELECT fid, adm_code, adm_name, parent_adm_code,
+                                         ST_Equals(the_geom, ST_GeomFromText(%s, 4326))
+                                  FROM adm_divisions ORDER BY fid""", [square_wkt(0, 0)]),
+                         [(existing_fid, 'DE6', 'Bergheim', None, None,), (fid, 'DE5', 'Berg', 'DE', True,)])
+
+    def test_dimensions(self):
+        hospital = self.context.get_dimension_id('dim1', 'Hospital', 1)
+        self.assertEqual(self.context.get_dimension_id('dim1', 'Hospital', 1), hospital)
+        self.assertNotEqual(self.context.get_dimension_id('dim2', 'Hospital', 1), hospital)
+        self.conn.commit()
+        self.assertEqual(fetch("SELECT COUNT(*) FROM dimensions"), [(2,)])
+
+        # lookup is loaded from datastore
+        self.assertEqual(ImportContext(self.get_conn()).get_dimension_id('dim1', 'Hospital', 1), hospital)
+
+    def test_risk_analysis_id(self):
+        """
+        Check if missing risk analysis is looked up again, and the
+        first one is returned when there are more
+        """
+        self.assertIsNone(self.context.get_risk_analysis_id('flood risk', 'FL'))
+        fetch("""INSERT INTO risk_analysis (id, name, hazard_type, region)
+                 VALUES (7, 'flood risk', 'FL', 'Europe'), (3, 'flood risk', 'FL', 'Other'),
+                        (1, 'flood risk', 'EQ', 'Europe')""")
+        connections['datastore'].commit()
+        self.assertEqual(self.context.get_risk_analysis_id('flood risk', 'FL'), 3)
+
+    def test_links(self):
+        """
+        Check if risk analysis and division are linked once, also when
+        linked before import
+        """
+        fetch("INSERT INTO risk_analysis_adm_divisions (risk_analysis_id, adm_fid) VALUES (1, 10)")
+        connections['datastore'].commit()
+        for adm_fid in (10, 11, 11,):
+            self.context.link_risk_analysis_adm(1, adm_fid)
+        self.context.link_risk_analysis_adm(2, 11)
+        self.conn.commit()
+        self.assertEqual(fetch("""SELECT risk_analysis_id, adm_fid FROM risk_analysis_adm_divisions
+                                  ORDER BY 1, 2"""), [(1, 10,), (1, 11,), (2, 11,)])
+
+        app = RiskApp.objects.create(name=RiskApp.APP_DATA_EXTRACTION)
+        hazard_type = HazardType.objects.create(mnemonic='FL', title='Flood', order=1, app=app)
+        risk = create_risk_analysis('flood risk', 'r_flood', hazard_type, self.region, [self.adms['DE5']])
+        for code in ('DE5', 'DE6', 'DE6',):
+            self.context.associate_risk_analysis(risk, self.context.get_adm(code))
+        associated = (RiskAnalysisAdministrativeDivisionAssociation.objects.filter(riskanalysis=risk)
+                                                                   .values_list('administrativedivision__code',
+                                                                                flat=True))
+        self.assertEqual(sorted(associated), ['DE5', 'DE6'])
+
+    def test_use_connection(self):
+        """
+        Check if datastore lookups are reloaded for new connection,
+        as rows inserted through previous one may have been rolled back
+        """
+        de5 = self.context.get_adm('DE5')
+        self.context.get_adm_fid(de5)
+        self.context.get_dimension_id('dim1', 'Hospital', 1)
+        self.conn.rollback()
+
+        # same connection keeps lookups
+        self.context.use_connection(self.conn)
+        self.assertIsNotNone(self.context._adm_fids)
+
+        self.context.use_connection(self.get_conn())
+        fid = self.context.get_adm_fid(de5)
+        dim_id = self.context.get_dimension_id('dim1', 'Hospital', 1)
+        self.context.conn.commit()
+        self.assertEqual(fetch("SELECT fid FROM adm_divisions"), [(fid,)])
+        self.assertEqual(fetch("SELECT dim_id FROM dimensions"), [(dim_id,)])
+
+
+class CopyValueTestCase(SimpleTestCase):
+
+    def test_copy_value(self):
+        db = DbUtils()
+        self.assertEqual(db._copy_value(None), '\\N')
+        self.assertEqual(db._copy_value(1.5), '1.5')
+        self.assertEqual(db._copy_value('a\tb\\c\nd\re'), 'a\\tb\\\\c\\nd\\re')
+        self.assertEqual(db._copy_value(u'\xe9cole'), '\xc3\xa9cole')
+
+
+@override_settings(OGC_SERVER=DATASTORE_OGC_SERVER)
+class CopyRowsTestCase(DatastoreTestCase):
+
+    def test_copy_rows(self):
+        """
+        Check if values with special characters survive COPY
+        """
+        rows = [(u'dim1', u'a\tb\\c\nd', 1,), (None, u'\xe9cole', 2,), (u'dim2', u'\\N', 3,)]
+        conn = DbUtils().get_db_conn()
+        try:
+            DbUtils().copy_rows(conn.cursor(), 'dimensions', ('dim_col', 'dim_value', 'dim_order',), rows)
+            conn.commit()
+        finally:
+            conn.close()
+        self.assertEqual(fetch("SELECT dim_col, dim_value, dim_order FROM dimensions ORDER BY dim_order"), rows)
@@ -0,0 +1,74 @@
+CREATE TABLE if not exists public.adm_divisions
+(
+  fid serial not null,
+  the_geom geometry(Geometry,4326),
+  adm_name character varying(100),
+  adm_code character varying(30),
+  parent_adm_code character varying(30),
+  level integer,
+  CONSTRAINT adm_divisions_pkey PRIMARY KEY (fid)
+)
+WITH (
+  OIDS=FALSE
+);
+
+CREATE INDEX if not exists adm_divisions_code_idx
+  ON public.adm_divisions (adm_code, level);
+
+--
+
+CREATE TABLE if not exists public.risk_analysis
+(
+  id integer not null,
+  name character varying(80),
+  hazard_type character varying(30),
+  region character varying(80),
+  CONSTRAINT risk_analysis_pkey PRIMARY KEY (id)
+)
+WITH (
+  OIDS=FALSE
+);
+
+--
+
+CREATE TABLE if not exists public.risk_analysis_adm_divisions
+(
+  risk_analysis_id integer,
+  adm_fid integer
+)
+WITH (
+  OIDS=FALSE
+);
+
+--
+
+CREATE TABLE if not exists public.dimensions
+(
+  dim_id serial not null,
+  dim_col character varying(30),
+  dim_value character varying(255),
+  dim_order integer not null default 0,
+  CONSTRAINT dimensions_pkey PRIMARY KEY (dim_id)
+)
+WITH (
+  OIDS=FALSE
+);
+
+--
+
+CREATE TABLE if not exists public.risk_dimensions
+(
+  adm_fid integer,
+  risk_analysis_id integer,
+  dim1_id integer,
+  dim2_id integer,
+  dim3_id integer,
+  dim4_id integer,
+  dim5_id integer,
+  value character varying(255),
+  event_id character varying(25) not null default '',
+  CONSTRAINT risk_dimensions_unique_constraint UNIQUE (adm_fid, dim1_id, dim2_id, risk_analysis_id, event_id)
+)
+WITH (
+  OIDS=FALSE
+);
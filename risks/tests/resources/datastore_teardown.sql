@@ -0,0 +1,17 @@
+DROP TABLE if exists public.risk_dimensions CASCADE;
+
+--
+
+DROP TABLE if exists public.dimensions CASCADE;
+
+--
+
+DROP TABLE if exists public.risk_analysis_adm_divisions CASCADE;
+
+--
+
+DROP TABLE if exists public.risk_analysis CASCADE;
+
+--
+
+DROP TABLE if exists public.adm_divisions CASCADE;
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2017 OSGeo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test import SimpleTestCase, RequestFactory, override_settings
+
+from risks.versioning import (DataVersions, data_versions, versioned_cache_page,
+                              conditional_data_view, check_version_cache)
+from risks.tests import TEST_CACHES
+
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class FakeUser(object):
+
+    def __init__(self, pk):
+        self.pk = pk
+
+    def is_authenticated(self):
+        return True
+
+
+class CountingView(object):
+    """
+    View counting calls, returning number of calls made so far
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, request, *args, **kwargs):
+        self.calls += 1
+        return HttpResponse(str(self.calls))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DataVersionsTestCase(SimpleTestCase):
+
+    def setUp(self):
+        data_versions.cache.clear()
+        self.factory = RequestFactory()
+
+    def get_request(self, user=None, **extra):
+        request = self.factory.get('/risks/data_extraction/reg/Afghanistan/', **extra)
+        request.user = user or AnonymousUser()
+        return request
+
+    def test_bump(self):
+        """
+        Check if versions stay the same until scope is bumped, and
+        bump increases them
+        """
+        scopes = data_versions.get_scopes(reg='Afghanistan', an='1')
+        self.assertEqual(scopes, ['adm', 'region:Afghanistan', 'analysis:1'])
+        versions = data_versions.get_versions(scopes + ['region:Italy', 'global'])
+        self.assertEqual(data_versions.get_versions(scopes + ['region:Italy', 'global']), versions)
+
+        data_versions.bump(region='Afghanistan', risk_analysis=1)
+        bumped = data_versions.get_versions(scopes + ['region:Italy', 'global'])
+        self.assertEqual(bumped[0], versions[0])
+        self.assertTrue(bumped[1] > versions[1])
+        self.assertTrue(bumped[2] > versions[2])
+        self.assertEqual(bumped[3], versions[3])
+        self.assertTrue(bumped[4] > versions[4])
+
+        data_versions.bump_adm_divisions()
+        self.assertTrue(data_versions.get_versions(['adm'])[0] > bumped[0])
+
+        # consecutive bumps always give new version
+        data_versions.bump(region='Afghanistan')
+        version = data_versions.get_versions(['region:Afghanistan'])[0]
+        data_versions.bump(region='Afghanistan')
+        self.assertTrue(data_versions.get_versions(['region:Afghanistan'])[0] > version)
+
+    @override_settings(CACHES=DUMMY_CACHES)
+    def test_dummy_cache(self):
+        versions = DataVersions()
+        version = versions.get_versions(['region:Afghanistan'])
+        self.assertEqual(versions.get_versions(['region:Afghanistan']), version)
+        versions.bump(region='Afghanistan')
+        self.assertTrue(versions.get_versions(['region:Afghanistan'])[0] > version[0])
+
+    def test_key_prefix(self):
+        """
+        Check if cache key prefix depends on data versions and user
+        """
+        prefix = data_versions.get_key_prefix(self.get_request(), reg='Afghanistan')
+        self.assertEqual(data_versions.get_key_prefix(self.get_request(), reg='Afghanistan'), prefix)
+        self.assertTrue(prefix.endswith(':u'))
+        self.assertNotEqual(data_versions.get_key_prefix(self.get_request(FakeUser(1)), reg='Afghanistan'), prefix)
+
+        data_versions.bump(region='Afghanistan')
+        self.assertNotEqual(data_versions.get_key_prefix(self.get_request(), reg='Afghanistan'), prefix)
+
+    def test_versioned_cache_page(self):
+        """
+        Check if response is cached until data is imported,
+        and not shared between users
+        """
+        counter = CountingView()
+        view = versioned_cache_page(60)(counter)
+        self.assertEqual(view(self.get_request(), reg='Afghanistan').content, '1')
+        self.assertEqual(view(self.get_request(), reg='Afghanistan').content, '1')
+
+        self.assertEqual(view(self.get_request(FakeUser(1)), reg='Afghanistan').content, '2')
+        self.assertEqual(view(self.get_request(FakeUser(1)), reg='Afghanistan').content, '2')
+
+        # other region data doesn't matter
+        data_versions.bump(region='Italy')
+        self.assertEqual(view(self.get_request(), reg='Afghanistan').content, '1')
+
+        data_versions.bump(region='Afghanistan')
+        self.assertEqual(view(self.get_request(), reg='Afghanistan').content, '3')
+
+    def test_conditional_data_view(self):
+        """
+        Check if conditional GET is answered with 304 while data
+        versions are the same
+        """
+        counter = CountingView()
+        view = conditional_data_view(counter)
+        response = view(self.get_request(), reg='Afghanistan')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = view(self.get_request(HTTP_IF_NONE_MATCH=etag), reg='Afghanistan')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(counter.calls, 1)
+
+        # other user gets other representation
+        response = view(self.get_request(FakeUser(1), HTTP_IF_NONE_MATCH=etag), reg='Afghanistan')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        data_versions.bump(region='Afghanistan')
+        response = view(self.get_request(HTTP_IF_NONE_MATCH=etag), reg='Afghanistan')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_check_version_cache(self):
+        self.assertEqual([w.id for w in check_version_cache(None)], ['risks.W001'])
+        with self.settings(CACHES=DUMMY_CACHES):
+            self.assertEqual(check_version_cache(None), [])
@@ -254,6 +254,32 @@ class RisksViewTestCase(RisksTestCase):
                 # cannot evaluate
                 #self.assertTrue(len(data['riskAnalysisData']['data']['values'])>0)
 
+    def test_event_views(self):
+        """
+        Check if event list and event summary views respond
+        """
+        risk = RiskAnalysis.objects.filter(administrative_divisions__code='AF').first()
+        args = (risk.region.name, 'AF', risk.hazard_type.mnemonic, risk.analysis_type.name, risk.id,)
+        for url_name in ('analysis_events', 'analysis_events_summary',):
+            url = risk.app.url_for(url_name, *args)
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200,
+                             'wrong status on {}: {}'.format(url, resp.content))
+            data = json.loads(resp.content)
+            self.assertFalse(data.get('errors'))
+
+        url = risk.app.url_for('analysis_events', *args)
+        resp = self.client.get(url, {'page_size': 1})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(len(json.loads(resp.content)['events']) <= 1)
+
+        # risk analysis id is accepted only with its own hazard type
+        other_ht = HazardType.objects.filter(app=risk.app).exclude(id=risk.hazard_type_id).first()
+        url = risk.app.url_for('analysis_events', risk.region.name, 'AF', other_ht.mnemonic,
+                               risk.analysis_type.name, risk.id)
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 404)
+
     def get_risk_analysis(self, url):
         client = self.client
         resp = client.get(url)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import errno
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+
+import mapbox_vector_tile
+from django.conf import settings
+from shapely.geometry import MultiPolygon, box, shape
+from shapely.ops import transform
+
+from risks import geometry_cache
+from risks.adm_tree import adm_tree
+from risks.versioning import data_versions
+
+log = logging.getLogger(__name__)
+
+MVT_CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+LAYER_NAME = 'administrative_divisions'
+MAX_ZOOM = 22
+
+# tiles are in web mercator (EPSG:3857), XYZ scheme
+EARTH_RADIUS = 6378137.0
+ORIGIN = math.pi * EARTH_RADIUS
+MAX_LATITUDE = 85.0511287798
+
+EXTENT = 4096
+# geometries are clipped a bit outside of the tile (in tile units),
+# so polygon outlines don't show at tile edges
+BUFFER = 64
+
+
+def _to_mercator(xs, ys, zs=None):
+    # called by shapely transform with coordinate sequences
+    return ([ORIGIN * x / 180.0 for x in xs],
+            [EARTH_RADIUS * math.log(math.tan(math.pi / 4 + math.radians(max(min(y, MAX_LATITUDE), -MAX_LATITUDE)) / 2))
+             for y in ys])
+
+
+def tile_bounds(z, x, y):
+    """
+    Returns (minx, miny, maxx, maxy) of tile, in web mercator
+    """
+    size = 2 * ORIGIN / 2 ** z
+    minx = -ORIGIN + x * size
+    maxy = ORIGIN - y * size
+    return (minx, maxy - size, minx + size, maxy,)
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _polygonal(geom):
+    # clipping can leave lines and points where polygons touch clip box
+    if geom.geom_type in ('Polygon', 'MultiPolygon',):
+        return geom
+    if geom.geom_type == 'GeometryCollection':
+        polygons = []
+        for part in geom:
+            if part.geom_type == 'Polygon':
+                polygons.append(part)
+            elif part.geom_type == 'MultiPolygon':
+                polygons.extend(part)
+        if polygons:
+            return MultiPolygon(polygons)
+
+
+class TileLayerIndex(object):
+    """
+    Process-level index of administrative divisions geometries in web
+    mercator, per level and simplification tolerance.
+
+    Geometries are read from prebuilt geometry cache
+    (see :py:mod:`risks.geometry_cache`), the index is dropped when
+    administrative divisions data version changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._layers = {}
+        self._version = None
+
+    def _load(self, level, tolerance):
+        nodes = adm_tree.get_level_nodes(level)
+        geometries = geometry_cache.get_geojson([adm_id for adm_id, code, name in nodes], tolerance)
+        out = []
+        for adm_id, code, name in nodes:
+            if adm_id not in geometries:
+                continue
+            geom = transform(_to_mercator, shape(json.loads(geometries[adm_id])))
+            out.append((geom.bounds, geom, code, name,))
+        log.info("loaded tile index for level %s, tolerance %s: %s divisions", level, tolerance, len(out))
+        return out
+
+    def get_layer(self, level, tolerance):
+        version = data_versions.get_versions([data_versions.ADM_SCOPE])[0]
+        key = (level, tolerance,)
+        with self._lock:
+            if version != self._version:
+                self._layers = {}
+                self._version = version
+            layer = self._layers.get(key)
+        if layer is None:
+            layer = self._load(level, tolerance)
+            with self._lock:
+                if version == self._version:
+                    self._layers[key] = layer
+        return layer
+
+    def get_features(self, level, tolerance, bounds, codes=None):
+        """
+        Returns (geometry, code, name) of divisions at given level, which
+        bounding boxes intersect bounds, optionally limited to codes
+        """
+        minx, miny, maxx, maxy = bounds
+        out = []
+        for (gminx, gminy, gmaxx, gmaxy), geom, code, name in self.get_layer(level, tolerance):
+            if gminx > maxx or gmaxx < minx or gminy > maxy or gmaxy < miny:
+                continue
+            if codes is not None and code not in codes:
+                continue
+            out.append((geom, code, name,))
+        return out
+
+
+tile_index = TileLayerIndex()
+
+
+def build_tile(z, x, y, level, region_id=None, get_value=None):
+    """
+    Returns encoded Mapbox Vector Tile with divisions at given level.
+
+    Geometries are simplified with prebuilt tolerance matching zoom,
+    clipped to tile (with buffer) and quantised to tile extent.
+    `get_value`, if given, is called with division code and returned
+    value is set as `value` feature property.
+    """
+    bounds = tile_bounds(z, x, y)
+    buf = (bounds[2] - bounds[0]) * BUFFER / EXTENT
+    clip = box(bounds[0] - buf, bounds[1] - buf, bounds[2] + buf, bounds[3] + buf)
+    codes = None
+    if region_id is not None:
+        codes = set(code for adm_id, code, name in adm_tree.get_level_nodes(level, region_id))
+
+    features = []
+    for geom, code, name in tile_index.get_features(level, geometry_cache.get_tolerance(zoom=z), clip.bounds, codes):
+        geom = _polygonal(geom if clip.contains(geom) else geom.intersection(clip))
+        if geom is None or geom.is_empty:
+            continue
+        properties = {'code': code, 'name': name}
+        if get_value is not None:
+            value = get_value(code)
+            if value is not None:
+                properties['value'] = value
+        features.append({'geometry': geom, 'properties': properties})
+
+    return mapbox_vector_tile.encode([{'name': LAYER_NAME, 'features': features}],
+                                     quantize_bounds=bounds, extents=EXTENT)
+
+
+def get_tile_key(level, region_id=None, risk=None, dim1=None, dim2=None):
+    """
+    Returns tile cache key (relative directory) for tile params and
+    current data versions: <adm version>/<level, region>/base, or
+    <adm version>/<level, region>/a<analysis id>/<analysis version>/<dims>
+    """
+    scopes = [data_versions.ADM_SCOPE]
+    if risk is not None:
+        scopes.append(data_versions.get_analysis_scope(risk))
+    versions = data_versions.get_versions(scopes)
+    parts = [str(versions[0]), 'l{}-r{}'.format(level, region_id or '')]
+    if risk is None:
+        parts.append('base')
+    else:
+        dims = hashlib.sha1(u'|'.join([dim1 or u'', dim2 or u'']).encode('utf-8')).hexdigest()[:12]
+        parts.extend(['a{}'.format(risk.id), str(versions[1]), dims])
+    return os.path.join(*parts)
+
+
+class TileCache(object):
+    """
+    Disk cache of encoded tiles. Keys contain data versions, so tiles of
+    older versions are never read. They are removed when the first tile
+    of newer version is written.
+    """
+
+    # positions of version components in keys (see get_tile_key())
+    VERSION_DEPTHS = (0, 3,)
+
+    def __init__(self, root):
+        self.root = root
+
+    def get_path(self, key, z, x, y):
+        return os.path.join(self.root, key, str(z), str(x), '{}.pbf'.format(y))
+
+    def get(self, key, z, x, y):
+        try:
+            with open(self.get_path(key, z, x, y), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def prune(self, key):
+        """
+        Removes directories of other versions than ones in key
+        """
+        parts = key.split(os.sep)
+        for depth in self.VERSION_DEPTHS:
+            if depth >= len(parts):
+                continue
+            parent = os.path.join(self.root, *parts[:depth])
+            try:
+                names = os.listdir(parent)
+            except OSError:
+                continue
+            for name in names:
+                if name != parts[depth]:
+                    log.info("removing superseded tiles: %s", os.path.join(parent, name))
+                    shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+
+    def set(self, key, z, x, y, data):
+        path = self.get_path(key, z, x, y)
+        dirname = os.path.dirname(path)
+        new_key = not os.path.isdir(os.path.join(self.root, key))
+        try:
+            os.makedirs(dirname)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        if new_key:
+            self.prune(key)
+        # written aside and moved, so readers never see partial tile
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+
+
+tile_cache = TileCache(getattr(settings, 'RISKS_TILE_CACHE_DIR',
+                               os.path.join(tempfile.gettempdir(), 'risks_tiles')))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import math
+
+# number of distinct coordinate values on each axis
+QUANTIZATION = 100000
+
+
+def _polygons(geometry):
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+
+def _edge(a, b):
+    return (a, b,) if a < b else (b, a,)
+
+
+def _rotate(points, start):
+    # closed ring (first point repeated at the end), started at given index
+    points = points[:-1]
+    points = points[start:] + points[:start]
+    return points + [points[0]]
+
+
+def _simplify(points, tolerance, kx, ky):
+    """
+    Douglas-Peucker simplification of quantized arc, tolerance is
+    in original units (scaled with kx, ky)
+    """
+    if tolerance <= 0 or len(points) < 3:
+        return points
+    if points[0] == points[-1]:
+        # closed arc: split at the farthest point, so it's not collapsed
+        x0, y0 = points[0]
+        far = max(range(len(points)),
+                  key=lambda i: ((points[i][0] - x0) * kx) ** 2 + ((points[i][1] - y0) * ky) ** 2)
+        if far in (0, len(points) - 1,):
+            return points
+        return _simplify(points[:far + 1], tolerance, kx, ky)[:-1] + _simplify(points[far:], tolerance, kx, ky)
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1,)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = points[first][0] * kx, points[first][1] * ky
+        bx, by = points[last][0] * kx, points[last][1] * ky
+        dx, dy = bx - ax, by - ay
+        length = math.hypot(dx, dy)
+        max_dist, max_idx = 0, None
+        for idx in range(first + 1, last):
+            px, py = points[idx][0] * kx, points[idx][1] * ky
+            if length:
+                dist = abs(dy * px - dx * py + bx * ay - by * ax) / length
+            else:
+                dist = math.hypot(px - ax, py - ay)
+            if dist > max_dist:
+                max_dist, max_idx = dist, idx
+        if max_idx is not None and max_dist > tolerance:
+            keep[max_idx] = True
+            stack.append((first, max_idx,))
+            stack.append((max_idx, last,))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def build_topology(geometries, properties, tolerance=0, object_name='divisions', quantization=QUANTIZATION):
+    """
+    Returns quantized TopoJSON topology (dict) for list of GeoJSON
+    polygonal geometries (dicts) and their properties.
+
+    Rings are cut into arcs where the set of rings sharing their edges
+    changes, so borders between neighbours are stored once. Arcs are
+    simplified with tolerance after that, so neighbours stay aligned.
+    """
+    polygons = [_polygons(g) for g in geometries]
+    coords = [pt for geom in polygons for polygon in geom for ring in polygon for pt in ring]
+    if coords:
+        x0, x1 = min(pt[0] for pt in coords), max(pt[0] for pt in coords)
+        y0, y1 = min(pt[1] for pt in coords), max(pt[1] for pt in coords)
+    else:
+        x0 = x1 = y0 = y1 = 0
+    kx = (x1 - x0) / float(quantization - 1) or 1
+    ky = (y1 - y0) / float(quantization - 1) or 1
+
+    # quantized rings, as geometry -> polygon -> ring index
+    rings = []
+    structure = []
+    for geom in polygons:
+        geom_rings = []
+        for polygon in geom:
+            polygon_rings = []
+            for ring in polygon:
+                points = []
+                for x, y in (pt[:2] for pt in ring):
+                    pt = (int(round((x - x0) / kx)), int(round((y - y0) / ky)),)
+                    if not points or points[-1] != pt:
+                        points.append(pt)
+                if points and points[0] != points[-1]:
+                    points.append(points[0])
+                if len(points) < 4:
+                    continue
+                polygon_rings.append(len(rings))
+                rings.append(points)
+            if polygon_rings:
+                geom_rings.append(polygon_rings)
+        structure.append(geom_rings)
+
+    owners = {}
+    for ring_idx, points in enumerate(rings):
+        for a, b in zip(points, points[1:]):
+            owners.setdefault(_edge(a, b), set()).add(ring_idx)
+
+    arcs = []
+    arc_lookup = {}
+
+    def arc_index(points):
+        key = tuple(points)
+        idx = arc_lookup.get(key)
+        if idx is not None:
+            return idx
+        idx = arc_lookup.get(key[::-1])
+        if idx is not None:
+            return ~idx
+        idx = arc_lookup[key] = len(arcs)
+        arcs.append(points)
+        return idx
+
+    ring_arcs = []
+    for points in rings:
+        edge_owners = [frozenset(owners[_edge(a, b)]) for a, b in zip(points, points[1:])]
+        cuts = [i for i in range(len(edge_owners)) if edge_owners[i - 1] != edge_owners[i]]
+        if not cuts:
+            # the same ring can be shared whole, so it starts at canonical point
+            ring = _rotate(points, points.index(min(points[:-1])))
+            ring_arcs.append([arc_index(ring)])
+            continue
+        ring = _rotate(points, cuts[0])
+        cuts = [c - cuts[0] for c in cuts] + [len(ring) - 1]
+        ring_arcs.append([arc_index(ring[start:end + 1]) for start, end in zip(cuts, cuts[1:])])
+
+    encoded = []
+    for points in arcs:
+        points = _simplify(points, tolerance, kx, ky)
+        out = [list(points[0])]
+        for prev, cur in zip(points, points[1:]):
+            out.append([cur[0] - prev[0], cur[1] - prev[1]])
+        encoded.append(out)
+
+    objects = []
+    for geom_rings, props in zip(structure, properties):
+        objects.append({'type': 'MultiPolygon',
+                        'arcs': [[ring_arcs[ring_idx] for ring_idx in polygon] for polygon in geom_rings],
+                        'properties': props})
+
+    return {'type': 'Topology',
+            'transform': {'scale': [kx, ky], 'translate': [x0, y0]},
+            'objects': {object_name: {'type': 'GeometryCollection', 'geometries': objects}},
+            'arcs': encoded}
@@ -23,6 +23,7 @@ api_urls = [
 urlpatterns = [
     url(r'^geom/', include(geometry_urls, namespace="geom")),
     url(r'^api/', include(api_urls, namespace='api')),
+    url(r'^tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.pbf$', geometry_views.administrative_tile_view, name='tiles'),
 ]
 
 _urls = (
@@ -39,10 +40,13 @@ _urls = (
     (r'reg/(?P<reg>[\w\-]+)/loc/(?P<loc>[\w\-]+)/ht/(?P<ht>[\w\-]+)/at/(?P<at>[\w\-]+)/an/(?P<an>[\w\-]+)/load/(?P<load>[\w\-]+)/$', views.data_extraction, 'analysis_all',),
     (r'reg/(?P<reg>[\w\-]+)/loc/(?P<loc>[\w\-]+)/ht/(?P<ht>[\w\-]+)/at/(?P<at>[\w\-]+)/an/(?P<an>[\w\-]+)/from/(?P<from>[\w\-]+)/to/(?P<to>[\w\-]+)/$', views.data_extraction, 'analysis_daterange',),
     (r'loc/(?P<loc>[\w\-]+)/ht/(?P<ht>[\w\-]+)/at/(?P<at>[\w\-]+)/an/(?P<an>[\w\-]+)/dym/(?P<dym>[\w\-]+)$', views.data_extraction, 'analysis_dym',),
+    (r'reg/(?P<reg>[\w\-]+)/loc/(?P<loc>[\w\-]+)/ht/(?P<ht>[\w\-]+)/at/(?P<at>[\w\-]+)/an/(?P<an>[\w\-]+)/events/$', views.event_list_view, 'analysis_events',),
+    (r'reg/(?P<reg>[\w\-]+)/loc/(?P<loc>[\w\-]+)/ht/(?P<ht>[\w\-]+)/at/(?P<at>[\w\-]+)/an/(?P<an>[\w\-]+)/events/summary/$', views.event_summary_view, 'analysis_events_summary',),
     (r'apps/(?P<apps>[\w\-]+)/?$', views.apps_view, 'apps',),
     (r'countryauth/?$', views.auth_view, 'countryauth',),
     (r'admlookup/(?P<admlookup>[\w\-]+)/?$', views.adm_lookup_view, 'admlookup',),
     (r'loc/(?P<loc>[\w\-]+)/detail/(?P<detail>[\w\-]+)/?$', views.adm_lookup_view, 'admlookup',),    
+    (r'reg/(?P<reg>[\w\-]+)/point/$', views.reverse_geocode_view, 'point',),
     (r'loc/(?P<loc>[\w\-]+)/ht/(?P<ht>[\w\-]+)/at/(?P<at>[\w\-]+)/an/(?P<an>[\w\-]+)/pdf/$', views.pdf_report, 'pdf_report',),
     (r'loc/(?P<loc>[\w\-]+)/ht/(?P<ht>[\w\-]+)/at/(?P<at>[\w\-]+)/an/(?P<an>[\w\-]+)/pdf/(?P<pdf_part>({}))/$'\
         .format('|'.join(views.PDFReportView.PDF_PARTS)), views.pdf_report, 'pdf_report_part',),)
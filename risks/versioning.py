@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import hashlib
+import logging
+import time
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
+
+log = logging.getLogger(__name__)
+
+
+class DataVersions(object):
+    """
+    Versions of imported data, per region and per risk analysis.
+
+    Versions are kept in shared django cache and bumped when data is
+    imported. Versions are timestamps in milliseconds (kept increasing
+    on bump), so an evicted version never matches older cache entries
+    and the newest version tells when data was last modified.
+    """
+
+    CACHE_KEY = 'risks:version:{}'
+    GLOBAL_SCOPE = 'global'
+    # administrative divisions tree is shared by all regions
+    ADM_SCOPE = 'adm'
+
+    def __init__(self):
+        # versions used when cache keeps nothing (dummy cache)
+        self._process_versions = {}
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'RISKS_VERSION_CACHE', 'default')]
+
+    def get_scopes(self, reg=None, an=None, **kwargs):
+        """
+        Returns version scopes for view url arguments.
+
+        Views without region in url depend on data from any region,
+        so they use global version.
+        """
+        scopes = [self.ADM_SCOPE, 'region:{}'.format(reg) if reg else self.GLOBAL_SCOPE]
+        if an and str(an).isdigit():
+            scopes.append(self.get_analysis_scope(an))
+        return scopes
+
+    def get_analysis_scope(self, risk_analysis):
+        return 'analysis:{}'.format(getattr(risk_analysis, 'id', risk_analysis))
+
+    def _init_version(self, key):
+        version = int(time.time() * 1000)
+        self.cache.add(key, version, None)
+        stored = self.cache.get(key)
+        if stored is None:
+            # cache doesn't keep values (dummy cache), so version must stay
+            # the same in this process, otherwise nothing would ever match
+            return self._process_versions.setdefault(key, version)
+        return stored
+
+    def get_versions(self, scopes):
+        keys = [self.CACHE_KEY.format(scope) for scope in scopes]
+        found = self.cache.get_many(keys)
+        return [found[key] if key in found else self._init_version(key) for key in keys]
+
+    def get_request_versions(self, request, **kwargs):
+        """
+        Returns versions for view request, looked up once per request
+        """
+        versions = getattr(request, '_risks_data_versions', None)
+        if versions is None:
+            versions = request._risks_data_versions = self.get_versions(self.get_scopes(**kwargs))
+        return versions
+
+    def get_key_prefix(self, request, **kwargs):
+        """
+        Returns cache key prefix for view request. Responses depend on
+        permissions of current user, so user is a part of the prefix.
+        """
+        versions = self.get_request_versions(request, **kwargs)
+        return 'risks:{}:u{}'.format('.'.join(str(v) for v in versions), get_request_user_id(request))
+
+    def _bump(self, scope):
+        key = self.CACHE_KEY.format(scope)
+        current = max(self.cache.get(key) or 0, self._process_versions.get(key, 0))
+        version = max(int(time.time() * 1000), current + 1)
+        self.cache.set(key, version, None)
+        if key in self._process_versions:
+            self._process_versions[key] = version
+
+    def bump(self, region=None, risk_analysis=None):
+        """
+        Bumps versions after data import, for given region and risk
+        analysis (objects, names or ids) and global one.
+        """
+        scopes = [self.GLOBAL_SCOPE]
+        if region is not None:
+            scopes.append('region:{}'.format(getattr(region, 'name', region)))
+        if risk_analysis is not None:
+            scopes.append(self.get_analysis_scope(risk_analysis))
+        for scope in scopes:
+            self._bump(scope)
+        log.info("bumped data versions: %s", ', '.join(scopes))
+
+    def bump_adm_divisions(self):
+        """
+        Bumps version of administrative divisions, after they are
+        imported or their tree is rebuilt.
+        """
+        self._bump(self.ADM_SCOPE)
+        log.info("bumped data versions: %s", self.ADM_SCOPE)
+
+
+data_versions = DataVersions()
+
+
+def get_request_user_id(request):
+    """
+    Returns id of authenticated user of request, empty string for anonymous
+    """
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated() else ''
+
+
+@checks.register()
+def check_version_cache(app_configs, **kwargs):
+    """
+    Versions must be kept in cache shared by web and worker processes,
+    otherwise bumps done by imports are not seen by views.
+    """
+    alias = getattr(settings, 'RISKS_VERSION_CACHE', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND', '')
+    if backend.endswith('.LocMemCache'):
+        return [checks.Warning("RISKS_VERSION_CACHE ('{}') uses per-process cache {}".format(alias, backend),
+                               hint="Use cache shared by all processes (memcached, database, file based), "
+                                    "or dummy cache to disable caching of data responses.",
+                               id='risks.W001')]
+    return []
+
+
+def versioned_cache_page(timeout):
+    """
+    Same as :py:func:`django.views.decorators.cache.cache_page`, but cache
+    keys contain data versions for region/risk analysis of the request
+    and current user, so responses can be cached for long, are invalidated
+    on import and are never served to users with other permissions.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            key_prefix = data_versions.get_key_prefix(request, **kwargs)
+            cached_view = cache_page(timeout, key_prefix=key_prefix)(view_func)
+            return cached_view(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
+
+
+def data_etag(request, *args, **kwargs):
+    """
+    Strong validator for data view response: depends on requested url
+    and representation, current user and data versions.
+    """
+    parts = [request.get_full_path(),
+             request.META.get('HTTP_ACCEPT', ''),
+             get_request_user_id(request)]
+    parts.extend(data_versions.get_request_versions(request, **kwargs))
+    return hashlib.sha1('|'.join(str(p) for p in parts)).hexdigest()
+
+
+def data_last_modified(request, *args, **kwargs):
+    versions = data_versions.get_request_versions(request, **kwargs)
+    return datetime.utcfromtimestamp(max(versions) / 1000.0)
+
+
+# answers If-None-Match/If-Modified-Since with 304 before view is called
+conditional_data_view = condition(etag_func=data_etag, last_modified_func=data_last_modified)
@@ -3,6 +3,7 @@
 from __future__ import print_function
 import os
 import json
+import base64
 import logging
 import re
 
@@ -16,9 +17,12 @@ from django.core.files.base import ContentFile, File
 from django.http import HttpResponse, FileResponse
 from django.template.loader import render_to_string
 from django.utils.crypto import get_random_string
+from django.utils.cache import patch_vary_headers
 from django.views.decorators.cache import cache_page
 from django.core import serializers
+from django.db.models import Max, Q
 from operator import attrgetter
+from itertools import groupby
 
 from geonode.layers.models import Layer
 from geonode.utils import json_response
@@ -26,10 +30,15 @@ from geonode.base.forms import ValuesListField
 from risks.models import (HazardType, AdministrativeDivision, Region,
                                           RiskAnalysisDymensionInfoAssociation,
                                           RiskAnalysis, DymensionInfo, AnalysisType,
-                                          FurtherResource, RiskApp, Event, AnalysisClass, 
+                                          FurtherResource, RiskApp, Event, EventAdministrativeDivisionAssociation, AnalysisClass, 
                                           AdministrativeData, AdministrativeDivisionDataAssociation, AdministrativeDivisionMappings)
 
-from risks.datasource import GeoserverDataSource
+from risks.datasource import GeoserverDataSource, PostGISDataSource, run_concurrently, cql_in
+from risks.cube import risk_cubes
+from risks.adm_tree import adm_tree
+from risks.point_index import adm_point_index
+from risks.packing import accepts_msgpack, msgpack_response, pack_values
+from risks.versioning import versioned_cache_page, conditional_data_view
 from risks.pdf_helpers import generate_pdf
 
 from dateutil.parser import parse
@@ -213,6 +222,9 @@ class FeaturesSource(object):
 
     AXIS_X = 'x'
     AXIS_Y = 'y'
+    BACKEND_WFS = 'wfs'
+    BACKEND_POSTGIS = 'postgis'
+    BACKEND_CUBE = 'cube'
     KWARGS_MAPPING = {'loc': 'adm_code',
                       'ht': 'hazard_type',
                       'an': 'risk_analysis',
@@ -234,42 +246,95 @@ class FeaturesSource(object):
 
         return (ass_list.first(), list(dim_list)[0])
 
-    def get_dymlist_field_mapping(self, analysis, dimension, dymlist):
+    def get_dim_fields(self, analysis, dims):
+        """
+        Returns layer attribute (dimX) for each of given dimensions.
+
+        Same as calling get_dim_association() for each dimension, but
+        resolved with a single query over analysis' associations.
+        """
+        axis_to_dim = {}
+        dym_axes = {}
+        ass_list = RiskAnalysisDymensionInfoAssociation.objects.filter(riskanalysis=analysis)\
+                                                               .order_by('order')\
+                                                               .values_list('dymensioninfo_id', 'axis', 'layer_attribute')
+        for dyminfo_id, axis, layer_attribute in ass_list:
+            # first association (by order) for given axis defines attribute
+            axis_to_dim.setdefault(axis, layer_attribute)
+            dym_axes.setdefault(dyminfo_id, set()).add(axis)
+
         out = []
+        for d in dims:
+            dim_list = set([axis_to_dim[axis] for axis in dym_axes.get(d.id, ())])
+            if len(dim_list) != 1:
+                raise ValueError("Cannot query more than one dimension at the moment, got {}".format(len(dim_list)))
+            out.append(list(dim_list)[0])
+        return out
+
+    def get_dymlist_field_mapping(self, analysis, dimension, dymlist):
         layers = [analysis.layer.typename]
-        current_dim_name = self.get_dim_association(analysis, dimension)[1]
-        out.append(current_dim_name)
-        for dym in dymlist:
-            if dym != dimension:
-                dim_association = self.get_dim_association(analysis, dym)
-                out.append(dim_association[1])
+        dims = [dimension] + [dym for dym in dymlist if dym != dimension]
+        out = self.get_dim_fields(analysis, dims)
         return (out, layers)
 
-    def get_features(self, analysis, dimension, dymlist, **kwargs):
+    def get_wfs_data_source(self):
+        s = settings.OGC_SERVER['default']
+        return GeoserverDataSource('{}/wfs'.format(s['LOCATION'].strip("/")),
+                                   username=s['USER'],
+                                   password=s['PASSWORD']
+                                   )
+
+    def get_extraction_backend(self):
+        return getattr(settings, 'RISKS_EXTRACTION_BACKEND', self.BACKEND_WFS)
+
+    def get_data_source(self, layer_name):
+        """
+        Returns data source for risk analysis layer, according to
+        RISKS_EXTRACTION_BACKEND setting. Layers not supported by
+        PostGIS backend are always read through WFS.
+        """
+        backend = self.get_extraction_backend()
+        if backend in (self.BACKEND_POSTGIS, self.BACKEND_CUBE,):
+            ds = PostGISDataSource()
+            if ds.supports(layer_name):
+                return ds
+        return self.get_wfs_data_source()
 
+    def get_features(self, analysis, dimension, dymlist, **kwargs):
+        """
+        Returns list of rows (feature properties) for risk analysis
+        """
         (dymlist_to_fields, dym_layers) = self.get_dymlist_field_mapping(analysis, dimension, dymlist)
 
-        s = settings.OGC_SERVER['default']
-        gs = GeoserverDataSource('{}/wfs'.format(s['LOCATION'].strip("/")),
-                                 username=s['USER'],
-                                 password=s['PASSWORD']
-                                 )        
         dim_name = dymlist_to_fields[0]        
         layer_name = dym_layers[0]        
         #if 'additional_data' in kwargs:
         #    layer_name = '{}_{}'.format(layer_name, kwargs['additional_data'])
         #features = gs.get_features(layer_name, dim_name, **kwargs)
-        features = gs.get_features(layer_name, None, **kwargs)
-        return features
+        ds = self.get_data_source(layer_name)
+        if self.get_extraction_backend() == self.BACKEND_CUBE and isinstance(ds, PostGISDataSource):
+            # precomputed values, sliced in-process
+            return risk_cubes.get(analysis).get_rows(kwargs['adm_code'])
+        return ds.get_rows(layer_name, None, **kwargs)
 
     def get_features_base(self, layerName, field_list, **kwargs):
-        s = settings.OGC_SERVER['default']
-        gs = GeoserverDataSource('{}/wfs'.format(s['LOCATION'].strip("/")),
-                                 username=s['USER'],
-                                 password=s['PASSWORD']
-                                 )
-        features = gs.get_features(layerName, field_list, **kwargs)
-        return features
+        """
+        Returns list of rows (feature properties) from given layer
+        """
+        ds = self.get_wfs_data_source()
+        return ds.get_rows(layerName, field_list, **kwargs)
+
+    def get_features_base_many(self, queries):
+        """
+        Fetches rows for list of (layer_name, field_list, kwargs) queries
+        concurrently. Results are returned in the same order as queries.
+
+        Note: this should be used for WFS calls only, don't use ORM
+        in fetch threads.
+        """
+        calls = [(self.get_features_base, (layer_name, field_list,), feat_kwargs,)
+                 for layer_name, field_list, feat_kwargs in queries]
+        return run_concurrently(calls)
 
 
 class RiskIndexView(AppAware, FeaturesSource, TemplateView):
@@ -309,28 +374,17 @@ class LocationSource(object):
             return
 
     def get_location_exact(self, loc):
-        try:
-            return AdministrativeDivision.objects.get(code=loc)            
-        except AdministrativeDivision.DoesNotExist:
-            return
+        return adm_tree.get(loc)
     
     def get_location(self, **kwargs):
-        loc = self.get_location_exact(kwargs['loc'])
-        try:
-            locations = loc.get_parents_chain() + [loc]
-            return locations
-        except:
-            pass
+        return adm_tree.get_chain(kwargs['loc'])
 
     def get_location_range(self, loc):
         return AdministrativeDivision.objects.filter(code__in=loc)        
     
     def location_lookup(self, **kwargs):
-        matches = AdministrativeDivision.objects.filter(name__contains=kwargs['admlookup'])
-        loc_chains = []
-        for loc in matches:
-            loc_chains.append(loc.get_parents_chain() + [loc])
-        return loc_chains      
+        limit = getattr(settings, 'RISKS_ADM_LOOKUP_LIMIT', 50)
+        return adm_tree.search(kwargs['admlookup'], limit=limit)
 
 class LocationView(ContextAware, LocationSource, View):
 
@@ -347,7 +401,7 @@ class LocationView(ContextAware, LocationSource, View):
         location_data = {'navItems': [location.set_app(app).set_region(reg).export() for location in locations],
                          'context': self.get_context_url(**kwargs),
                          'furtherResources': self.get_further_resources(**kwargs),
-                         'overview': [ht.set_region(reg).set_location(loc).export() for ht in hazard_types]}
+                         'overview': HazardType.export_overview(hazard_types, reg, loc)}
 
         return json_response(location_data)
 
@@ -377,34 +431,57 @@ class AdmLookupView(ContextAware, LocationSource, View):
             if not loc_chain:
                 return json_response(errors=['Invalid location code'], status=404)
             
-            loc = loc_chain[-1]
             lookup_data = []
-            ra_ids = []
-            while loc is not None:
-                ra_matches = RiskAnalysis.objects.filter(administrative_divisions=loc).exclude(pk__in=ra_ids)                
-                if ra_matches:
-                    ra_ids += list(ra_matches.values_list('pk', flat=True))
-                    lookup_data += self.prepare_data(ra_matches, loc)                
-                loc = loc.parent                       
+            # each analysis is listed once, for the nearest location up the chain
+            locs_by_level = dict((loc.level, loc,) for loc in loc_chain)
+            ra_matches = RiskAnalysis.objects.filter(administrative_divisions__in=loc_chain)\
+                                             .annotate(nearest_level=Max('administrative_divisions__level'))\
+                                             .select_related('hazard_type', 'analysis_type')\
+                                             .order_by('-nearest_level', 'name')
+            for level, level_matches in groupby(ra_matches, attrgetter('nearest_level')):
+                lookup_data += self.prepare_data(level_matches, locs_by_level[level])
             
         else:
-            loc_chains = self.location_lookup(**kwargs)
-            if not loc_chains:
+            matches = self.location_lookup(**kwargs)
+            if not matches:
                 return json_response(errors=['Invalid location code'], status=404)
                         
-            for loc_chain in loc_chains:
-                current_loc = loc_chain[-1] 
-                country = next((x for x in loc_chain if x.level == 1), None)    
+            for adm_code, adm_name, country_code in matches:
                 current_chain_data = {
-                    'admCode': current_loc.code,
-                    'admName': current_loc.name,
-                    'country': country.code if country is not None else ''
+                    'admCode': adm_code,
+                    'admName': adm_name,
+                    'country': country_code
                 }
                 lookup_data.append(current_chain_data)
         
         return json_response(lookup_data)                               
                 
 
+class ReverseGeocodeView(ContextAware, LocationSource, View):
+    """
+    Returns chain of administrative divisions of region containing
+    point given with `lon` and `lat` params, from root to the most
+    detailed division, in the same format as location view `navItems`.
+    """
+
+    def get(self, request, *args, **kwargs):
+        reg = self.get_region(**kwargs)
+        if reg is None:
+            return json_response(errors=['Invalid region'], status=404)
+        try:
+            lon = float(request.GET['lon'])
+            lat = float(request.GET['lat'])
+        except (KeyError, ValueError):
+            return json_response(errors=['Invalid lon/lat'], status=400)
+
+        code = adm_point_index.find(reg.id, lon, lat)
+        locations = adm_tree.get_chain(code) if code else None
+        if not locations:
+            return json_response(errors=['No location found for point'], status=404)
+        app = self.get_app()
+        return json_response({'navItems': [location.set_app(app).set_region(reg).export() for location in locations]})
+
+
 class HazardTypeView(ContextAware, LocationSource, View):
     """
     loc/AF/ht/EQ/"
@@ -520,7 +597,7 @@ class HazardTypeView(ContextAware, LocationSource, View):
 
         out = {
             'navItems': [location.set_app(app).set_region(reg).export() for location in locations],
-            'overview': [ht.set_region(reg).set_location(loc).export() for ht in hazard_types],
+            'overview': HazardType.export_overview(hazard_types, reg, loc),
             'context': self.get_context_url(**kwargs),
             'furtherResources': self.get_further_resources(**kwargs),
             'hazardType': hazard_type.get_hazard_details(),            
@@ -584,7 +661,7 @@ class EventView(FeaturesSource, HazardTypeView):
         feat_kwargs = self.url_kwargs_to_query_params(**kwargs)
         features = self.get_features_base('geonode:risk_analysis', None, **feat_kwargs)
         
-        values = [[f['properties']['dim1_value'], f['properties']['dim2_value'], f['properties']['value']] for f in features['features']]
+        values = [[f['dim1_value'], f['dim2_value'], f['value']] for f in features]
 
 
         out = {
@@ -689,61 +766,69 @@ class DataExtractionView(FeaturesSource, HazardTypeView):
         """
         Returns risk data as proper structure
 
+        Rows are built column by column and sorted once, by order key
+        computed from dimX_order fields:
+        first dimension order * 1000 + other dimensions orders.
         """
-        values = []
         dims = [dimension.set_risk_analysis(risk)] + [d.set_risk_analysis(risk) for d in dimensions if d.id != dimension.id]
 
-        _fields = [self.get_dim_association(risk, d) for d in dims]
-        fields = ['{}_value'.format(f[1]) for f in _fields]
-        field_orders = ['{}_order'.format(f[1]) for f in _fields]
-
-        orders = [dict(d.get_axis_order()) for d in dims]
-
-        orders_len = len(orders)
-
-        def make_order_val(feat):
-            """
-            compute order value
-            """
-            _order_vals = []
-
-            for idx, o in enumerate(orders):
-                field_name = field_orders[idx]
-                val = feat['properties'].get(field_name)
-                # order_val = o.get(val)
-                order_val = val
-
-                if order_val is None:
-                    order_val = 0
-                # 111 > 1, 1, 1
-                # mag = 10 ** (orders_len - idx)
-                mag = 1000 if idx == 0 else 1
-                _order_vals.append(int('{}'.format(order_val * mag)))
-            # return ''.join(_order_vals)
-            return sum(_order_vals)
-
-        def order_key(val):
-            # order by last val
-            order = val.pop(-1)
-            return order
-
-        for feat in features:
-            p = feat['properties']
-            line = []
-            [line.append(p[f]) for f in fields]
-            line.append(p['value'])
-            line.append(make_order_val(feat))
-            if capitalize:
-                line = [str(item).capitalize() for item in line]
-            values.append(line)
-
-        values.sort(key=order_key)
+        _fields = self.get_dim_fields(risk, dims)
+        fields = ['{}_value'.format(f) for f in _fields]
+        field_orders = ['{}_order'.format(f) for f in _fields]
+
+        rows = features if isinstance(features, list) else list(features)
+
+        columns = [[p[f] for p in rows] for f in fields]
+        columns.append([p['value'] for p in rows])
+
+        order_keys = [0] * len(rows)
+        for idx, field_name in enumerate(field_orders):
+            mag = 1000 if idx == 0 else 1
+            order_col = [p.get(field_name) for p in rows]
+            order_keys = [k if o is None else k + int(o) * mag
+                          for k, o in zip(order_keys, order_col)]
+
+        values = [list(line) for line in zip(*columns)]
+        if capitalize:
+            # order key was capitalized along with the line, so it's
+            # compared as a string
+            values = [[str(item).capitalize() for item in line] for line in values]
+            order_keys = [str(k) for k in order_keys]
+
+        # stable argsort, same as sorting lines by order key
+        positions = sorted(range(len(values)), key=order_keys.__getitem__)
+        values = [values[pos] for pos in positions]
 
         out = {'dimensions': [dim.set_risk_analysis(risk).export() for dim in dims],
                'values': values}
 
         return out
 
+    def values_response(self, request, out, containers):
+        """
+        Returns response with risk data.
+
+        If client accepts msgpack, `values` matrices of `containers`
+        (parts of `out`) are sent column-encoded, json is used otherwise.
+        """
+        if accepts_msgpack(request):
+            for container in containers:
+                container['values'] = pack_values(container['values'])
+            response = msgpack_response(out)
+        else:
+            response = json_response(out)
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+    def get_risk_analysis(self, **kwargs):
+        """
+        Returns risk analysis for `an` url argument (id), or None
+        """
+        try:
+            return RiskAnalysis.objects.get(id=kwargs['an'])
+        except (RiskAnalysis.DoesNotExist, ValueError,):
+            pass
+
     def is_user_allowed(self, request, risk_analysis):
         result = True
         if risk_analysis.owner:
@@ -829,7 +914,7 @@ class DataExtractionView(FeaturesSource, HazardTypeView):
         
         
         
-        out['riskAnalysisData']['data'] = self.reformat_features(risk, dimension, dymlist, features['features'])
+        out['riskAnalysisData']['data'] = self.reformat_features(risk, dimension, dymlist, features)
         
         out['context'] = self.get_context_url(**kwargs)
         out['wms'] = {'style': None,
@@ -858,28 +943,19 @@ class DataExtractionView(FeaturesSource, HazardTypeView):
             out['riskAnalysisData']['eventsLayer']['layerTitle'] = '{}_events'.format(out['riskAnalysisData']['layer']['layerTitle'])
 
             # retrieve values for events aggregated by country
-            field_list = ['adm_code', 'dim1_value', 'dim2_value', 'value', 'event_id']
             field_list_group = ['adm_code', 'dim1_value', 'dim2_value', 'value']
             feat_kwargs['level'] = loc.level
-            features_event_group_country = self.get_features_base('geonode:risk_analysis_event_group', field_list_group, **feat_kwargs)
-            features_event_values = self.get_features_base('geonode:risk_analysis_event_details', field_list, **feat_kwargs)        
-            values_events = {}
-            for f in features_event_values['features']:
-                temp = []                
-                for l in field_list:
-                    temp.append(f['properties'][l])
-                values_events[temp[field_list.index('event_id')]] = temp
+            (features_event_group_country, features_event_values,) = self.get_features_base_many([
+                ('geonode:risk_analysis_event_group', field_list_group, feat_kwargs,),
+                ('geonode:risk_analysis_event_details', self.EVENT_VALUES_FIELDS, feat_kwargs,)])
+            values_events = self.get_event_values(features_event_values)
             
-            event_group_country = [[f['properties']['adm_code'], f['properties']['dim1_value'], f['properties']['dim2_value'], f['properties']['value']] for f in features_event_group_country['features']]            
+            event_group_country = [[f['adm_code'], f['dim1_value'], f['dim2_value'], f['value']] for f in features_event_group_country]            
             
-            events = Event.objects.filter(hazard_type=hazard_type, region=reg)
-            if loc.level == 1:
-                events = events.filter(iso2=loc.code)
-            elif loc.level >= 2:
-                events = events.filter(nuts3__contains=loc.code)
+            events = self.get_location_events(hazard_type, reg, loc)
             
             #check if need to filter by date
-            if events and 'from' in kwargs and 'to' in kwargs:
+            if 'from' in kwargs and 'to' in kwargs and events.exists():
                 try:
                     date_from = parse(kwargs.get('from'))
                     date_to = parse(kwargs.get('to'))
@@ -887,42 +963,261 @@ class DataExtractionView(FeaturesSource, HazardTypeView):
                 except ValueError:
                     return json_response(errors=['Invalid date format'], status=400)
             
-            events = events.order_by('-begin_date')
+            events = events.select_related('hazard_type', 'region').order_by('-begin_date')
             total = events.count()
             
-            if events and 'load' not in kwargs and 'from' not in kwargs and total > 50:
+            if 'load' not in kwargs and 'from' not in kwargs and total > 50:
                 events = events[:50]
-            ev_list = []
-            data_key = values_events.values()[0][1]
-            for event in events:
-                e = event.get_event_plain()                
-                value_arr = values_events[e['event_id']] if e['event_id'] in values_events else None
-                try:                    
-                    e[data_key] = float(value_arr[3]) if value_arr is not None else None
-                except:
-                    e[data_key] = None
-                e['data_key'] = data_key                
-                ev_list.append(e)
+            ev_list = self.set_event_values(Event.get_events_plain(events), values_events)
             
             
             out['riskAnalysisData']['data']['event_group_country'] = event_group_country
             out['riskAnalysisData']['data']['total_events'] = total
             #out['riskAnalysisData']['events'] = serializers.serialize("json", events, use_natural_foreign_keys=True, use_natural_primary_keys=True)
             out['riskAnalysisData']['events'] = ev_list            
+            # paginated events, for clients which need more than the first page
+            out['riskAnalysisData']['eventsUrl'] = app.url_for('analysis_events', reg.name, loc.code, hazard_type.mnemonic, current_atype.name, risk.id)
         
-        return json_response(out)
+        return self.values_response(request, out, [out['riskAnalysisData']['data']])
+
+    EVENT_VALUES_FIELDS = ['adm_code', 'dim1_value', 'dim2_value', 'value', 'event_id']
+
+    def get_event_values(self, features):
+        """
+        Returns event_id -> [adm_code, dim1_value, dim2_value, value, event_id]
+        """
+        values_events = {}
+        for f in features:
+            values_events[f['event_id']] = [f[l] for l in self.EVENT_VALUES_FIELDS]
+        return values_events
+
+    def set_event_values(self, events, values_events):
+        """
+        Sets value of risk analysis on each plain event,
+        under the key named after the first dimension value.
+        """
+        if not values_events:
+            return events
+        data_key = values_events.values()[0][1]
+        for e in events:
+            value_arr = values_events[e['event_id']] if e['event_id'] in values_events else None
+            try:                    
+                e[data_key] = float(value_arr[3]) if value_arr is not None else None
+            except:
+                e[data_key] = None
+            e['data_key'] = data_key                
+        return events
+
+    def get_location_events(self, hazard_type, region, loc):
+        events = Event.objects.filter(hazard_type=hazard_type, region=region)
+        if loc.level >= 1:
+            events = events.for_adm_division(loc, subtree=True)
+        return events
 
     def get_viewparams(self, risk, htype, loc):
         return 'risk_analysis:{};hazard_type:{};adm_code:{};d1:{{}};d2:{{}}'.format(risk.name, htype.mnemonic, loc.code)
 
 
-class EventDetailsView(DataExtractionView):
-    def get_risk_analysis(self, **kwargs):
+class EventListView(DataExtractionView):
+    """
+    Paginated list of events for risk analysis at location, with
+    risk analysis value for each event.
+
+    Events are sorted by begin date and event id, newest first, and
+    paginated with keyset cursors: each page returns `nextCursor`,
+    pointing after its last event, to be sent back as `cursor` param.
+    Optional filters: `from`/`to` begin date range, `event_type`, `cause`.
+    """
+
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 500
+
+    def encode_cursor(self, event):
+        return base64.urlsafe_b64encode('{}|{}'.format(event.begin_date.isoformat(), event.event_id))
+
+    def decode_cursor(self, cursor):
+        (begin_date, event_id,) = base64.urlsafe_b64decode(str(cursor)).split('|', 1)
+        return parse(begin_date).date(), event_id
+
+    def get_page_size(self, request):
         try:
-            return RiskAnalysis.objects.get(id=kwargs['an'])
-        except RiskAnalysis.DoesNotExist:
+            page_size = int(request.GET.get('page_size', self.PAGE_SIZE))
+        except ValueError:
+            page_size = self.PAGE_SIZE
+        return max(1, min(page_size, self.MAX_PAGE_SIZE))
+
+    def get_location_risk_analysis(self, region, location, hazard_type, **kwargs):
+        """
+        Returns risk analysis for `an` url argument (id), only if it's
+        for given hazard type and region and available at location
+        """
+        try:
+            return RiskAnalysis.objects.filter(id=kwargs['an'],
+                                               hazard_type=hazard_type,
+                                               region=region,
+                                               administrative_divisions__in=[location]).distinct().get()
+        except (RiskAnalysis.DoesNotExist, ValueError,):
             pass
 
+    def get_events_context(self, request, **kwargs):
+        """
+        Resolves location, hazard type, risk analysis and filtered events
+        for request. Returns (error response, context) tuple.
+        """
+        reg = self.get_region(**kwargs)
+        locations = self.get_location(**kwargs)
+        if not locations:
+            return json_response(errors=['Invalid location code'], status=404), None
+        loc = locations[-1]
+
+        hazard_type = self.get_hazard_type(reg, loc, **kwargs)
+        if not hazard_type:
+            return json_response(errors=['Invalid hazard type'], status=404), None
+
+        risk = self.get_location_risk_analysis(reg, loc, hazard_type, **kwargs)
+        if risk is None:
+            return json_response(errors=['No risk analysis found for given parameters'], status=404), None
+        if not self.is_user_allowed(request, risk):
+            return json_response(errors=['Data not available for current user'], status=403), None
+
+        events = self.get_location_events(hazard_type, reg, loc)
+        params = request.GET
+        try:
+            if params.get('from') and params.get('to'):
+                events = events.filter(begin_date__range=(parse(params['from']), parse(params['to']),))
+            if params.get('cursor'):
+                (begin_date, event_id,) = self.decode_cursor(params['cursor'])
+                events = events.filter(Q(begin_date__lt=begin_date) |
+                                       Q(begin_date=begin_date, event_id__lt=event_id))
+        except (ValueError, TypeError,):
+            return json_response(errors=['Invalid date format or cursor'], status=400), None
+        if params.get('event_type'):
+            events = events.filter(event_type=params['event_type'])
+        if params.get('cause'):
+            events = events.filter(cause=params['cause'])
+
+        return None, {'region': reg, 'location': loc, 'hazard_type': hazard_type,
+                      'risk': risk, 'events': events}
+
+    # max number of event ids in single WFS request filter
+    EVENT_IDS_CHUNK = 100
+
+    def get_event_values_for(self, risk, loc, event_ids=None, **kwargs):
+        """
+        Returns event values for risk analysis at location level, only
+        for given events if `event_ids` is not None
+        """
+        feat_kwargs = self.url_kwargs_to_query_params(**kwargs)
+        feat_kwargs['risk_analysis'] = risk.name
+        feat_kwargs['level'] = loc.level
+        if event_ids is None:
+            features = self.get_features_base('geonode:risk_analysis_event_details', self.EVENT_VALUES_FIELDS, **feat_kwargs)
+            return self.get_event_values(features)
+
+        event_ids = list(event_ids)
+        queries = []
+        for idx in range(0, len(event_ids), self.EVENT_IDS_CHUNK):
+            chunk_kwargs = dict(feat_kwargs, cql_filter=cql_in('event_id', event_ids[idx:idx + self.EVENT_IDS_CHUNK]))
+            queries.append(('geonode:risk_analysis_event_details', self.EVENT_VALUES_FIELDS, chunk_kwargs,))
+        features = []
+        for chunk in self.get_features_base_many(queries):
+            features.extend(chunk)
+        return self.get_event_values(features)
+
+    def get(self, request, *args, **kwargs):
+        (error, ctx,) = self.get_events_context(request, **kwargs)
+        if error is not None:
+            return error
+
+        page_size = self.get_page_size(request)
+        page = list(ctx['events'].select_related('hazard_type', 'region')
+                                 .order_by('-begin_date', '-event_id')[:page_size + 1])
+        next_cursor = self.encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+        page = page[:page_size]
+
+        values_events = self.get_event_values_for(ctx['risk'], ctx['location'],
+                                                  [e.event_id for e in page], **kwargs)
+
+        out = {'events': self.set_event_values(Event.get_events_plain(page), values_events),
+               'pageSize': page_size,
+               'nextCursor': next_cursor}
+        return json_response(out)
+
+
+class EventSummaryView(EventListView):
+    """
+    Summary of events for risk analysis at location: number of events
+    and sum of their risk analysis values, grouped by year, month, event
+    type and affected administrative unit (one level below location).
+    Accepts the same filters as :py:class:`EventListView`.
+    """
+
+    def add_to_group(self, group, key, value):
+        entry = group.setdefault(key, [0, None])
+        entry[0] += 1
+        if value is not None:
+            entry[1] = value if entry[1] is None else entry[1] + value
+
+    def export_group(self, group):
+        return [{'key': key, 'count': count, 'value': value}
+                for key, (count, value,) in sorted(group.iteritems())]
+
+    def get(self, request, *args, **kwargs):
+        (error, ctx,) = self.get_events_context(request, **kwargs)
+        if error is not None:
+            return error
+        loc = ctx['location']
+        events = ctx['events']
+
+        values_events = self.get_event_values_for(ctx['risk'], loc, **kwargs)
+        values = {}
+        for event_id, value_arr in values_events.iteritems():
+            try:
+                values[event_id] = float(value_arr[3])
+            except (TypeError, ValueError,):
+                pass
+
+        total = {}
+        by_year = {}
+        by_month = {}
+        by_type = {}
+        for event_id, year, begin_date, event_type in events.order_by()\
+                                                          .values_list('event_id', 'year', 'begin_date', 'event_type')\
+                                                          .iterator():
+            value = values.get(event_id)
+            self.add_to_group(total, None, value)
+            self.add_to_group(by_year, year, value)
+            self.add_to_group(by_month, begin_date.strftime('%Y-%m'), value)
+            self.add_to_group(by_type, event_type, value)
+
+        # leaves are summarized by themselves
+        adm_level = loc.level + 1 if adm_tree.get_children(loc.code) else loc.level
+        by_adm = {}
+        adm_names = {}
+        affected = EventAdministrativeDivisionAssociation.objects.filter(event__in=events.order_by().values('event_id'),
+                                                                         adm__level=adm_level,
+                                                                         adm__tree_id=loc.tree_id,
+                                                                         adm__lft__gte=loc.lft,
+                                                                         adm__rght__lte=loc.rght)\
+                                                                 .values_list('event_id', 'adm__code', 'adm__name')
+        for event_id, adm_code, adm_name in affected.iterator():
+            adm_names[adm_code] = adm_name
+            self.add_to_group(by_adm, adm_code, values.get(event_id))
+
+        (count, value,) = total.get(None, (0, None,))
+        out = {'dataKey': values_events.values()[0][1] if values_events else None,
+               'count': count,
+               'value': value,
+               'byYear': self.export_group(by_year),
+               'byMonth': self.export_group(by_month),
+               'byEventType': self.export_group(by_type),
+               'byAdm': self.export_group(by_adm)}
+        for entry in out['byAdm']:
+            entry['name'] = adm_names[entry['key']]
+        return json_response(out)
+
+
+class EventDetailsView(DataExtractionView):
     def get_risk_analysis_group(self, hazard_type, **kwargs):
         ref_ra = self.get_risk_analysis(**kwargs)        
         analysis_types = AnalysisType.objects.filter(analysis_class=ref_ra.analysis_type.analysis_class)
@@ -962,12 +1257,47 @@ class EventDetailsView(DataExtractionView):
             except AnalysisType.DoesNotExist:
                 return
     
+    def get_administrative_data(self, hazard_type, region, locations):
+        """
+        Returns administrative data values for locations, with value
+        of the latest dimension for each (data, location) pair, and
+        mapping of administrative data to analysis types.
+        """
+        administrative_data = {}
+        risk_analysis_mapping = {}
+        adm_data_entries = list(AdministrativeData.objects.all())
+
+        # first analysis (by name) which type matches data indicator type
+        at_names = RiskAnalysis.objects.filter(hazard_type=hazard_type, region=region)\
+                                       .order_by('name')\
+                                       .values_list('analysis_type__name', flat=True)
+        at_names = list(at_names)
+        by_id = {}
+        for adm_data_entry in adm_data_entries:
+            at_name = next((n for n in at_names if adm_data_entry.indicator_type in n), None)
+            if at_name is not None:
+                risk_analysis_mapping[adm_data_entry.name] = at_name
+            administrative_data[adm_data_entry.name] = by_id[adm_data_entry.id] = {
+                    'unitOfMeasure': adm_data_entry.unit_of_measure,
+                    'values': {}
+            }
+
+        # DISTINCT ON picks row with latest dimension for each pair
+        latest_values = AdministrativeDivisionDataAssociation.objects.filter(adm__in=locations)\
+                                                                     .order_by('data', 'adm', '-dimension')\
+                                                                     .distinct('data', 'adm')\
+                                                                     .values_list('data_id', 'adm__code', 'value')
+        for data_id, adm_code, value in latest_values:
+            by_id[data_id]['values'][adm_code] = value
+        return administrative_data, risk_analysis_mapping
+
     def get(self, request, *args, **kwargs):        
         event = self.get_event(**kwargs)
         #location = self.get_location_exact(event.iso2)
         #retrieve data about nuts2 which are not in AdministrativeDivision models 
-        nuts3_adm_divs = AdministrativeDivision.objects.filter(level=2, code__in=event.nuts3.split(';'))
+        nuts3_adm_divs = event.administrative_divisions.filter(level=2)
         nuts3_ids = nuts3_adm_divs.values_list('id', flat=True)                   
+        nuts3_codes = list(nuts3_adm_divs.order_by('code').values_list('code', flat=True))
         nuts2_codes = AdministrativeDivisionMappings.objects.filter(child__pk__in=nuts3_ids).order_by('code').values_list('code', flat=True).distinct()
         nuts3_in_nuts2 = list(AdministrativeDivisionMappings.objects.filter(code__in=nuts2_codes).values_list('child__code', flat=True))
         #locations = self.get_location_range(event.nuts3.split(';') + [event.iso2])
@@ -980,23 +1310,7 @@ class EventDetailsView(DataExtractionView):
         if an_group and event:
             
             #administrative data
-            administrative_data = {}            
-            risk_analysis_mapping = {}
-            adm_data_entries = AdministrativeData.objects.all()
-            location_adm_data = AdministrativeDivisionDataAssociation.objects.filter(adm__in=locations)            
-            
-            for adm_data_entry in adm_data_entries:                 
-                ra_match = RiskAnalysis.objects.filter(hazard_type=hazard_type, region=risk_analysis.region, analysis_type__name__contains=adm_data_entry.indicator_type).first()
-                if ra_match:
-                    risk_analysis_mapping[adm_data_entry.name] = ra_match.analysis_type.name
-                administrative_data[adm_data_entry.name] = {
-                        'unitOfMeasure': adm_data_entry.unit_of_measure,
-                        'values': {}
-                }
-                for location in locations:
-                    data_exact = location_adm_data.filter(data=adm_data_entry, adm=location).order_by('-dimension').first()                                        
-                    if data_exact:   
-                        administrative_data[adm_data_entry.name]['values'][data_exact.adm.code] = data_exact.value
+            (administrative_data, risk_analysis_mapping,) = self.get_administrative_data(hazard_type, risk_analysis.region, locations)
 
             overview = {                
                 'event': event.get_event_plain(),
@@ -1005,6 +1319,9 @@ class EventDetailsView(DataExtractionView):
                 'threshold': 1.5
             }
 
+            # fetch values for all analysis bound to current event at once
+            an_group = list(an_group)
+            event_queries = []
             for an_event in an_group:                
                 adjusted_kwargs = {
                     'loc': event.iso2,                    
@@ -1013,10 +1330,15 @@ class EventDetailsView(DataExtractionView):
                     'an': an_event.name
                 }            
                 feat_kwargs = self.url_kwargs_to_query_params(**adjusted_kwargs)
-                features = self.get_features_base('geonode:risk_analysis_event_details', None, **feat_kwargs)                
+                event_queries.append(('geonode:risk_analysis_event_details', None, feat_kwargs,))
+            event_features = self.get_features_base_many(event_queries)
+
+            risk_queries = []
+            risk_targets = []
+            for an_event, features in zip(an_group, event_features):
                 dymlist = an_event.dymension_infos.all().distinct()
                 dimension = dymlist.filter(riskanalysis_associacion__axis=self.AXIS_X).distinct().get()                
-                an_event_values = self.reformat_features(an_event, dimension, dymlist, features['features'], True)  
+                an_event_values = self.reformat_features(an_event, dimension, dymlist, features, True)  
                 data['{}'.format(an_event.analysis_type.name)] = an_event_values
                 data['{}'.format(an_event.analysis_type.name)]['riskAnalysis'] = an_event.get_risk_details()
 
@@ -1027,23 +1349,32 @@ class EventDetailsView(DataExtractionView):
                 
                 #for every match, retrieve sum of values of administrative divisions affected
                 for an_risk in matching_ra:
-                    adjusted_kwargs['an'] = an_risk.name
-                    adjusted_kwargs['loc'] = event.nuts3.replace(';', '__')
-                    feat_kwargs = self.url_kwargs_to_query_params(**self.removekey(adjusted_kwargs, 'evt'))
-                    features = self.get_features_base('geonode:risk_analysis_grouped_values', None, **feat_kwargs)
-
-                    dymlist = an_risk.dymension_infos.all().distinct()
-                    if kwargs.get('dym'):
-                        dimension = dymlist.get(id=kwargs['dym'])
-                    else:
-                        dimension = dymlist.filter(riskanalysis_associacion__axis=self.AXIS_X).distinct().get()                    
-
-                    an_risk_values = self.reformat_features(an_risk, dimension, dymlist, features['features'], True)                
-
-                    merged_values = an_event_values['values'] + an_risk_values['values']
-                    data['{}'.format(an_event.analysis_type.name)]['values'] = merged_values # [[str(item).capitalize() for item in row] for row in merged_values]
+                    adjusted_kwargs = {
+                        'loc': '__'.join(nuts3_codes),
+                        'ht': kwargs['ht'],
+                        'an': an_risk.name
+                    }
+                    feat_kwargs = self.url_kwargs_to_query_params(**adjusted_kwargs)
+                    risk_queries.append(('geonode:risk_analysis_grouped_values', None, feat_kwargs,))
+                    risk_targets.append((an_event_values, an_risk,))
+            risk_features = self.get_features_base_many(risk_queries)
+
+            # merge in the same order as matches were found
+            for (an_event_values, an_risk,), features in zip(risk_targets, risk_features):
+                dymlist = an_risk.dymension_infos.all().distinct()
+                if kwargs.get('dym'):
+                    dimension = dymlist.get(id=kwargs['dym'])
+                else:
+                    dimension = dymlist.filter(riskanalysis_associacion__axis=self.AXIS_X).distinct().get()                    
+
+                an_risk_values = self.reformat_features(an_risk, dimension, dymlist, features, True)                
+
+                # values of every matching risk analysis are appended, as
+                # data[] entry and an_event_values are the same dict
+                merged_values = an_event_values['values'] + an_risk_values['values']
+                an_event_values['values'] = merged_values # [[str(item).capitalize() for item in row] for row in merged_values]
                    
-        return json_response({ 'data': data, 'overview': overview })
+        return self.values_response(request, { 'data': data, 'overview': overview }, data.values())
 
 
 class CostBenefitAnalysisView(HazardTypeView):
@@ -1374,13 +1705,24 @@ class TestView(ContextAware, View):
         return json_response({'apps': app_array})                            
 
 CACHE_TTL = 120
-location_view = cache_page(CACHE_TTL)(LocationView.as_view()) 
-hazard_type_view = cache_page(CACHE_TTL)(HazardTypeView.as_view())
-analysis_type_view = cache_page(CACHE_TTL)(HazardTypeView.as_view())
-data_extraction = cache_page(CACHE_TTL)(DataExtractionView.as_view())
-event_view = cache_page(CACHE_TTL)(EventView.as_view())
-event_details_view = cache_page(CACHE_TTL)(EventDetailsView.as_view())
-adm_lookup_view = cache_page(CACHE_TTL)(AdmLookupView.as_view())
+# data views are invalidated by imports, so they can be cached for long
+DATA_CACHE_TTL = getattr(settings, 'RISKS_DATA_CACHE_TTL', 86400)
+
+
+def data_view(view):
+    return conditional_data_view(versioned_cache_page(DATA_CACHE_TTL)(view))
+
+
+location_view = data_view(LocationView.as_view()) 
+hazard_type_view = data_view(HazardTypeView.as_view())
+analysis_type_view = data_view(HazardTypeView.as_view())
+data_extraction = data_view(DataExtractionView.as_view())
+event_view = data_view(EventView.as_view())
+event_details_view = data_view(EventDetailsView.as_view())
+event_list_view = data_view(EventListView.as_view())
+event_summary_view = data_view(EventSummaryView.as_view())
+adm_lookup_view = data_view(AdmLookupView.as_view())
+reverse_geocode_view = data_view(ReverseGeocodeView.as_view())
 auth_view = cache_page(CACHE_TTL)(AuthorizationView.as_view())
 apps_view = cache_page(CACHE_TTL)(TestView.as_view())
 